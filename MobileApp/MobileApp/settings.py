@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -31,6 +32,7 @@ ALLOWED_HOSTS = ["127.0.0.1", "localhost"]
 # Application definition
 
 INSTALLED_APPS = [
+    'daphne',  # runserver serves ASGI too, for the live slot streams
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
@@ -81,6 +83,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'MobileApp.wsgi.application'
+ASGI_APPLICATION = 'MobileApp.asgi.application'
 
 
 # Database
@@ -93,6 +96,32 @@ DATABASES = {
     }
 }
 
+# Set POSTGRES_DB (plus POSTGRES_USER, _PASSWORD, _HOST, _PORT) to run on
+# PostgreSQL, e.g. for the query-plan tests in core/tests.py
+if os.environ.get('POSTGRES_DB'):
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ['POSTGRES_DB'],
+        'USER': os.environ.get('POSTGRES_USER', ''),
+        'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+        'HOST': os.environ.get('POSTGRES_HOST', ''),
+        'PORT': os.environ.get('POSTGRES_PORT', ''),
+    }
+
+# Cache
+# Availability, doctor-day and count entries are invalidated by writing to
+# the cache, so every process serving requests must share it. Set
+# REDIS_URL (e.g. redis://localhost:6379/0) in production;
+# `manage.py check --deploy` fails on the per-process default, which is
+# only correct for a single runserver.
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
@@ -131,8 +160,77 @@ USE_TZ = True
 STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
-import os
 
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
 
+
+
+# Appointment slots
+# "materialized": every bookable slot is a TimeSlot row
+# "virtual": free slots are computed from the schedule; rows are only
+#            written when a slot is booked
+SLOT_AVAILABILITY_MODE = "materialized"
+
+# Seconds a per-(doctor, date) availability entry may live in the cache.
+# Bookings, cancellations and slot edits invalidate entries immediately,
+# in every worker as long as the cache is shared (see CACHES above).
+AVAILABILITY_CACHE_TIMEOUT = 300
+
+# Days ahead kept filled by `manage.py create_default_slots`
+# (materialized mode only)
+SLOT_HORIZON_DAYS = 14
+
+# How far ahead a slot can be booked, recurring bookings included; ids
+# of template slots past it are refused
+BOOKING_HORIZON_DAYS = 182
+
+# Minutes an unpaid ONLINE booking keeps its slot
+SLOT_HOLD_MINUTES = 10
+
+# Idempotency-Key replay for the booking and payment APIs. A key whose
+# first request has run longer than the lock timeout (keep it above the
+# server's request timeout) is taken over by the next retry.
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60        # seconds
+IDEMPOTENCY_LOCK_TIMEOUT = 60             # seconds
+IDEMPOTENCY_MAX_RESPONSE_BYTES = 16 * 1024
+
+# Seconds a doctor's day view may be served from cache (0 disables).
+# Bookings, status changes and report uploads invalidate it immediately.
+DOCTOR_DAY_CACHE_TIMEOUT = 30
+
+# Live slot events (Server-Sent Events). Deploy with
+# `daphne -b 0.0.0.0 -p 8000 MobileApp.asgi:application` so idle streams
+# don't hold threads; behind WSGI the browser polls instead.
+SSE_POLL_INTERVAL = 0.5          # seconds between SlotEvent polls per worker
+SSE_KEEPALIVE_SECONDS = 15
+SSE_MAX_STREAM_SECONDS = 300     # browsers reconnect with Last-Event-ID
+SSE_RETRY_MS = 3000
+SSE_POLL_FALLBACK_MS = 5000      # poll interval when served over WSGI
+SSE_QUEUE_SIZE = 100             # events buffered per slow subscriber
+SLOT_EVENT_RETENTION = 600       # seconds of events kept for replay
+
+# Report uploads, enforced by appointments.uploads.ReportUploadHandler
+# while the request body streams in
+REPORT_UPLOAD_MAX_FILE_SIZE = 25 * 2**20
+REPORT_UPLOAD_MAX_REQUEST_SIZE = 250 * 2**20
+REPORT_UPLOAD_MAX_FILES = 10
+
+# Report previews (appointments.previews): longest side in pixels, threads
+# per process building them after uploads (0 = inline, on commit),
+# seconds allowed for rendering a PDF's first page, and the largest image
+# (width x height, after JPEG draft scaling) decoded for a thumbnail.
+# Image previews use Pillow (requirements.txt); PDF previews need the
+# optional poppler-utils system package for pdftoppm.
+REPORT_PREVIEW_SIZE = 480
+REPORT_PREVIEW_WORKERS = 2
+REPORT_PREVIEW_TIMEOUT = 30
+REPORT_PREVIEW_MAX_PIXELS = 25_000_000
+
+# Protected media (core.media.serve_file). After a view's access check
+# the transfer is handed to the front-end server: "x-accel-redirect"
+# for nginx, with an `internal` location at PROTECTED_MEDIA_INTERNAL_URL
+# aliased to MEDIA_ROOT, or "x-sendfile" for Apache mod_xsendfile /
+# lighttpd. Unset, Django streams the file itself.
+PROTECTED_MEDIA_SERVER = os.environ.get("PROTECTED_MEDIA_SERVER") or None
+PROTECTED_MEDIA_INTERNAL_URL = "/protected-media/"
@@ -1,7 +1,5 @@
 from django.contrib import admin
 from django.urls import path, include
-from django.conf import settings
-from django.conf.urls.static import static
 
 urlpatterns = [
     # Core (home, post-login redirect)
@@ -25,8 +23,5 @@ urlpatterns = [
     path("training/", include("training.urls")),
 ]
 
-
-urlpatterns += static(
-    settings.MEDIA_URL,
-    document_root=settings.MEDIA_ROOT
-)
\ No newline at end of file
+# MEDIA_URL is not served: reports go through appointments:report_file,
+# which checks access first (see core.media)
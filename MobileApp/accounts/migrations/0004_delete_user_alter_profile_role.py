@@ -7,6 +7,7 @@ class Migration(migrations.Migration):
 
     dependencies = [
         ('accounts', '0003_profile'),
+        ('appointments', '0003_alter_appointment_user'),
     ]
 
     operations = [
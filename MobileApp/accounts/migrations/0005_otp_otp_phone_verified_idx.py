@@ -0,0 +1,17 @@
+# Generated by Django 6.0 on 2026-10-18 22:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_delete_user_alter_profile_role'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='otp',
+            index=models.Index(fields=['phone_number', 'is_verified'], name='otp_phone_verified_idx'),
+        ),
+    ]
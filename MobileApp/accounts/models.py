@@ -26,6 +26,14 @@ class OTP(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     is_verified = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["phone_number", "is_verified"],
+                name="otp_phone_verified_idx",
+            ),
+        ]
+
     def is_expired(self):
         return timezone.now() > self.created_at + timedelta(minutes=5)
 
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import TimeSlot
+from .models import TimeSlot, WaitlistEntry
 
 @admin.register(TimeSlot)
 class TimeSlotAdmin(admin.ModelAdmin):
@@ -22,3 +22,31 @@ class TimeSlotAdmin(admin.ModelAdmin):
     )
 
     ordering = ("date", "start_time")
+
+
+@admin.register(WaitlistEntry)
+class WaitlistEntryAdmin(admin.ModelAdmin):
+    list_display = (
+        "doctor",
+        "date",
+        "user",
+        "priority",
+        "status",
+        "created_at",
+    )
+
+    list_filter = (
+        "status",
+        "date",
+    )
+
+    list_editable = (
+        "priority",
+    )
+
+    search_fields = (
+        "doctor__name",
+        "user__username",
+    )
+
+    raw_id_fields = ("doctor", "user", "appointment")
@@ -0,0 +1,593 @@
+import time as _time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Min, OuterRef, Q, Subquery
+from django.utils import timezone
+
+from dashboards.stats import bump_day_stats, count_new_days, refresh_day_stats
+from doctors.models import Doctor
+from doctors.schedule import get_schedule
+from .models import TimeSlot
+from .slots import build_day_slots, is_working_day, materialize_slots
+
+
+# ------------------------
+# MODES
+# ------------------------
+# "materialized": every bookable slot is a TimeSlot row (generated on demand)
+# "virtual":      free slots are computed from the schedule template; a row
+#                 is only written when a slot is booked
+MATERIALIZED = "materialized"
+VIRTUAL = "virtual"
+
+
+def is_virtual():
+    return settings.SLOT_AVAILABILITY_MODE == VIRTUAL
+
+
+# ------------------------
+# VIRTUAL SLOT IDS
+# ------------------------
+# Free template slots have no row yet, so they get a token id instead:
+#   v-<doctor_id>-<YYYYMMDD>-<HHMM>
+def slot_token(doctor_id, slot_date, start_time):
+    return f"v-{doctor_id}-{slot_date:%Y%m%d}-{start_time:%H%M}"
+
+
+def parse_slot_token(value):
+    if not isinstance(value, str) or not value.startswith("v-"):
+        return None
+
+    try:
+        _, doctor_id, day, start = value.split("-")
+        return (
+            int(doctor_id),
+            datetime.strptime(day, "%Y%m%d").date(),
+            datetime.strptime(start, "%H%M").time(),
+        )
+    except ValueError:
+        return None
+
+
+def slot_label(start_time, end_time):
+    return f"{start_time.strftime('%I:%M %p')} - {end_time.strftime('%I:%M %p')}"
+
+
+# ------------------------
+# FREE SLOTS
+# ------------------------
+def _overlaps(start, end, rows):
+    return any(r["start_time"] < end and r["end_time"] > start for r in rows)
+
+
+def free_q(now=None):
+    """Rows that can be booked: never taken, or held past their expiry."""
+    return Q(is_available=True) | Q(held_until__lt=now or timezone.now())
+
+
+def _is_free(row, now):
+    return row["is_available"] or (
+        row["held_until"] is not None and row["held_until"] < now
+    )
+
+
+def _free_rows(rows, now):
+    return [
+        {"id": r["id"], "start_time": r["start_time"], "end_time": r["end_time"]}
+        for r in rows if _is_free(r, now)
+    ]
+
+
+def merge_template(doctor, slot_date, rows, now=None):
+    """
+    Free rows of a doctor-day plus every template slot no row overlaps.
+    `rows` are that day's TimeSlot values (booked ones included).
+    """
+    slots = _free_rows(rows, now or timezone.now())
+
+    for s in build_day_slots(doctor, slot_date):
+        if not _overlaps(s.start_time, s.end_time, rows):
+            slots.append({
+                "id": slot_token(doctor.id, slot_date, s.start_time),
+                "start_time": s.start_time,
+                "end_time": s.end_time,
+            })
+
+    slots.sort(key=lambda s: s["start_time"])
+    return slots
+
+
+def free_slots(doctor, slot_date):
+    """
+    Free slots for one doctor-day, ordered by start time:
+    [{"id", "start_time", "end_time"}, ...]
+    """
+    if not is_working_day(doctor, slot_date):
+        return []
+
+    if is_virtual():
+        if slot_date < timezone.localdate():
+            return []
+
+        rows = list(TimeSlot.objects.filter(
+            doctor=doctor,
+            date=slot_date
+        ).values("id", "start_time", "end_time", "is_available", "held_until"))
+
+        return merge_template(doctor, slot_date, rows)
+
+    if not TimeSlot.objects.filter(doctor=doctor, date=slot_date).exists():
+        materialize_slots(doctor, slot_date)
+
+    return list(TimeSlot.objects.filter(
+        free_q(),
+        doctor=doctor,
+        date=slot_date
+    ).order_by("start_time").values("id", "start_time", "end_time"))
+
+
+def free_slots_for_range(doctors, start_date, end_date):
+    """
+    Free slots for several doctors over a date range in one query:
+    {doctor_id: {date: [slot, ...]}}, working days only.
+
+    Days that have no rows yet (not generated in materialized mode)
+    are filled from the template with virtual ids, so nothing is
+    written on read; resolve_slot_id() books those like any other.
+    """
+    start_date = max(start_date, timezone.localdate())
+    virtual = is_virtual()
+    now = timezone.now()
+
+    rows = defaultdict(list)
+    for row in TimeSlot.objects.filter(
+        doctor__in=doctors,
+        date__gte=start_date,
+        date__lte=end_date
+    ).order_by("start_time").values(
+        "id", "doctor_id", "date", "start_time", "end_time", "is_available", "held_until"
+    ):
+        rows[row["doctor_id"], row["date"]].append(row)
+
+    result = {}
+    for doctor in doctors:
+        days = result[doctor.id] = {}
+        day = start_date
+
+        while day <= end_date:
+            if is_working_day(doctor, day):
+                day_rows = rows.get((doctor.id, day), [])
+                if virtual or not day_rows:
+                    days[day] = merge_template(doctor, day, day_rows, now)
+                else:
+                    days[day] = _free_rows(day_rows, now)
+            day += timedelta(days=1)
+
+    return result
+
+
+# ------------------------
+# NEXT AVAILABLE
+# ------------------------
+# Free rows are read earliest first from the (doctor, date, is_available,
+# start_time) index with a LIMIT: the first `limit` overall, or the
+# first per doctor. Template slots are merged in from the compiled
+# schedule without queries: in materialized mode on the days that have
+# no rows yet (one more query finds those), in virtual mode on every
+# day, around the rows that exist (only booked slots have one).
+def horizon_end(days=None):
+    """Last day of a `days`-long window starting today (SLOT_HORIZON_DAYS)."""
+    return timezone.localdate() + timedelta(days=(days or settings.SLOT_HORIZON_DAYS) - 1)
+
+
+def _horizon(days=None):
+    """Dates from today to the end of the horizon."""
+    day = timezone.localdate()
+    end = horizon_end(days)
+    while day <= end:
+        yield day
+        day += timedelta(days=1)
+
+
+NEXT_FIELDS = ("id", "doctor_id", "date", "start_time", "end_time", "is_available", "held_until")
+
+
+def _upcoming_free_rows(now, end):
+    today = timezone.localdate()
+    return TimeSlot.objects.filter(
+        free_q(now),
+        date__gte=today,
+        date__lte=end
+    ).exclude(
+        date=today,
+        start_time__lte=timezone.localtime(now).time()
+    ).order_by("date", "start_time", "doctor_id").values(*NEXT_FIELDS)
+
+
+def _earliest_free_rows(doctors, now, end, limit):
+    """The first `limit` free rows across `doctors` that fall on working days."""
+    by_id = {doctor.id: doctor for doctor in doctors}
+    free = _upcoming_free_rows(now, end).filter(doctor__in=doctors)
+    rows = []
+    offset = 0
+    while len(rows) < limit:
+        page = list(free[offset:offset + limit])
+        # rows are left behind on days taken off after they were written
+        rows += [r for r in page if is_working_day(by_id[r["doctor_id"]], r["date"])]
+        if len(page) < limit:
+            break
+        offset += limit
+    return rows
+
+
+def _first_free_rows(doctors, now, end):
+    """Each doctor's first free row on a working day, in one query."""
+    by_id = {doctor.id: doctor for doctor in doctors}
+    free = _upcoming_free_rows(now, end)
+    first = Doctor.objects.filter(id__in=by_id).annotate(
+        slot_id=Subquery(free.filter(doctor_id=OuterRef("pk")).values("id")[:1])
+    ).values("slot_id")
+
+    rows = []
+    for row in free.filter(id__in=first):
+        while row is not None and not is_working_day(by_id[row["doctor_id"]], row["date"]):
+            row = free.filter(doctor_id=row["doctor_id"], date__gt=row["date"]).first()
+        if row is not None:
+            rows.append(row)
+    return rows
+
+
+def _search_rows(doctors, now, end, limit=None):
+    """
+    (rows by doctor-day, doctor-days that have rows) for _day_slots():
+    every row in virtual mode; in materialized mode the earliest free
+    rows (`limit` overall, or the first per doctor) and the days that
+    have been written.
+    """
+    rows = defaultdict(list)
+    if is_virtual():
+        found = TimeSlot.objects.filter(
+            doctor__in=doctors,
+            date__gte=timezone.localdate(),
+            date__lte=end
+        ).values(*NEXT_FIELDS)
+        row_days = set()
+    else:
+        found = (
+            _first_free_rows(doctors, now, end) if limit is None
+            else _earliest_free_rows(doctors, now, end, limit)
+        )
+        row_days = set(TimeSlot.objects.filter(
+            doctor__in=doctors,
+            date__gte=timezone.localdate(),
+            date__lte=end
+        ).order_by().values_list("doctor_id", "date").distinct())
+
+    for row in found:
+        rows[row["doctor_id"], row["date"]].append(row)
+    return rows, row_days
+
+
+def _day_slots(doctor, day, rows, row_days, now):
+    """Free slots of a doctor-day that have not started, from _search_rows() data."""
+    if not is_working_day(doctor, day):
+        return []
+
+    key = (doctor.id, day)
+    if key in row_days:
+        slots = _free_rows(rows.get(key, []), now)
+    else:
+        slots = merge_template(doctor, day, rows.get(key, []), now)
+
+    if day == timezone.localdate():
+        cutoff = timezone.localtime(now).time()
+        slots = [s for s in slots if s["start_time"] > cutoff]
+    return slots
+
+
+def next_available(doctors, limit=5, days=None):
+    """
+    Earliest `limit` free slots across `doctors` within the horizon,
+    as (date, doctor, slot) tuples. One or two TimeSlot queries.
+    """
+    limit = max(limit, 0)
+    if not doctors or not limit:
+        return []
+
+    now = timezone.now()
+    rows, row_days = _search_rows(doctors, now, horizon_end(days), limit)
+
+    found = []
+    for day in _horizon(days):
+        if len(found) >= limit:
+            break
+        on_day = [
+            (s["start_time"], doctor.id, doctor, s)
+            for doctor in doctors
+            for s in _day_slots(doctor, day, rows, row_days, now)
+        ]
+        on_day.sort(key=lambda item: item[:2])
+        found += [(day, doctor, s) for _, _, doctor, s in on_day]
+    return found[:limit]
+
+
+def next_slot_by_doctor(doctors, days=None):
+    """
+    {doctor_id: (date, slot)} with each doctor's earliest free slot.
+    One or two TimeSlot queries for the whole list.
+    """
+    if not doctors:
+        return {}
+
+    now = timezone.now()
+    rows, row_days = _search_rows(doctors, now, horizon_end(days))
+
+    first = {}
+    for doctor in doctors:
+        for day in _horizon(days):
+            slots = _day_slots(doctor, day, rows, row_days, now)
+            if slots:
+                first[doctor.id] = (day, slots[0])
+                break
+    return first
+
+
+def _bookable_date(slot_date):
+    return timezone.localdate() <= slot_date <= horizon_end(settings.BOOKING_HORIZON_DAYS)
+
+
+def _match_token(doctor, slot_date, start_time, day_rows):
+    """
+    What a virtual token names, given every row of its doctor-day:
+    (row id, None) if a row starts at that time, (None, template slot)
+    if a row may be written for it, or (None, None).
+
+    Existing rows come first, so tokens also find manually added slots.
+    A materialized day that has rows is complete: nothing is added to
+    it, and a slot deleted from it stays deleted.
+    """
+    for row in day_rows:
+        if row["start_time"] == start_time:
+            return row["id"], None
+
+    if day_rows and not is_virtual():
+        return None, None
+
+    for slot in build_day_slots(doctor, slot_date):
+        if slot.start_time == start_time:
+            # a manually added slot may already cover this time
+            if _overlaps(slot.start_time, slot.end_time, day_rows):
+                return None, None
+            return None, slot
+    return None, None
+
+
+def resolve_slot_id(slot_id):
+    """
+    Turn a slot id from the client into a TimeSlot primary key.
+
+    Real ids pass through unchanged. A virtual token is matched against
+    the day's rows, then the doctor's template; a template slot's row is
+    created on first booking, and the (doctor, date, start_time)
+    constraint makes that safe under races. Returns None if the token
+    doesn't name a bookable slot within BOOKING_HORIZON_DAYS.
+    """
+    parsed = parse_slot_token(slot_id)
+    if parsed is None:
+        return slot_id
+
+    doctor_id, slot_date, start_time = parsed
+
+    if not _bookable_date(slot_date):
+        return None
+
+    doctor = Doctor.objects.filter(id=doctor_id, is_active=True).first()
+    if doctor is None:
+        return None
+
+    day_rows = list(TimeSlot.objects.filter(
+        doctor=doctor,
+        date=slot_date
+    ).values("id", "start_time", "end_time"))
+
+    row_id, slot = _match_token(doctor, slot_date, start_time, day_rows)
+    if slot is None:
+        return row_id
+
+    if not is_virtual():
+        # materialized days are all-or-nothing: write the whole day, not one slot
+        materialize_slots(doctor, slot_date)
+        return TimeSlot.objects.filter(
+            doctor=doctor,
+            date=slot_date,
+            start_time=start_time
+        ).values_list("id", flat=True).first()
+
+    with transaction.atomic():
+        row, created = TimeSlot.objects.get_or_create(
+            doctor=doctor,
+            date=slot_date,
+            start_time=start_time,
+            defaults={"end_time": slot.end_time, "is_available": True}
+        )
+        if created:
+            bump_day_stats({(doctor.id, slot_date): {"slots": 1, "free": 1}})
+    return row.id
+
+
+def resolve_slot_ids(values):
+    """
+    Batch version of resolve_slot_id(): {value: TimeSlot id or None}.
+
+    Uses a bounded number of queries however many values are passed.
+    Tokens are matched like resolve_slot_id(); template slots that have
+    no row yet are written with one bulk insert (whole days in
+    materialized mode, just the slots in virtual mode).
+    """
+    resolved = {}
+    tokens = {}
+
+    for value in values:
+        parsed = parse_slot_token(value)
+        if parsed is not None:
+            tokens[value] = parsed
+            continue
+        try:
+            resolved[value] = int(value)
+        except (TypeError, ValueError):
+            resolved[value] = None
+
+    if not tokens:
+        return resolved
+
+    doctors = Doctor.objects.in_bulk(
+        {doctor_id for doctor_id, _, _ in tokens.values()}
+    )
+    dates = {slot_date for _, slot_date, _ in tokens.values()}
+
+    rows = defaultdict(list)
+    for row in TimeSlot.objects.filter(
+        doctor_id__in=list(doctors),
+        date__in=dates
+    ).values("id", "doctor_id", "date", "start_time", "end_time"):
+        rows[row["doctor_id"], row["date"]].append(row)
+
+    wanted = {}
+    new_rows = {}
+    new_days = {}
+    for value, (doctor_id, slot_date, start_time) in tokens.items():
+        resolved[value] = None
+        doctor = doctors.get(doctor_id)
+        if doctor is None or not doctor.is_active or not _bookable_date(slot_date):
+            continue
+
+        row_id, slot = _match_token(
+            doctor, slot_date, start_time, rows.get((doctor_id, slot_date), [])
+        )
+        if slot is None:
+            resolved[value] = row_id
+            continue
+
+        wanted[value] = (doctor_id, slot_date, start_time)
+        if is_virtual():
+            new_rows[doctor_id, slot_date, start_time] = slot
+        elif (doctor_id, slot_date) not in new_days:
+            # materialized days are all-or-nothing, and this one has no rows
+            template = build_day_slots(doctor, slot_date)
+            new_days[doctor_id, slot_date] = len(template)
+            for s in template:
+                new_rows[doctor_id, slot_date, s.start_time] = s
+
+    if not wanted:
+        return resolved
+
+    with transaction.atomic():
+        TimeSlot.objects.bulk_create(new_rows.values(), ignore_conflicts=True)
+        if is_virtual():
+            # single slots may race another booking of the day: recount
+            refresh_day_stats({(doctor_id, slot_date) for doctor_id, slot_date, _ in new_rows})
+        else:
+            count_new_days(new_days)
+
+    ids = {
+        (doctor_id, slot_date, start_time): slot_id
+        for slot_id, doctor_id, slot_date, start_time in TimeSlot.objects.filter(
+            doctor_id__in={k[0] for k in wanted.values()},
+            date__in={k[1] for k in wanted.values()},
+            start_time__in={k[2] for k in wanted.values()}
+        ).values_list("id", "doctor_id", "date", "start_time")
+    }
+    for value, key in wanted.items():
+        resolved[value] = ids.get(key)
+
+    return resolved
+
+
+# ------------------------
+# AVAILABILITY CACHE
+# ------------------------
+# Entries are keyed by a per-(doctor, date) version token. Writers bump
+# the token after commit instead of deleting the entry, so a read that
+# raced with a booking can only store its (stale) result under a token
+# nobody will ask for again. Tokens only reach other workers through a
+# shared cache backend (REDIS_URL, enforced by core.checks on deploy).
+STATS_KEYS = {
+    "hits": "availability:hits",
+    "misses": "availability:misses",
+}
+
+
+def _version_key(doctor_id, slot_date):
+    return f"availability:version:{doctor_id}:{slot_date:%Y%m%d}"
+
+
+def _count(name):
+    key = STATS_KEYS[name]
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key)
+
+
+def availability_version(doctor_id, slot_date):
+    """Token that changes whenever the doctor-day's slots do."""
+    version_key = _version_key(doctor_id, slot_date)
+    version = cache.get(version_key)
+    if version is None:
+        cache.add(version_key, _time.time_ns(), settings.AVAILABILITY_CACHE_TIMEOUT)
+        version = cache.get(version_key)
+    return version
+
+
+def cached_free_slots(doctor, slot_date):
+    version = availability_version(doctor.id, slot_date)
+
+    # schedule edits change availability for every day at once
+    key = f"availability:{doctor.id}:{slot_date:%Y%m%d}:{get_schedule().version}:{version}"
+
+    slots = cache.get(key)
+    if slots is not None:
+        _count("hits")
+        return slots
+
+    _count("misses")
+    slots = free_slots(doctor, slot_date)
+    cache.set(key, slots, _cache_timeout(doctor, slot_date))
+    return slots
+
+
+def _cache_timeout(doctor, slot_date):
+    # a hold expiring frees its slot without any write to invalidate
+    # on, so the entry must not outlive the day's next expiry
+    timeout = settings.AVAILABILITY_CACHE_TIMEOUT
+    now = timezone.now()
+
+    next_expiry = TimeSlot.objects.filter(
+        doctor=doctor,
+        date=slot_date,
+        held_until__gt=now
+    ).aggregate(first=Min("held_until"))["first"]
+
+    if next_expiry is not None:
+        timeout = min(timeout, int((next_expiry - now).total_seconds()) + 1)
+    return timeout
+
+
+def invalidate_availability(doctor_id, slot_date):
+    version_key = _version_key(doctor_id, slot_date)
+    transaction.on_commit(
+        lambda: cache.set(
+            version_key, _time.time_ns(), settings.AVAILABILITY_CACHE_TIMEOUT
+        )
+    )
+
+
+def availability_cache_stats():
+    hits = cache.get(STATS_KEYS["hits"], 0)
+    misses = cache.get(STATS_KEYS["misses"], 0)
+    return {"hits": hits, "misses": misses}
@@ -0,0 +1,82 @@
+# Reference counting for content-addressed report files.
+#
+# Every AppointmentReport holds one reference on its ReportBlob.
+# acquire_blobs() moves freshly uploaded files to their content address
+# and takes references; deleting a report (directly or by cascade)
+# drops one through the post_delete signal, and once that commits a
+# blob left with no references is unlinked. Both sides work under the
+# blob's row lock, so an upload of the same bytes either keeps the blob
+# alive or finds it gone and puts its own copy in place.
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import F
+
+from .models import AppointmentReport, ReportBlob
+
+
+def _storage():
+    return AppointmentReport._meta.get_field("file").storage
+
+
+def _directory():
+    return AppointmentReport._meta.get_field("file").upload_to.rstrip("/")
+
+
+def acquire_blobs(uploads):
+    """
+    Take one reference per StoredReport and return {sha256: ReportBlob}.
+    Files whose content is already stored are left where they are, for
+    the upload handler to discard. Call inside the transaction that
+    creates the reports.
+    """
+    storage = _storage()
+    counts = Counter(upload.sha256 for upload in uploads)
+    first = {}
+    for upload in uploads:
+        first.setdefault(upload.sha256, upload)
+
+    with transaction.atomic():
+        while True:
+            ReportBlob.objects.bulk_create([
+                ReportBlob(
+                    sha256=sha256,
+                    name=storage.blob_name(_directory(), sha256, upload.suffix),
+                    size=upload.size
+                )
+                for sha256, upload in first.items()
+            ], ignore_conflicts=True)
+            blobs = {
+                blob.sha256: blob
+                for blob in ReportBlob.objects.select_for_update().filter(sha256__in=counts)
+            }
+            if len(blobs) == len(counts):
+                break
+            # collected between our insert and lock; insert again
+
+        for sha256, blob in blobs.items():
+            if not storage.exists(blob.name):
+                storage.adopt(first[sha256].name, blob.name)
+            blob.refcount += counts[sha256]
+        ReportBlob.objects.bulk_update(blobs.values(), ["refcount"])
+
+    return blobs
+
+
+def release_blobs(blob_ids):
+    """Drop one reference per id; unreferenced blobs go once this commits."""
+    counts = Counter(blob_ids)
+    for blob_id, n in counts.items():
+        ReportBlob.objects.filter(id=blob_id).update(refcount=F("refcount") - n)
+    transaction.on_commit(lambda: collect_blobs(counts))
+
+
+def collect_blobs(blob_ids):
+    """Unlink and forget the given blobs if nothing references them."""
+    storage = _storage()
+    with transaction.atomic():
+        for blob in ReportBlob.objects.select_for_update().filter(id__in=blob_ids, refcount=0):
+            storage.delete(blob.name)
+            if blob.preview:
+                storage.delete(blob.preview)
+            blob.delete()
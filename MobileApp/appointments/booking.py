@@ -0,0 +1,520 @@
+import random
+import time
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import OperationalError, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from dashboards.stats import bump_day_stats
+from doctors.models import Doctor
+from .availability import (
+    free_q,
+    invalidate_availability,
+    resolve_slot_id,
+    resolve_slot_ids,
+)
+from .live import record_slot_events
+from .models import Appointment, TimeSlot, WaitlistEntry
+
+
+LOCK_RETRIES = 20
+PROMOTION_BATCH = 5
+
+
+class SlotUnavailable(Exception):
+    """The slot does not exist or somebody else booked it first."""
+
+
+class HoldExpired(Exception):
+    """The payment hold lapsed and the slot was released or rebooked."""
+
+
+class MixedDoctors(ValueError):
+    """A batch booking named slots of more than one doctor."""
+
+
+# ------------------------
+# BOOKING ENGINE
+# ------------------------
+def book_slot(slot_id, consultation_type="ONLINE", user=None, booked_by_staff=None):
+    """
+    Claim a slot and create its appointment in one transaction.
+
+    The claim is a single conditional UPDATE (is_available True -> False).
+    The database serializes concurrent UPDATEs of the same row on both
+    SQLite and PostgreSQL, so exactly one caller sees an affected row;
+    everyone else gets SlotUnavailable. No SELECT ... FOR UPDATE needed.
+
+    ONLINE bookings only hold the slot for SLOT_HOLD_MINUTES until paid
+    (see confirm_hold). An expired hold is claimable like a free slot,
+    by a second conditional UPDATE on held_until.
+    """
+    try:
+        slot_id = int(resolve_slot_id(slot_id))
+    except (TypeError, ValueError):
+        raise SlotUnavailable(slot_id)
+
+    return _retry_locked(_claim, slot_id, consultation_type, user, booked_by_staff)
+
+
+def _retry_locked(func, *args):
+    # SQLite reports write contention as "database is locked" instead of
+    # waiting; retry a few times when we own the transaction
+    retries = 0 if transaction.get_connection().in_atomic_block else LOCK_RETRIES
+
+    while True:
+        try:
+            return func(*args)
+        except OperationalError as e:
+            if retries == 0 or "locked" not in str(e):
+                raise
+            retries -= 1
+            time.sleep(random.uniform(0.005, 0.05))
+
+
+def _claim(slot_id, consultation_type, user, booked_by_staff):
+    now = timezone.now()
+    held_until = None
+    if consultation_type == "ONLINE":
+        held_until = now + timedelta(minutes=settings.SLOT_HOLD_MINUTES)
+
+    with transaction.atomic():
+        was_free = TimeSlot.objects.filter(
+            id=slot_id,
+            is_available=True
+        ).update(is_available=False, held_until=held_until)
+
+        if not was_free:
+            # an expired hold the sweeper hasn't released yet
+            claimed = TimeSlot.objects.filter(
+                id=slot_id,
+                held_until__lt=now
+            ).update(is_available=False, held_until=held_until)
+
+            if claimed != 1:
+                raise SlotUnavailable(slot_id)
+
+            _expire_appointments(Appointment.objects.filter(
+                slot_id=slot_id,
+                status="BOOKED",
+                hold_expires_at__lt=now
+            ))
+
+        slot = TimeSlot.objects.select_related("doctor").get(id=slot_id)
+
+        appointment = Appointment.objects.create(
+            user=user,
+            doctor=slot.doctor,
+            slot=slot,
+            booked_by_staff=booked_by_staff,
+            consultation_type=consultation_type,
+            amount=slot.doctor.consultation_fee or 0,
+            payment_status="PENDING",
+            status="BOOKED",
+            payment_mode="ONLINE" if consultation_type == "ONLINE" else "OFFLINE",
+            hold_expires_at=held_until
+        )
+
+        record_slot_events("TAKEN", [slot])
+        bump_day_stats({(slot.doctor_id, slot.date): {"booked": 1, "free": -was_free}})
+        invalidate_availability(slot.doctor_id, slot.date)
+
+    return appointment
+
+
+# ------------------------
+# BATCH BOOKING
+# ------------------------
+def book_slots(slot_ids, consultation_type="ONLINE", user=None,
+               booked_by_staff=None, partial=False):
+    """
+    Book several slots of one doctor in a single transaction.
+
+    Returns [(slot_id, appointment or None), ...] in input order. By
+    default it is all or nothing: if any slot can't be had, nothing is
+    booked and SlotUnavailable is raised with the failing ids. With
+    partial=True the free slots are booked and the rest come back None.
+
+    The query count doesn't depend on the batch size: the requested rows
+    are locked and read once, claimed with one UPDATE and their
+    appointments written with one bulk insert.
+    """
+    resolved = resolve_slot_ids(slot_ids)
+    return _retry_locked(
+        _claim_many, slot_ids, resolved, consultation_type,
+        user, booked_by_staff, partial
+    )
+
+
+def _claim_many(slot_ids, resolved, consultation_type, user, booked_by_staff, partial):
+    now = timezone.now()
+    held_until = None
+    if consultation_type == "ONLINE":
+        held_until = now + timedelta(minutes=settings.SLOT_HOLD_MINUTES)
+
+    ids = {i for i in resolved.values() if i is not None}
+
+    with transaction.atomic():
+        # FOR UPDATE on PostgreSQL; SQLite already serializes writers
+        rows = {
+            row["id"]: row
+            for row in TimeSlot.objects.select_for_update().filter(
+                id__in=ids
+            ).values(
+                "id", "doctor_id", "date", "start_time", "end_time",
+                "is_available", "held_until"
+            )
+        }
+
+        if len({row["doctor_id"] for row in rows.values()}) > 1:
+            raise MixedDoctors("A batch can only book one doctor's slots")
+
+        free = {
+            slot_id for slot_id, row in rows.items()
+            if row["is_available"] or (
+                row["held_until"] is not None and row["held_until"] < now
+            )
+        }
+
+        failed = [v for v in slot_ids if resolved[v] not in free]
+        if failed and not partial:
+            raise SlotUnavailable(failed)
+
+        if not free:
+            return [(v, None) for v in slot_ids]
+
+        claimed = TimeSlot.objects.filter(
+            free_q(now),
+            id__in=free
+        ).update(is_available=False, held_until=held_until)
+
+        if claimed != len(free):
+            raise SlotUnavailable(failed)
+
+        held = [slot_id for slot_id in free if not rows[slot_id]["is_available"]]
+        if held:
+            _expire_appointments(Appointment.objects.filter(
+                slot_id__in=held,
+                status="BOOKED",
+                hold_expires_at__lt=now
+            ))
+
+        # one fee lookup for the whole batch
+        doctor_id = next(iter(rows.values()))["doctor_id"]
+        fee = Doctor.objects.values_list("consultation_fee", flat=True).get(id=doctor_id)
+
+        slots = {
+            slot_id: TimeSlot(
+                id=slot_id,
+                doctor_id=doctor_id,
+                date=rows[slot_id]["date"],
+                start_time=rows[slot_id]["start_time"],
+                end_time=rows[slot_id]["end_time"],
+                is_available=False,
+                held_until=held_until
+            )
+            for slot_id in free
+        }
+        created = {
+            a.slot_id: a
+            for a in Appointment.objects.bulk_create([
+                Appointment(
+                    user=user,
+                    doctor_id=doctor_id,
+                    slot=slots[slot_id],
+                    date=slots[slot_id].date,
+                    starts_at=slots[slot_id].starts_at,
+                    ends_at=slots[slot_id].ends_at,
+                    booked_by_staff=booked_by_staff,
+                    consultation_type=consultation_type,
+                    amount=fee or 0,
+                    payment_status="PENDING",
+                    status="BOOKED",
+                    payment_mode="ONLINE" if consultation_type == "ONLINE" else "OFFLINE",
+                    hold_expires_at=held_until
+                )
+                for slot_id in sorted(free)
+            ])
+        }
+
+        record_slot_events("TAKEN", [a.slot for a in created.values()])
+
+        deltas = defaultdict(Counter)
+        for slot_id in free:
+            day = deltas[doctor_id, rows[slot_id]["date"]]
+            day["booked"] += 1
+            day["free"] -= rows[slot_id]["is_available"]
+        bump_day_stats(deltas)
+
+        for slot_date in {rows[slot_id]["date"] for slot_id in free}:
+            invalidate_availability(doctor_id, slot_date)
+
+    return [(v, created.get(resolved[v])) for v in slot_ids]
+
+
+# ------------------------
+# PAYMENT HOLDS
+# ------------------------
+def _expire_appointments(queryset):
+    expired = list(queryset.select_for_update(of=("self",)).values_list(
+        "id", "doctor_id", "date"
+    ))
+    if not expired:
+        return 0
+
+    Appointment.objects.filter(id__in=[i for i, _, _ in expired]).update(
+        status="CANCELLED",
+        payment_status="FAILED",
+        hold_expires_at=None
+    )
+
+    days = Counter((doctor_id, day) for _, doctor_id, day in expired)
+    bump_day_stats({
+        pair: {"booked": -n, "cancelled": n} for pair, n in days.items()
+    })
+    return len(expired)
+
+
+def confirm_hold(appointment):
+    """
+    Turn the appointment's payment hold into a firm booking.
+
+    Call inside the transaction that records the payment. The slot row
+    still carrying this appointment's exact expiry proves nobody has
+    released or rebooked it, so a late payment is accepted as long as
+    the slot wasn't taken in the meantime. Raises HoldExpired otherwise.
+    """
+    if appointment.hold_expires_at is None:
+        if appointment.status != "BOOKED":
+            raise HoldExpired(appointment.id)
+        return
+
+    kept = TimeSlot.objects.filter(
+        id=appointment.slot_id,
+        held_until=appointment.hold_expires_at
+    ).update(held_until=None)
+
+    if kept != 1:
+        raise HoldExpired(appointment.id)
+
+    Appointment.objects.filter(id=appointment.id).update(hold_expires_at=None)
+    appointment.hold_expires_at = None
+
+
+def mark_paid(appointment, **fields):
+    """
+    Record the appointment as PAID and add its amount to the day's
+    revenue. Call inside the transaction that records the payment.
+    Returns False if it was already paid.
+    """
+    paid = Appointment.objects.filter(
+        id=appointment.id
+    ).exclude(payment_status="PAID").update(payment_status="PAID", **fields)
+
+    if not paid:
+        return False
+
+    appointment.payment_status = "PAID"
+    for name, value in fields.items():
+        setattr(appointment, name, value)
+
+    bump_day_stats({
+        (appointment.doctor_id, appointment.date): {"revenue": appointment.amount}
+    })
+    return True
+
+
+def release_expired_holds(batch_size=500, now=None):
+    """
+    Free slots whose payment hold lapsed and cancel their appointments.
+
+    Works in batches off the partial index on TimeSlot.held_until, so
+    only currently held slots are read, never the appointments table.
+    Returns the number of slots released.
+    """
+    now = now or timezone.now()
+    released = 0
+
+    while True:
+        with transaction.atomic():
+            batch = list(TimeSlot.objects.select_for_update().filter(
+                held_until__lt=now
+            ).order_by("held_until").values_list("id", "doctor_id", "date")[:batch_size])
+
+            if not batch:
+                break
+
+            ids = [slot_id for slot_id, _, _ in batch]
+
+            # re-checked per row: a slot paid for or rebooked since the
+            # SELECT no longer matches and is left alone
+            released += TimeSlot.objects.filter(
+                id__in=ids,
+                held_until__lt=now
+            ).update(is_available=True, held_until=None)
+
+            _expire_appointments(Appointment.objects.filter(
+                slot_id__in=ids,
+                status="BOOKED",
+                hold_expires_at__lt=now
+            ))
+
+            freed = list(TimeSlot.objects.filter(id__in=ids, is_available=True))
+            record_slot_events("FREED", freed)
+            bump_day_stats({
+                pair: {"free": n}
+                for pair, n in Counter((s.doctor_id, s.date) for s in freed).items()
+            })
+            _promote_released(freed)
+
+            for doctor_id, slot_date in {(d, day) for _, d, day in batch}:
+                invalidate_availability(doctor_id, slot_date)
+
+        if len(batch) < batch_size:
+            break
+
+    return released
+
+
+# ------------------------
+# CANCELLATION + WAITLIST
+# ------------------------
+def cancel_booking(appointment, upcoming_only=False):
+    """
+    Cancel a BOOKED appointment, free its slot and hand the slot to the
+    head of the doctor-day waitlist, all in one transaction.
+
+    The status change is a conditional UPDATE, so when the same
+    appointment is cancelled twice concurrently only one caller frees
+    the slot. With upcoming_only the UPDATE also requires that the slot
+    hasn't started (the patient rule). Returns False if nothing matched.
+    """
+    return _retry_locked(_cancel, appointment, upcoming_only)
+
+
+def _cancel(appointment, upcoming_only=False):
+    with transaction.atomic():
+        appointments = Appointment.objects.filter(id=appointment.id)
+        if upcoming_only:
+            appointments = appointments.cancellable()
+        else:
+            appointments = appointments.filter(status="BOOKED")
+
+        cancelled = appointments.update(status="CANCELLED", hold_expires_at=None)
+
+        if cancelled != 1:
+            return False
+
+        appointment.status = "CANCELLED"
+        appointment.hold_expires_at = None
+
+        freed = TimeSlot.objects.filter(
+            id=appointment.slot_id,
+            is_available=False
+        ).update(is_available=True, held_until=None)
+
+        slot = TimeSlot.objects.get(id=appointment.slot_id)
+        record_slot_events("FREED", [slot])
+        bump_day_stats({
+            (slot.doctor_id, slot.date): {"booked": -1, "cancelled": 1, "free": freed}
+        })
+        invalidate_availability(slot.doctor_id, slot.date)
+        promote_waitlist(slot)
+
+    return True
+
+
+def complete_booking(appointment):
+    """Mark a BOOKED appointment COMPLETED. Returns False if it wasn't BOOKED."""
+    with transaction.atomic():
+        completed = Appointment.objects.filter(
+            id=appointment.id,
+            status="BOOKED"
+        ).update(status="COMPLETED")
+
+        if completed != 1:
+            return False
+
+        appointment.status = "COMPLETED"
+        bump_day_stats({
+            (appointment.doctor_id, appointment.date): {"booked": -1, "completed": 1}
+        })
+
+    return True
+
+
+def _slot_started(slot):
+    return slot.starts_at <= timezone.now()
+
+
+def promote_waitlist(slot):
+    """
+    Book a just-freed slot for the first waiting patient of its
+    doctor-day (highest priority, then oldest). Must run inside the
+    transaction that freed the slot. Returns the new appointment or None.
+
+    Only the head of the queue is read (partial index on WAITING
+    entries), and each entry is claimed with a conditional UPDATE, so
+    concurrent cancellations on the same day promote different patients.
+    """
+    if _slot_started(slot):
+        return None
+
+    already_booked = Appointment.objects.filter(
+        user=OuterRef("user"),
+        doctor_id=slot.doctor_id,
+        date=slot.date,
+        status="BOOKED"
+    )
+
+    while True:
+        candidates = list(WaitlistEntry.objects.filter(
+            doctor_id=slot.doctor_id,
+            date=slot.date,
+            status="WAITING"
+        ).exclude(
+            Exists(already_booked)
+        ).select_related("user").order_by(
+            "-priority", "created_at", "id"
+        )[:PROMOTION_BATCH])
+
+        if not candidates:
+            return None
+
+        for entry in candidates:
+            try:
+                with transaction.atomic():
+                    taken = WaitlistEntry.objects.filter(
+                        id=entry.id,
+                        status="WAITING"
+                    ).update(status="PROMOTED")
+
+                    if taken != 1:
+                        continue
+
+                    appointment = _claim(slot.id, entry.consultation_type, entry.user, None)
+                    WaitlistEntry.objects.filter(id=entry.id).update(appointment=appointment)
+            except SlotUnavailable:
+                return None
+
+            return appointment
+
+
+def _promote_released(slots):
+    days = {(s.doctor_id, s.date) for s in slots}
+    if not days:
+        return
+
+    # most released days have nobody waiting; one query finds those that do
+    waiting = set(WaitlistEntry.objects.filter(
+        status="WAITING",
+        doctor_id__in={d for d, _ in days},
+        date__in={day for _, day in days}
+    ).values_list("doctor_id", "date").distinct())
+
+    for slot in slots:
+        if (slot.doctor_id, slot.date) in waiting:
+            promote_waitlist(slot)
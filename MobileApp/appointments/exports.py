@@ -0,0 +1,30 @@
+from pathlib import PurePosixPath
+
+from django.utils import timezone
+
+from core.media import serve_zip
+from .models import AppointmentReport
+
+
+def reports_zip(request, reports, filename):
+    """
+    Stream the given AppointmentReports as one ZIP, a folder per
+    appointment. Only the names are loaded up front: each file is read
+    while the archive is being sent.
+    """
+    storage = AppointmentReport._meta.get_field("file").storage
+    rows = reports.filter(blob__isnull=False).order_by(
+        "appointment__date", "appointment_id", "id"
+    ).values_list("id", "file", "uploaded_at", "appointment_id", "appointment__date")
+
+    entries = [
+        (
+            f"{day:%Y-%m-%d}-appointment-{appointment_id}/"
+            f"report-{report_id}{PurePosixPath(name).suffix.lower()}",
+            storage,
+            name,
+            timezone.localtime(uploaded_at),
+        )
+        for report_id, name, uploaded_at, appointment_id, day in rows
+    ]
+    return serve_zip(request, entries, filename)
@@ -0,0 +1,222 @@
+# Live availability over Server-Sent Events.
+#
+# Booking, cancellation and hold release append SlotEvent rows in the
+# same transaction as the change. Each ASGI worker runs one SlotEventHub
+# that tails the table with a single query per poll, however many
+# streams are open, and fans events out to per-connection asyncio
+# queues. An idle subscriber is just a queue and a suspended coroutine.
+# Needs an ASGI server (daphne, see settings): under WSGI the view falls
+# back to slot_event_poll(), and the browser's reconnects do the polling.
+import asyncio
+import json
+import logging
+import weakref
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections
+from django.utils import timezone
+
+from .availability import slot_label, slot_token
+from .models import SlotEvent
+
+
+logger = logging.getLogger(__name__)
+
+# All event queries of a worker, its hub and every stream's replay, share
+# one thread and so one DB connection; request threads never wait on them
+_db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="slot-events")
+
+
+def _db(func):
+    return sync_to_async(func, thread_sensitive=False, executor=_db_executor)
+
+
+# ------------------------
+# WRITING EVENTS
+# ------------------------
+def record_slot_events(kind, slots):
+    """Log TAKEN/FREED for TimeSlot instances; call inside the write's transaction."""
+    SlotEvent.objects.bulk_create([
+        SlotEvent(
+            doctor_id=slot.doctor_id,
+            date=slot.date,
+            slot_id=slot.id,
+            start_time=slot.start_time,
+            end_time=slot.end_time,
+            kind=kind,
+        )
+        for slot in slots
+    ])
+
+
+def _payload(event):
+    return {
+        "id": event.slot_id,
+        "token": slot_token(event.doctor_id, event.date, event.start_time),
+        "kind": event.kind.lower(),
+        "start_time": event.start_time.strftime("%H:%M"),
+        "label": slot_label(event.start_time, event.end_time),
+    }
+
+
+def _format(event):
+    return f"id: {event.id}\nevent: slot\ndata: {json.dumps(_payload(event))}\n\n"
+
+
+# ------------------------
+# HUB (one per event loop)
+# ------------------------
+class SlotEventHub:
+    def __init__(self):
+        self.channels = defaultdict(set)
+        self.last_id = None
+        self.task = None
+        self.last_prune = None
+
+    def subscribe(self, key):
+        queue = asyncio.Queue(maxsize=settings.SSE_QUEUE_SIZE)
+        self.channels[key].add(queue)
+        return queue
+
+    async def start(self):
+        """Poll from the current event on, if not already: await before streaming."""
+        if self.task is None or self.task.done():
+            last_id = await _db(_latest_event_id)()
+            if self.task is None or self.task.done():
+                self.last_id = last_id
+                self.task = asyncio.get_running_loop().create_task(self._run())
+
+    def unsubscribe(self, key, queue):
+        subscribers = self.channels.get(key)
+        if subscribers is not None:
+            subscribers.discard(queue)
+            if not subscribers:
+                del self.channels[key]
+
+    @property
+    def subscriber_count(self):
+        return sum(len(s) for s in self.channels.values())
+
+    async def _run(self):
+        while self.channels:
+            try:
+                await self._poll()
+            except DatabaseError:
+                # keep the open streams alive: try again next poll
+                logger.exception("Could not poll slot events")
+                await _db(close_old_connections)()
+            await asyncio.sleep(settings.SSE_POLL_INTERVAL)
+
+    async def _poll(self):
+        events = await _db(_events_after)(self.last_id)
+        for event in events:
+            self.last_id = event.id
+            key = (event.doctor_id, event.date)
+            for queue in list(self.channels.get(key, ())):
+                try:
+                    queue.put_nowait(event)
+                except asyncio.QueueFull:
+                    # too far behind: end the stream, the browser
+                    # reconnects with Last-Event-ID and catches up
+                    while not queue.empty():
+                        queue.get_nowait()
+                    queue.put_nowait(None)
+                    self.unsubscribe(key, queue)
+
+        await self._maybe_prune()
+
+    async def _maybe_prune(self):
+        now = timezone.now()
+        if self.last_prune and now - self.last_prune < timedelta(minutes=1):
+            return
+        self.last_prune = now
+        await _db(prune_slot_events)(now)
+
+
+def _latest_event_id():
+    return SlotEvent.objects.order_by("-id").values_list("id", flat=True).first() or 0
+
+
+def _events_after(last_id):
+    return list(SlotEvent.objects.filter(id__gt=last_id).order_by("id")[:1000])
+
+
+def prune_slot_events(now=None):
+    cutoff = (now or timezone.now()) - timedelta(seconds=settings.SLOT_EVENT_RETENTION)
+    return SlotEvent.objects.filter(created_at__lt=cutoff).delete()[0]
+
+
+_hubs = weakref.WeakKeyDictionary()
+
+
+def get_hub():
+    loop = asyncio.get_running_loop()
+    hub = _hubs.get(loop)
+    if hub is None:
+        hub = _hubs[loop] = SlotEventHub()
+    return hub
+
+
+# ------------------------
+# STREAM
+# ------------------------
+def _replay(doctor_id, day, last_event_id):
+    return list(SlotEvent.objects.filter(
+        doctor_id=doctor_id,
+        date=day,
+        id__gt=last_event_id
+    ).order_by("id"))
+
+
+async def slot_event_stream(doctor_id, day, last_event_id=None):
+    key = (doctor_id, day)
+    hub = get_hub()
+    queue = hub.subscribe(key)
+    loop = asyncio.get_running_loop()
+    closes_at = loop.time() + settings.SSE_MAX_STREAM_SECONDS
+    seen = 0
+
+    try:
+        await hub.start()
+        yield f"retry: {settings.SSE_RETRY_MS}\n\n"
+
+        if last_event_id is not None:
+            for event in await _db(_replay)(doctor_id, day, last_event_id):
+                seen = event.id
+                yield _format(event)
+
+        while True:
+            remaining = closes_at - loop.time()
+            if remaining <= 0:
+                return
+            try:
+                event = await asyncio.wait_for(
+                    queue.get(), min(settings.SSE_KEEPALIVE_SECONDS, remaining)
+                )
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+
+            if event is None:
+                return
+            if event.id > seen:
+                yield _format(event)
+    finally:
+        hub.unsubscribe(key, queue)
+
+
+def slot_event_poll(doctor_id, day, last_event_id=None):
+    """
+    The whole body of one short poll, for WSGI where a stream would tie
+    up a worker: the events since Last-Event-ID, or just the current id
+    to start from. EventSource reconnects after `retry` with the last id
+    it saw, so the browser polls without any client-side fallback.
+    """
+    body = f"retry: {settings.SSE_POLL_FALLBACK_MS}\n\n"
+    if last_event_id is None:
+        return body + f"id: {_latest_event_id()}\n\n"
+    return body + "".join(_format(event) for event in _replay(doctor_id, day, last_event_id))
@@ -0,0 +1,77 @@
+from datetime import datetime, time, timedelta
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from doctors.models import Doctor
+from appointments.models import TimeSlot
+from appointments.slots import materialize_slots
+
+
+# the old per-slot get_or_create loop, kept here for comparison
+WORKING_HOURS = [
+    (time(10, 0), time(12, 0)),
+    (time(13, 0), time(17, 0)),
+]
+SLOT_DURATION = timedelta(minutes=30)
+
+
+def legacy_generate(doctor, slot_date):
+    for start, end in WORKING_HOURS:
+        current = datetime.combine(slot_date, start)
+        end_dt = datetime.combine(slot_date, end)
+
+        while current < end_dt:
+            TimeSlot.objects.get_or_create(
+                doctor=doctor,
+                date=slot_date,
+                start_time=current.time(),
+                end_time=(current + SLOT_DURATION).time(),
+                defaults={"is_available": True}
+            )
+            current += SLOT_DURATION
+
+
+class Command(BaseCommand):
+    help = "Compare DB round-trips per doctor-day: get_or_create loop vs bulk materialization"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=5)
+
+    def handle(self, *args, **options):
+        doctors = list(Doctor.objects.filter(is_active=True))
+        if not doctors:
+            self.stderr.write("No active doctors to benchmark")
+            return
+
+        days = []
+        day = timezone.localdate() + timedelta(days=1)
+        while len(days) < options["days"]:
+            if day.weekday() < 5:
+                days.append(day)
+            day += timedelta(days=1)
+
+        for label, generate in (("before (get_or_create)", legacy_generate),
+                                ("after (bulk upsert)", materialize_slots)):
+            # run inside a transaction that is always rolled back
+            with transaction.atomic():
+                TimeSlot.objects.filter(doctor__in=doctors, date__in=days).delete()
+
+                with CaptureQueriesContext(connection) as ctx:
+                    started = perf_counter()
+                    for doctor in doctors:
+                        for slot_date in days:
+                            generate(doctor, slot_date)
+                    elapsed = perf_counter() - started
+
+                transaction.set_rollback(True)
+
+            doctor_days = len(doctors) * len(days)
+            self.stdout.write(
+                f"{label}: {len(ctx.captured_queries) / doctor_days:.1f} "
+                f"round-trips per doctor-day, "
+                f"{elapsed * 1000 / doctor_days:.2f} ms per doctor-day"
+            )
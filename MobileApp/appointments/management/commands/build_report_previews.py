@@ -0,0 +1,83 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from appointments.models import ReportBlob
+from appointments.previews import RENDERERS, build_previews, renderable_q
+
+
+# -------------------------
+# WORKER (runs in the pool)
+# -------------------------
+def _init_worker():
+    # forked children must not reuse the parent's DB connections
+    django.setup()
+    connections.close_all()
+
+
+# -------------------------
+# COMMAND
+# -------------------------
+class Command(BaseCommand):
+    help = "Build the missing previews of stored reports, in parallel batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers", type=int, default=min(4, os.cpu_count() or 1),
+            help="Size of the process pool (1 = run inline)"
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=50,
+            help="Reports handed to a worker at a time"
+        )
+        parser.add_argument(
+            "--retry-failed", action="store_true",
+            help="Try again on files a renderer failed on before"
+        )
+
+    def handle(self, *args, **options):
+        if not RENDERERS:
+            self.stdout.write("No renderers available: install Pillow and/or poppler-utils")
+            return
+
+        if options["retry_failed"]:
+            ReportBlob.objects.filter(preview_status="FAILED").update(preview_status="")
+
+        blob_ids = list(
+            ReportBlob.objects.filter(renderable_q(), preview="", preview_status="")
+            .order_by("id").values_list("id", flat=True)
+        )
+        if not blob_ids:
+            self.stdout.write("Nothing to do")
+            return
+
+        batch_size = options["batch_size"]
+        batches = [blob_ids[i:i + batch_size] for i in range(0, len(blob_ids), batch_size)]
+        workers = max(1, min(options["workers"], len(batches)))
+
+        started = perf_counter()
+
+        if workers == 1:
+            results = [build_previews(batch) for batch in batches]
+        else:
+            # children open their own connections
+            connections.close_all()
+            with ProcessPoolExecutor(workers, initializer=_init_worker) as pool:
+                results = list(pool.map(build_previews, batches))
+
+        elapsed = perf_counter() - started
+
+        built, skipped, failed = (sum(column) for column in zip(*results))
+        self.stdout.write(
+            f"{built} previews built for {len(blob_ids)} report files in {elapsed:.2f}s "
+            f"({built / elapsed if elapsed else 0:.1f}/sec, {workers} workers); "
+            f"{skipped} skipped, {failed} failed"
+        )
+        if failed:
+            self.stdout.write(self.style.WARNING("Run with --retry-failed to try failed previews again"))
+        else:
+            self.stdout.write(self.style.SUCCESS("✅ Report previews are up to date"))
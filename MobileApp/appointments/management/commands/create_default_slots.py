@@ -1,55 +1,160 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from time import perf_counter
+
+import django
+from django.conf import settings
 from django.core.management.base import BaseCommand
-from datetime import datetime, time, timedelta, date
+from django.db import connections, transaction
+from django.db.models import Count
+from django.utils import timezone
 
+from dashboards.stats import count_new_days, refresh_day_stats
 from doctors.models import Doctor
 from appointments.models import TimeSlot
-
-
+from appointments.slots import build_day_slots
+
+
+# -------------------------
+# WORKER (runs in the pool)
+# -------------------------
+def _init_worker():
+    # forked children must not reuse the parent's DB connections
+    django.setup()
+    connections.close_all()
+
+
+def _flush(batch, new_days, partial_days, batch_size):
+    """Write a batch of slots and count its days in the same transaction."""
+    with transaction.atomic():
+        TimeSlot.objects.bulk_create(
+            batch, batch_size=batch_size, ignore_conflicts=True
+        )
+        count_new_days(new_days)
+        # days that already had some rows: recount them
+        refresh_day_stats(partial_days)
+
+
+def fill_doctors(doctor_ids, days, batch_size):
+    """
+    Fill the horizon for a chunk of doctors.
+    Doctor-days that already have every scheduled slot are skipped.
+    """
+    existing = {
+        (doctor_id, day): n
+        for doctor_id, day, n in TimeSlot.objects.filter(
+            doctor_id__in=doctor_ids,
+            date__in=days,
+        ).values_list("doctor_id", "date").annotate(n=Count("id"))
+    }
+
+    created = 0
+    skipped = []
+    batch = []
+    new_days = {}
+    partial_days = set()
+
+    for doctor_id in doctor_ids:
+        doctor = Doctor(id=doctor_id)
+        doctor_created = 0
+
+        for day in days:
+            # days off come back empty from the compiled schedule
+            slots = build_day_slots(doctor, day)
+            have = existing.get((doctor_id, day), 0)
+            if have >= len(slots):
+                continue
+
+            batch.extend(slots)
+            doctor_created += len(slots) - have
+            if have:
+                partial_days.add((doctor_id, day))
+            else:
+                new_days[doctor_id, day] = len(slots)
+
+            if len(batch) >= batch_size:
+                _flush(batch, new_days, partial_days, batch_size)
+                batch = []
+                new_days = {}
+                partial_days = set()
+
+        if doctor_created:
+            created += doctor_created
+        else:
+            skipped.append(doctor_id)
+
+    if batch:
+        _flush(batch, new_days, partial_days, batch_size)
+
+    return created, skipped
+
+
+# -------------------------
+# COMMAND
+# -------------------------
 class Command(BaseCommand):
-    help = "Create default 30-min slots (10–12, 1–5) for all doctors"
-
-    def handle(self, *args, **kwargs):
-        today = date.today()
-
-        # Define slot ranges
-        morning_start = time(10, 0)
-        morning_end = time(12, 0)
-
-        afternoon_start = time(13, 0)
-        afternoon_end = time(17, 0)
-
-        slot_duration = timedelta(minutes=30)
-
-        doctors = Doctor.objects.filter(is_active=True)
-
-        for doctor in doctors:
-            self.stdout.write(f"Creating slots for {doctor.name}")
-
-            self.create_slots(
-                doctor, today,
-                morning_start, morning_end, slot_duration
-            )
-            self.create_slots(
-                doctor, today,
-                afternoon_start, afternoon_end, slot_duration
+    help = "Keep an N-day horizon of scheduled slots filled for all active doctors"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days", type=int, default=settings.SLOT_HORIZON_DAYS,
+            help="Horizon length in days, starting today"
+        )
+        parser.add_argument(
+            "--workers", type=int, default=min(4, os.cpu_count() or 1),
+            help="Size of the process pool (1 = run inline)"
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=500,
+            help="Slots written per transaction"
+        )
+
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+        days = [today + timedelta(days=i) for i in range(options["days"])]
+
+        doctors = dict(
+            Doctor.objects.filter(is_active=True).values_list("id", "name")
+        )
+        doctor_ids = sorted(doctors)
+
+        if not days or not doctor_ids:
+            self.stdout.write("Nothing to do")
+            return
+
+        workers = max(1, min(options["workers"], len(doctor_ids)))
+        batch_size = options["batch_size"]
+        chunks = [doctor_ids[i::workers] for i in range(workers)]
+
+        started = perf_counter()
+
+        if workers == 1:
+            results = [fill_doctors(doctor_ids, days, batch_size)]
+        else:
+            # children open their own connections
+            connections.close_all()
+            with ProcessPoolExecutor(workers, initializer=_init_worker) as pool:
+                results = list(pool.map(
+                    fill_doctors, chunks,
+                    [days] * workers, [batch_size] * workers
+                ))
+
+        elapsed = perf_counter() - started
+
+        created = sum(n for n, _ in results)
+        skipped = sorted(i for _, ids in results for i in ids)
+
+        self.stdout.write(
+            f"{created} slots created for {len(doctor_ids) - len(skipped)} doctors "
+            f"over {len(days)} days in {elapsed:.2f}s "
+            f"({created / elapsed if elapsed else 0:.0f} slots/sec, {workers} workers)"
+        )
+
+        if skipped:
+            self.stdout.write(
+                f"Skipped {len(skipped)} doctors with a complete horizon: "
+                + ", ".join(doctors[i] for i in skipped)
             )
 
         self.stdout.write(self.style.SUCCESS("✅ Default slots created successfully"))
-
-    def create_slots(self, doctor, slot_date, start_time, end_time, duration):
-        current = datetime.combine(slot_date, start_time)
-        end = datetime.combine(slot_date, end_time)
-
-        while current < end:
-            next_time = current + duration
-
-            TimeSlot.objects.get_or_create(
-                doctor=doctor,
-                date=slot_date,
-                start_time=current.time(),
-                end_time=next_time.time(),
-                defaults={"is_available": True}
-            )
-
-            current = next_time
-
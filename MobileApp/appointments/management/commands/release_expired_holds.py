@@ -0,0 +1,24 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+
+from appointments.booking import release_expired_holds
+
+
+class Command(BaseCommand):
+    help = "Release slots whose payment hold has expired (run every minute from cron)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=500,
+            help="Slots released per transaction"
+        )
+
+    def handle(self, *args, **options):
+        started = perf_counter()
+        released = release_expired_holds(batch_size=options["batch_size"])
+        elapsed = perf_counter() - started
+
+        self.stdout.write(
+            self.style.SUCCESS(f"✅ Released {released} expired holds in {elapsed:.2f}s")
+        )
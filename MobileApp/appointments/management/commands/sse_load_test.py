@@ -0,0 +1,178 @@
+import asyncio
+import resource
+import statistics
+import threading
+from datetime import datetime, time, timedelta
+from importlib import import_module
+from time import perf_counter
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+from django.urls import reverse
+from django.utils import timezone
+
+from doctors.models import Doctor
+from appointments.booking import book_slot, cancel_booking
+from appointments.live import get_hub
+from appointments.models import TimeSlot
+
+
+def _rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Command(BaseCommand):
+    help = (
+        "Hold N concurrent SSE subscribers on one in-process ASGI worker "
+        "and measure memory and fan-out latency"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--subscribers", type=int, default=2000)
+        parser.add_argument("--events", type=int, default=5, help="Bookings pushed to every subscriber")
+
+    def handle(self, *args, **options):
+        user = User.objects.create(username=f"sse-{timezone.now():%Y%m%d%H%M%S%f}")
+        doctor = Doctor.objects.create(
+            user=user,
+            name="SSE Load Test",
+            specialization="Load Test",
+            is_active=False,
+        )
+
+        session = import_module(settings.SESSION_ENGINE).SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.save()
+
+        day = timezone.localdate() + timedelta(days=365)
+        start = datetime.combine(day, time(0, 0))
+        TimeSlot.objects.bulk_create([
+            TimeSlot(
+                doctor=doctor,
+                date=day,
+                start_time=(start + timedelta(minutes=i)).time(),
+                end_time=(start + timedelta(minutes=i + 1)).time(),
+            )
+            for i in range(options["events"])
+        ])
+
+        try:
+            asyncio.run(self.run(doctor, user, day, session.session_key, options))
+        finally:
+            session.delete()
+            user.delete()  # cascades to doctor, slots, appointments, events
+
+    async def run(self, doctor, user, day, session_key, options):
+        application = get_asgi_application()
+        path = reverse("appointments:slot_events", args=[doctor.id])
+        cookie = f"{settings.SESSION_COOKIE_NAME}={session_key}".encode()
+
+        total = options["subscribers"]
+        connected = asyncio.Semaphore(0)
+        received = {}
+        waiter = {"count": 0, "done": None}
+        stop = asyncio.Event()
+
+        async def subscriber(i):
+            requested = False
+
+            async def receive():
+                nonlocal requested
+                if not requested:
+                    requested = True
+                    return {"type": "http.request", "body": b"", "more_body": False}
+                await stop.wait()
+                return {"type": "http.disconnect"}
+
+            async def send(message):
+                if message["type"] != "http.response.body":
+                    return
+                body = message.get("body", b"")
+                if body.startswith(b"retry:"):
+                    connected.release()
+                elif body.startswith(b"id:"):
+                    received.setdefault(i, []).append(perf_counter())
+                    waiter["count"] += 1
+                    if waiter["count"] == total and waiter["done"]:
+                        waiter["done"].set()
+
+            await application({
+                "type": "http",
+                "asgi": {"version": "3.0"},
+                "http_version": "1.1",
+                "method": "GET",
+                "scheme": "http",
+                "path": path,
+                "raw_path": path.encode(),
+                "query_string": f"date={day.isoformat()}".encode(),
+                "headers": [(b"host", b"localhost"), (b"cookie", cookie)],
+                "client": ("127.0.0.1", 10000 + i),
+                "server": ("localhost", 80),
+            }, receive, send)
+
+        # first connection loads the URLconf, views and DB connection
+        tasks = [asyncio.create_task(subscriber(0))]
+        await connected.acquire()
+
+        rss_before = _rss_mb()
+        threads_before = threading.active_count()
+        started = perf_counter()
+
+        tasks += [asyncio.create_task(subscriber(i)) for i in range(1, total)]
+        for _ in range(1, total):
+            await connected.acquire()
+
+        connect_time = perf_counter() - started
+        rss_after = _rss_mb()
+        hub = get_hub()
+
+        self.stdout.write(
+            f"{hub.subscriber_count} subscribers connected in {connect_time:.2f}s; "
+            f"RSS {rss_before:.0f} -> {rss_after:.0f} MB "
+            f"({(rss_after - rss_before) * 1024 / (total - 1):.1f} KB per subscriber), "
+            f"threads {threads_before} -> {threading.active_count()}"
+        )
+
+        slot_ids = await sync_to_async(list)(
+            TimeSlot.objects.filter(doctor=doctor).values_list("id", flat=True)
+        )
+        latencies = []
+        for slot_id in slot_ids:
+            waiter["count"] = 0
+            waiter["done"] = asyncio.Event()
+
+            pushed = perf_counter()
+            appointment = await sync_to_async(book_slot)(
+                slot_id, consultation_type="CLINIC", user=user
+            )
+            await asyncio.wait_for(waiter["done"].wait(), 60)
+
+            arrivals = [times[-1] - pushed for times in received.values()]
+            latencies.append((statistics.median(arrivals), max(arrivals)))
+            await sync_to_async(cancel_booking)(appointment)
+            await asyncio.sleep(settings.SSE_POLL_INTERVAL * 2)  # let the FREED event drain
+
+        for median, worst in latencies:
+            self.stdout.write(
+                f"event fan-out to {total} subscribers: "
+                f"median {median * 1000:.0f} ms, max {worst * 1000:.0f} ms"
+            )
+
+        stop.set()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ One worker held {total} concurrent subscribers"
+        ))
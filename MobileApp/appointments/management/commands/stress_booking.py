@@ -0,0 +1,90 @@
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time, timedelta
+from time import perf_counter
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from doctors.models import Doctor
+from appointments.booking import SlotUnavailable, book_slot
+from appointments.models import Appointment, TimeSlot
+
+
+class Command(BaseCommand):
+    help = "Fire concurrent bookings at a set of slots and report correctness and throughput"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--slots", type=int, default=20)
+        parser.add_argument("--attempts", type=int, default=25, help="Bookings fired per slot")
+        parser.add_argument("--threads", type=int, default=32)
+
+    def handle(self, *args, **options):
+        doctor = Doctor.objects.create(
+            user=User.objects.create(username=f"stress-{timezone.now():%Y%m%d%H%M%S%f}"),
+            name="Stress Test",
+            specialization="Stress Test",
+            is_active=False,
+        )
+        patient = doctor.user
+
+        try:
+            self.run(doctor, patient, options)
+        finally:
+            doctor.user.delete()  # cascades to doctor, slots, appointments
+
+    def run(self, doctor, patient, options):
+        day = timezone.localdate() + timedelta(days=365)
+        start = datetime.combine(day, time(0, 0))
+        slots = TimeSlot.objects.bulk_create([
+            TimeSlot(
+                doctor=doctor,
+                date=day,
+                start_time=(start + timedelta(minutes=i)).time(),
+                end_time=(start + timedelta(minutes=i + 1)).time(),
+            )
+            for i in range(options["slots"])
+        ])
+        slot_ids = list(
+            TimeSlot.objects.filter(doctor=doctor).values_list("id", flat=True)
+        )
+
+        def attempt(slot_id):
+            try:
+                book_slot(slot_id, consultation_type="CLINIC", user=patient)
+                return "booked"
+            except SlotUnavailable:
+                return "rejected"
+            except Exception as e:
+                return f"error: {e}"
+            finally:
+                connection.close()
+
+        work = slot_ids * options["attempts"]
+
+        started = perf_counter()
+        with ThreadPoolExecutor(max_workers=options["threads"]) as pool:
+            outcomes = Counter(pool.map(attempt, work))
+        elapsed = perf_counter() - started
+
+        per_slot = Counter(
+            Appointment.objects.filter(slot__in=slot_ids).values_list("slot_id", flat=True)
+        )
+        double_booked = [i for i, n in per_slot.items() if n > 1]
+
+        self.stdout.write(
+            f"{len(work)} attempts on {len(slots)} slots with {options['threads']} threads "
+            f"in {elapsed:.2f}s: {dict(outcomes)}"
+        )
+        self.stdout.write(
+            f"throughput: {len(work) / elapsed:.0f} attempts/sec, "
+            f"{outcomes['booked'] / elapsed:.0f} bookings/sec"
+        )
+
+        if double_booked or outcomes["booked"] != len(slot_ids):
+            raise CommandError(
+                f"expected exactly one booking per slot, double booked: {double_booked}"
+            )
+        self.stdout.write(self.style.SUCCESS("✅ Exactly one booking per slot"))
@@ -0,0 +1,223 @@
+import os
+import resource
+import tempfile
+import tracemalloc
+from datetime import timedelta
+from importlib import import_module
+from time import perf_counter
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.core.handlers.wsgi import WSGIHandler, WSGIRequest
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+
+from appointments.availability import free_slots
+from appointments.booking import book_slot
+from appointments.models import AppointmentReport
+from doctors.models import Doctor
+
+
+BLOCK = 2**20
+
+
+def _rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _written_mb():
+    # bytes this process passed to write(): temp file copies show up here
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1]) / 2**20
+    except OSError:
+        pass
+    return 0
+
+
+class MultipartBody:
+    """
+    A multipart/form-data body of `files` distinct PDFs of `size` bytes
+    each, generated as it is read so the client side holds one block at
+    a time.
+    """
+
+    def __init__(self, files, size, fields=()):
+        self.boundary = get_random_string(24)
+        self.block = b"%PDF-1.7\n" + os.urandom(BLOCK - 9)
+        self.parts = []
+        for name, value in fields:
+            self.parts.append(self._header(f'name="{name}"') + value.encode() + b"\r\n")
+        for i in range(files):
+            self.parts.append(self._header(
+                f'name="reports"; filename="scan{i}.pdf"', "Content-Type: application/pdf\r\n"
+            ))
+            self.parts.append(size)
+            self.parts.append(b"\r\n")
+        self.parts.append(f"--{self.boundary}--\r\n".encode())
+        self.length = sum(p if isinstance(p, int) else len(p) for p in self.parts)
+        self.chunks = self._chunks()
+        self.pending = b""
+
+    def _header(self, disposition, extra=""):
+        return (
+            f"--{self.boundary}\r\n"
+            f"Content-Disposition: form-data; {disposition}\r\n{extra}\r\n"
+        ).encode()
+
+    def _chunks(self):
+        files = 0
+        for part in self.parts:
+            if isinstance(part, bytes):
+                yield part
+                continue
+            # a different first line per file, so none are deduplicated
+            files += 1
+            first = b"%PDF-1.7\n%" + str(files).encode().rjust(8) + b"\n"
+            for offset in range(0, part, BLOCK):
+                block = first + self.block[len(first):] if offset == 0 else self.block
+                yield block[:min(BLOCK, part - offset)]
+
+    def read(self, size=-1):
+        while size < 0 or len(self.pending) < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            self.pending += chunk
+        if size < 0:
+            size = len(self.pending)
+        data, self.pending = self.pending[:size], self.pending[size:]
+        return data
+
+    def readline(self, size=-1):
+        return self.read(size)
+
+    @property
+    def content_type(self):
+        return f"multipart/form-data; boundary={self.boundary}"
+
+
+class Command(BaseCommand):
+    help = (
+        "Upload N reports of S MB to one appointment and compare memory "
+        "and throughput of the streaming upload handler with Django's "
+        "default handlers"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--files", type=int, default=10)
+        parser.add_argument("--size-mb", type=int, default=20)
+        parser.add_argument("--mode", choices=["both", "streaming", "default"], default="both")
+
+    def handle(self, *args, **options):
+        user = User.objects.create(username=f"upload-{timezone.now():%Y%m%d%H%M%S%f}")
+        doctor = Doctor.objects.create(
+            user=user,
+            name="Upload Benchmark",
+            specialization="Load Test",
+            is_active=False,
+        )
+        day = timezone.localdate() + timedelta(days=365)
+        appointment = book_slot(
+            free_slots(doctor, day)[0]["id"], consultation_type="CLINIC", user=user
+        )
+
+        session = import_module(settings.SESSION_ENGINE).SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.save()
+
+        size = options["size_mb"] * 2**20
+        limits = {
+            "REPORT_UPLOAD_MAX_FILE_SIZE": max(settings.REPORT_UPLOAD_MAX_FILE_SIZE, size),
+            "REPORT_UPLOAD_MAX_REQUEST_SIZE": max(
+                settings.REPORT_UPLOAD_MAX_REQUEST_SIZE, (size + 2**16) * options["files"]
+            ),
+            "REPORT_UPLOAD_MAX_FILES": max(settings.REPORT_UPLOAD_MAX_FILES, options["files"]),
+        }
+        modes = ["streaming", "default"] if options["mode"] == "both" else [options["mode"]]
+
+        try:
+            with tempfile.TemporaryDirectory() as media, override_settings(MEDIA_ROOT=media, **limits):
+                for mode in modes:
+                    run = self.streaming if mode == "streaming" else self.default
+                    self.measure(mode, run, appointment, session.session_key, options["files"], size)
+                    AppointmentReport.objects.filter(appointment=appointment).delete()
+        finally:
+            session.delete()
+            user.delete()  # cascades to doctor, slots, appointments, reports
+
+    def measure(self, mode, run, appointment, session_key, files, size):
+        body = MultipartBody(files, size)
+        rss_before = _rss_mb()
+        written_before = _written_mb()
+        tracemalloc.start()
+        started = perf_counter()
+
+        status = run(appointment, session_key, body)
+
+        elapsed = perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        stored = AppointmentReport.objects.filter(appointment=appointment).count()
+        total_mb = files * size / 2**20
+        self.stdout.write(
+            f"{mode:>9}: HTTP {status}, {stored} reports, {total_mb:.0f} MB in {elapsed:.2f}s "
+            f"({total_mb / elapsed:.0f} MB/s); Python heap peak {peak / 2**20:.1f} MB, "
+            f"RSS {rss_before:.0f} -> {_rss_mb():.0f} MB, "
+            f"{_written_mb() - written_before:.0f} MB written"
+        )
+
+    def environ(self, body, path, **extra):
+        return {
+            "REQUEST_METHOD": "POST",
+            "PATH_INFO": path,
+            "SCRIPT_NAME": "",
+            "QUERY_STRING": "",
+            "SERVER_NAME": "localhost",
+            "SERVER_PORT": "80",
+            "HTTP_HOST": "localhost",
+            "CONTENT_TYPE": body.content_type,
+            "CONTENT_LENGTH": str(body.length),
+            "wsgi.input": body,
+            "wsgi.url_scheme": "http",
+            **extra,
+        }
+
+    def streaming(self, appointment, session_key, body):
+        # the real view, through the whole WSGI stack
+        token = get_random_string(32)
+        environ = self.environ(
+            body,
+            reverse("appointments:upload_report", args=[appointment.id]),
+            HTTP_COOKIE=f"{settings.SESSION_COOKIE_NAME}={session_key}; "
+                        f"{settings.CSRF_COOKIE_NAME}={token}",
+            HTTP_X_CSRFTOKEN=token,
+        )
+        statuses = []
+        response = WSGIHandler()(environ, lambda status, headers: statuses.append(status))
+        b"".join(response)
+        return statuses[0].split()[0]
+
+    def default(self, appointment, session_key, body):
+        # what upload_report did before: default handlers, one INSERT per file
+        request = WSGIRequest(self.environ(body, "/"))
+        for f in request.FILES.getlist("reports"):
+            AppointmentReport.objects.create(appointment=appointment, file=f)
+        request.close()
+        return 200
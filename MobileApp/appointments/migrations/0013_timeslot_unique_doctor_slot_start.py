@@ -0,0 +1,51 @@
+# Generated by Django 6.0 on 2026-10-18 18:42
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remove_duplicate_slots(apps, schema_editor):
+    # Keep one row per (doctor, date, start_time); only unbooked
+    # duplicates are dropped so no appointment is cascaded away.
+    TimeSlot = apps.get_model('appointments', 'TimeSlot')
+
+    duplicates = (
+        TimeSlot.objects
+        .values('doctor_id', 'date', 'start_time')
+        .annotate(n=Count('id'))
+        .filter(n__gt=1)
+    )
+
+    for row in duplicates:
+        group = TimeSlot.objects.filter(
+            doctor_id=row['doctor_id'],
+            date=row['date'],
+            start_time=row['start_time'],
+        )
+        # prefer the booked row, otherwise the oldest one
+        keep = (
+            group.filter(appointment__isnull=False).aggregate(id=Min('id'))['id']
+            or group.aggregate(id=Min('id'))['id']
+        )
+        group.filter(appointment__isnull=True).exclude(id=keep).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0012_remove_appointment_appointment_date'),
+        ('doctors', '0006_alter_doctor_user'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='appointment',
+            name='payment_status',
+            field=models.CharField(choices=[('PENDING', 'Pending'), ('PAID', 'Paid'), ('FAILED', 'Failed'), ('UNPAID', 'Unpaid')], default='UNPAID', max_length=10),
+        ),
+        migrations.RunPython(remove_duplicate_slots, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='timeslot',
+            constraint=models.UniqueConstraint(fields=('doctor', 'date', 'start_time'), name='unique_doctor_slot_start'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 6.0 on 2026-10-18 18:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0014_appointment_slot_active_unique'),
+        ('doctors', '0007_doctorschedule_holiday'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='hold_expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='timeslot',
+            name='held_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='timeslot',
+            index=models.Index(condition=models.Q(('held_until__isnull', False)), fields=['held_until'], name='timeslot_held_until_idx'),
+        ),
+    ]
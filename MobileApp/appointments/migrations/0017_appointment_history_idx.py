@@ -0,0 +1,20 @@
+# Generated by Django 6.0 on 2026-10-18 19:55
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0016_waitlistentry'),
+        ('doctors', '0007_doctorschedule_holiday'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='appointment_history_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 6.0 on 2026-10-18 20:15
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0017_appointment_history_idx'),
+        ('doctors', '0007_doctorschedule_holiday'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['-created_at', '-id'], name='appointment_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['doctor', 'status', '-created_at', '-id'], name='appointment_doctor_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['status', 'payment_status', '-created_at', '-id'], name='appointment_status_pay_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['payment_status', 'consultation_type', '-created_at', '-id'], name='appointment_pay_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['consultation_type', '-created_at', '-id'], name='appointment_type_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 6.0 on 2026-10-18 20:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0018_staff_console_indexes'),
+        ('doctors', '0007_doctorschedule_holiday'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlotEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('start_time', models.TimeField()),
+                ('end_time', models.TimeField()),
+                ('kind', models.CharField(choices=[('TAKEN', 'Taken'), ('FREED', 'Freed')], max_length=5)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='doctors.doctor')),
+                ('slot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='appointments.timeslot')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['doctor', 'date', 'id'], name='slotevent_stream_idx')],
+            },
+        ),
+    ]
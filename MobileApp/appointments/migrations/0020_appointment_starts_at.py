@@ -0,0 +1,88 @@
+# Generated by Django 6.0 on 2026-10-18 21:52
+
+from datetime import datetime
+
+from django.db import migrations, models, transaction
+from django.utils import timezone
+
+
+BATCH_SIZE = 1000
+
+
+def copy_slot_times(apps, schema_editor):
+    # One short transaction per batch of ids, so a large table is never
+    # locked for the whole backfill and a rerun picks up where it stopped.
+    Appointment = apps.get_model('appointments', 'Appointment')
+    db = schema_editor.connection.alias
+
+    last_id = 0
+    while True:
+        with transaction.atomic(using=db):
+            rows = list(
+                Appointment.objects.using(db)
+                .filter(id__gt=last_id, starts_at__isnull=True)
+                .order_by('id')
+                .values_list('id', 'slot__date', 'slot__start_time', 'slot__end_time')
+                [:BATCH_SIZE]
+            )
+            if not rows:
+                break
+
+            Appointment.objects.using(db).bulk_update([
+                Appointment(
+                    id=appointment_id,
+                    date=day,
+                    starts_at=timezone.make_aware(datetime.combine(day, start)),
+                    ends_at=timezone.make_aware(datetime.combine(day, end)),
+                )
+                for appointment_id, day, start, end in rows
+            ], ['date', 'starts_at', 'ends_at'])
+        last_id = rows[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('appointments', '0019_slotevent'),
+        ('doctors', '0007_doctorschedule_holiday'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='date',
+            field=models.DateField(null=True),
+        ),
+        migrations.AddField(
+            model_name='appointment',
+            name='starts_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='appointment',
+            name='ends_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.RunPython(copy_slot_times, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='appointment',
+            name='date',
+            field=models.DateField(),
+        ),
+        migrations.AlterField(
+            model_name='appointment',
+            name='starts_at',
+            field=models.DateTimeField(db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='appointment',
+            name='ends_at',
+            field=models.DateTimeField(),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['doctor', 'date', 'starts_at'], name='appointment_doctor_day_idx'),
+        ),
+    ]
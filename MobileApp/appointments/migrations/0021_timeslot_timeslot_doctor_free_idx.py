@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 22:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0020_appointment_starts_at'),
+        ('doctors', '0007_doctorschedule_holiday'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='timeslot',
+            index=models.Index(fields=['doctor', 'date', 'is_available', 'start_time'], name='timeslot_doctor_free_idx'),
+        ),
+    ]
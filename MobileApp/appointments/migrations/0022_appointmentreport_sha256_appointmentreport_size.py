@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-18 22:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0021_timeslot_timeslot_doctor_free_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointmentreport',
+            name='sha256',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='appointmentreport',
+            name='size',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,120 @@
+# Generated by Django 6.0 on 2026-10-18 23:41
+
+import hashlib
+
+import appointments.storage
+import django.db.models.deletion
+from django.db import migrations, models, transaction
+from django.db.models import F
+
+
+BATCH_SIZE = 500
+
+
+def deduplicate_reports(apps, schema_editor):
+    # Hash every report file and point reports with equal content at one
+    # ReportBlob. The first copy stays where it is (blob.name is its old
+    # path), so nothing is moved; later copies are deleted once the
+    # batch that stopped referencing them has committed.
+    AppointmentReport = apps.get_model('appointments', 'AppointmentReport')
+    ReportBlob = apps.get_model('appointments', 'ReportBlob')
+    storage = AppointmentReport._meta.get_field('file').storage
+    db = schema_editor.connection.alias
+
+    blobs = {}          # path -> ReportBlob already holding that file
+    reports = stored = missing = duplicates = reclaimed = 0
+    last_id = 0
+    while True:
+        unlink = set()
+        with transaction.atomic(using=db):
+            batch = list(
+                AppointmentReport.objects.using(db)
+                .filter(id__gt=last_id, blob__isnull=True)
+                .order_by('id')[:BATCH_SIZE]
+            )
+            if not batch:
+                break
+
+            for report in batch:
+                name = report.file.name
+                blob = blobs.get(name)
+                if blob is None:
+                    if not name or not storage.exists(name):
+                        missing += 1
+                        continue
+                    sha256 = hashlib.sha256()
+                    with storage.open(name, 'rb') as f:
+                        for chunk in f.chunks():
+                            sha256.update(chunk)
+                    blob, created = ReportBlob.objects.using(db).get_or_create(
+                        sha256=sha256.hexdigest(),
+                        defaults={'name': name, 'size': storage.size(name)},
+                    )
+                    if created:
+                        stored += 1
+                    else:
+                        unlink.add(name)
+                        duplicates += 1
+                        reclaimed += blob.size
+                    blobs[name] = blob
+
+                ReportBlob.objects.using(db).filter(id=blob.id).update(refcount=F('refcount') + 1)
+                report.blob = blob
+                report.file = blob.name
+                reports += 1
+
+            AppointmentReport.objects.using(db).bulk_update(batch, ['blob', 'file'])
+
+        last_id = batch[-1].id
+        for name in unlink:
+            storage.delete(name)
+
+    if not (reports or missing):
+        return
+    print(
+        f'\n  {reports} reports now share {stored} blobs: '
+        f'{duplicates} duplicate files removed, {reclaimed} bytes reclaimed'
+        + (f', {missing} without a file' if missing else '')
+    )
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('appointments', '0022_appointmentreport_sha256_appointmentreport_size'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True)),
+                ('name', models.CharField(max_length=255)),
+                ('size', models.PositiveBigIntegerField()),
+                ('refcount', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='appointmentreport',
+            name='file',
+            field=models.FileField(storage=appointments.storage.ContentAddressedStorage(), upload_to='appointment_reports/'),
+        ),
+        migrations.AddField(
+            model_name='appointmentreport',
+            name='blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='reports', to='appointments.reportblob'),
+        ),
+        migrations.RunPython(deduplicate_reports, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='appointmentreport',
+            name='sha256',
+        ),
+        migrations.RemoveField(
+            model_name='appointmentreport',
+            name='size',
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 23:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0023_reportblob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reportblob',
+            name='preview',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-19 11:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0025_console_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reportblob',
+            name='preview_status',
+            field=models.CharField(blank=True, choices=[('SKIPPED', 'Skipped'), ('FAILED', 'Failed')], max_length=10),
+        ),
+    ]
@@ -1,10 +1,14 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
 from doctors.models import Doctor
 from django.core.exceptions import ValidationError
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 from datetime import datetime
 
+from .storage import report_storage
+
 User = get_user_model()
 
 # -----------------------
@@ -33,6 +37,22 @@ PAYMENT_STATUS_CHOICES = [
     ("UNPAID", "Unpaid"),
 ]
 
+SLOT_EVENT_CHOICES = [
+    ("TAKEN", "Taken"),
+    ("FREED", "Freed"),
+]
+
+PREVIEW_STATUS_CHOICES = [
+    ("SKIPPED", "Skipped"),
+    ("FAILED", "Failed"),
+]
+
+WAITLIST_STATUS_CHOICES = [
+    ("WAITING", "Waiting"),
+    ("PROMOTED", "Promoted"),
+    ("LEFT", "Left"),
+]
+
 # -----------------------
 # TIME SLOT
 # -----------------------
@@ -46,6 +66,29 @@ class TimeSlot(models.Model):
     start_time = models.TimeField()
     end_time = models.TimeField()
     is_available = models.BooleanField(default=True)
+    # set while an ONLINE booking waits for payment; once it passes the
+    # slot counts as free again even if the sweeper hasn't run yet
+    held_until = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # a doctor's free slots for a day, in time order
+            models.Index(
+                fields=["doctor", "date", "is_available", "start_time"],
+                name="timeslot_doctor_free_idx",
+            ),
+            models.Index(
+                fields=["held_until"],
+                condition=models.Q(held_until__isnull=False),
+                name="timeslot_held_until_idx",
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["doctor", "date", "start_time"],
+                name="unique_doctor_slot_start",
+            ),
+        ]
 
     def clean(self):
         # start < end
@@ -67,12 +110,57 @@ class TimeSlot(models.Model):
         if overlapping.exists():
             raise ValidationError("This slot overlaps with an existing slot")
 
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if not adding:
+                # keep the copies on its appointments in step
+                self.appointments.update(
+                    date=self.date,
+                    starts_at=self.starts_at,
+                    ends_at=self.ends_at
+                )
+
+    @property
+    def starts_at(self):
+        return timezone.make_aware(datetime.combine(self.date, self.start_time))
+
+    @property
+    def ends_at(self):
+        return timezone.make_aware(datetime.combine(self.date, self.end_time))
+
     def __str__(self):
         return f"{self.doctor.name} | {self.date} {self.start_time}-{self.end_time}"
 
 # -----------------------
 # APPOINTMENT
 # -----------------------
+def slot_past_q(now=None):
+    """The appointment's slot has started."""
+    return models.Q(starts_at__lte=now or timezone.now())
+
+
+class AppointmentQuerySet(models.QuerySet):
+    def with_time_flags(self, now=None):
+        """
+        Annotate is_past and is_cancellable in SQL, so listings can
+        filter on them without per-row Python.
+        """
+        past = slot_past_q(now)
+        return self.annotate(
+            is_past=models.ExpressionWrapper(past, output_field=models.BooleanField()),
+            is_cancellable=models.ExpressionWrapper(
+                models.Q(status="BOOKED") & ~past,
+                output_field=models.BooleanField()
+            ),
+        )
+
+    def cancellable(self, now=None):
+        """BOOKED and not started yet: what a patient may cancel."""
+        return self.filter(models.Q(status="BOOKED") & ~slot_past_q(now))
+
+
 class Appointment(models.Model):
     user = models.ForeignKey(
         User,
@@ -81,7 +169,17 @@ class Appointment(models.Model):
         blank=True
     )
     doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE)
-    slot = models.OneToOneField(TimeSlot, on_delete=models.CASCADE)
+    # a slot keeps its cancelled appointments; only one may be active
+    slot = models.ForeignKey(
+        TimeSlot,
+        on_delete=models.CASCADE,
+        related_name="appointments"
+    )
+    # copies of the slot's date and times (TimeSlot.save keeps them in
+    # step) so listings filter and sort without joining TimeSlot
+    date = models.DateField()
+    starts_at = models.DateTimeField(db_index=True)
+    ends_at = models.DateTimeField()
 
     consultation_type = models.CharField(
         max_length=10,
@@ -117,28 +215,231 @@ class Appointment(models.Model):
         default="BOOKED"
     )
 
+    # copy of slot.held_until for the hold this appointment owns
+    hold_expires_at = models.DateTimeField(null=True, blank=True)
+
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = AppointmentQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # keyset pagination of a patient's history
+            models.Index(
+                fields=["user", "-created_at", "-id"],
+                name="appointment_history_idx",
+            ),
+            # staff console: equality filters first, then the keyset
+            models.Index(
+                fields=["-created_at", "-id"],
+                name="appointment_recent_idx",
+            ),
+            models.Index(
+                fields=["doctor", "-created_at", "-id"],
+                name="appointment_doctor_recent_idx",
+            ),
+            models.Index(
+                fields=["doctor", "status", "-created_at", "-id"],
+                name="appointment_doctor_status_idx",
+            ),
+            models.Index(
+                fields=["status", "-created_at", "-id"],
+                name="appointment_status_idx",
+            ),
+            models.Index(
+                fields=["status", "payment_status", "-created_at", "-id"],
+                name="appointment_status_pay_idx",
+            ),
+            models.Index(
+                fields=["payment_status", "-created_at", "-id"],
+                name="appointment_pay_idx",
+            ),
+            models.Index(
+                fields=["payment_status", "consultation_type", "-created_at", "-id"],
+                name="appointment_pay_type_idx",
+            ),
+            models.Index(
+                fields=["consultation_type", "-created_at", "-id"],
+                name="appointment_type_idx",
+            ),
+            # date ranges without a doctor (doctor + date uses the day index)
+            models.Index(
+                fields=["date", "status"],
+                name="appointment_date_status_idx",
+            ),
+            # a doctor's day, in time order
+            models.Index(
+                fields=["doctor", "date", "starts_at"],
+                name="appointment_doctor_day_idx",
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["slot"],
+                condition=~models.Q(status="CANCELLED"),
+                name="one_active_appointment_per_slot",
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.starts_at is None:
+            self.date = self.slot.date
+            self.starts_at = self.slot.starts_at
+            self.ends_at = self.slot.ends_at
+        super().save(*args, **kwargs)
+
+    @property
+    def is_held(self):
+        return self.hold_expires_at is not None and self.hold_expires_at > timezone.now()
+
     @property
     def is_past(self):
-        slot_dt = datetime.combine(self.slot.date, self.slot.start_time)
-        slot_dt = timezone.make_aware(slot_dt)
-        return timezone.now() >= slot_dt
+        # set by with_time_flags()
+        if "is_past" in self.__dict__:
+            return self.__dict__["is_past"]
+        return timezone.now() >= self.starts_at
+
+    @is_past.setter
+    def is_past(self, value):
+        self.__dict__["is_past"] = value
 
     def can_cancel(self):
+        if "is_cancellable" in self.__dict__:
+            return self.is_cancellable
         return self.status == "BOOKED" and not self.is_past
 
+# -----------------------
+# SLOT EVENTS (live availability feed)
+# -----------------------
+class SlotEvent(models.Model):
+    """
+    Append-only log of slots being taken or freed, written in the same
+    transaction as the change. The SSE hub tails it by id.
+    """
+    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE)
+    date = models.DateField()
+    slot = models.ForeignKey(TimeSlot, on_delete=models.CASCADE)
+    start_time = models.TimeField()
+    end_time = models.TimeField()
+    kind = models.CharField(max_length=5, choices=SLOT_EVENT_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            # Last-Event-ID replay for one (doctor, date) stream
+            models.Index(fields=["doctor", "date", "id"], name="slotevent_stream_idx"),
+        ]
+
+# -----------------------
+# WAITLIST
+# -----------------------
+class WaitlistEntry(models.Model):
+    doctor = models.ForeignKey(
+        Doctor,
+        on_delete=models.CASCADE,
+        related_name="waitlist"
+    )
+    date = models.DateField()
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+
+    consultation_type = models.CharField(
+        max_length=10,
+        choices=CONSULTATION_TYPE_CHOICES,
+        default="ONLINE"
+    )
+
+    # higher goes first; equal priority is first come, first served
+    priority = models.SmallIntegerField(default=0)
+
+    status = models.CharField(
+        max_length=10,
+        choices=WAITLIST_STATUS_CHOICES,
+        default="WAITING"
+    )
+
+    appointment = models.OneToOneField(
+        Appointment,
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name="waitlist_entry"
+    )
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # promotion reads the head of one doctor-day's queue
+            models.Index(
+                "doctor",
+                "date",
+                models.F("priority").desc(),
+                "created_at",
+                "id",
+                condition=models.Q(status="WAITING"),
+                name="waitlist_queue_idx",
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["doctor", "date", "user"],
+                condition=models.Q(status="WAITING"),
+                name="one_waiting_entry_per_user_day",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user} waiting for {self.doctor.name} on {self.date}"
+
 # -----------------------
 # REPORT
 # -----------------------
+class ReportBlob(models.Model):
+    """
+    One stored report file, named by the SHA-256 of its content and
+    shared by every AppointmentReport with the same bytes. refcount is
+    the number of those reports (see appointments.blobs). preview is the
+    stored JPEG preview, empty until appointments.previews builds one;
+    preview_status records a renderer that declined the file or failed
+    on it, so the backfill doesn't try the same bytes again.
+    """
+    sha256 = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    refcount = models.PositiveIntegerField(default=0)
+    preview = models.CharField(max_length=255, blank=True)
+    preview_status = models.CharField(max_length=10, choices=PREVIEW_STATUS_CHOICES, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.sha256[:12]} ({self.refcount} reports)"
+
+
 class AppointmentReport(models.Model):
     appointment = models.ForeignKey(
         Appointment,
         on_delete=models.CASCADE,
         related_name="reports"
     )
-    file = models.FileField(upload_to="appointment_reports/")
+    file = models.FileField(upload_to="appointment_reports/", storage=report_storage)
+    # file.name is blob.name; null only for reports whose file was
+    # already missing when reports moved to content-addressed storage
+    blob = models.ForeignKey(
+        ReportBlob,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name="reports"
+    )
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
         return f"Report for Appointment #{self.appointment.id}"
+
+
+@receiver(post_delete, sender=AppointmentReport)
+def release_report_blob(sender, instance, **kwargs):
+    # covers delete_report and cascades from appointments and users
+    if instance.blob_id:
+        from .blobs import release_blobs
+        release_blobs([instance.blob_id])
@@ -0,0 +1,195 @@
+# Report previews.
+#
+# Listings show a small JPEG instead of the report itself: a thumbnail
+# for images, the first page for PDFs. A preview belongs to a ReportBlob,
+# so it is built once per distinct content and named by the same hash
+# (<upload_to>/previews/<ab>/<sha256>.jpg). Uploads hand their new blobs
+# to a small in-process thread pool once they commit; anything that pool
+# never got to (a restart, a failure, reports from before previews) is
+# picked up by the build_report_previews command. Images need Pillow and
+# PDFs need pdftoppm (poppler-utils); without them those reports simply
+# have no preview and the templates link to the file instead. So do
+# images above REPORT_PREVIEW_MAX_PIXELS, which would take more memory
+# to decode than a worker should spend on a thumbnail. A blob's bytes
+# never change, so one a renderer declined (SKIPPED) or failed on
+# (FAILED) is left alone until the command is run with --retry-failed.
+import logging
+import os
+import posixpath
+import shutil
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils.crypto import get_random_string
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+from .models import AppointmentReport, ReportBlob
+
+
+logger = logging.getLogger(__name__)
+
+PDFTOPPM = shutil.which("pdftoppm")
+
+
+# ------------------------
+# RENDERERS
+# ------------------------
+def _render_image(source, destination, size):
+    with Image.open(source) as image:
+        image.draft("RGB", (size, size))  # JPEGs decode straight at 1/2..1/8 scale
+        width, height = image.size
+        if width * height > settings.REPORT_PREVIEW_MAX_PIXELS:
+            return False  # only the header has been read so far
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size))
+        image.convert("RGB").save(destination, "JPEG", quality=80, optimize=True)
+
+
+def _render_pdf(source, destination, size):
+    # pdftoppm adds the .jpg itself
+    subprocess.run(
+        [
+            PDFTOPPM, "-jpeg", "-jpegopt", "quality=80", "-f", "1", "-l", "1",
+            "-scale-to", str(size), "-singlefile", source, destination.removesuffix(".jpg"),
+        ],
+        check=True,
+        capture_output=True,
+        timeout=settings.REPORT_PREVIEW_TIMEOUT,
+    )
+
+
+# extension -> renderer(source path, destination path, longest side);
+# a renderer returns False to leave a file without a preview
+RENDERERS = {}
+if Image is not None:
+    RENDERERS.update(dict.fromkeys([".jpg", ".jpeg", ".png", ".webp"], _render_image))
+if PDFTOPPM:
+    RENDERERS[".pdf"] = _render_pdf
+
+
+def _renderer(blob):
+    return RENDERERS.get(posixpath.splitext(blob.name)[1].lower())
+
+
+def renderable_q():
+    """Blobs some installed renderer can preview."""
+    q = Q(pk__in=[])
+    for suffix in RENDERERS:
+        q |= Q(name__iendswith=suffix)
+    return q
+
+
+# ------------------------
+# BUILDING
+# ------------------------
+def _field():
+    return AppointmentReport._meta.get_field("file")
+
+
+def preview_name(blob):
+    directory = posixpath.join(_field().upload_to.rstrip("/"), "previews")
+    return _field().storage.blob_name(directory, blob.sha256, ".jpg")
+
+
+def build_preview(blob):
+    """
+    Render and store the preview of a ReportBlob and record it on the
+    row. Returns the preview's name, or None if there is no renderer for
+    the file, the renderer declined it, the file is gone, or the blob
+    was collected meanwhile.
+    """
+    storage = _field().storage
+    renderer = _renderer(blob)
+    if renderer is None or not storage.exists(blob.name):
+        return None
+
+    name = preview_name(blob)
+    if not storage.exists(name):
+        partial = posixpath.join(_field().upload_to, "incoming", get_random_string(32) + ".jpg")
+        os.makedirs(os.path.dirname(storage.path(partial)), exist_ok=True)
+        try:
+            rendered = renderer(
+                storage.path(blob.name), storage.path(partial), settings.REPORT_PREVIEW_SIZE
+            )
+            if rendered is False:
+                ReportBlob.objects.filter(id=blob.id).update(preview_status="SKIPPED")
+                return None
+            storage.adopt(partial, name)
+        finally:
+            storage.delete(partial)  # nothing left once adopted
+
+    if not ReportBlob.objects.filter(id=blob.id).update(preview=name):
+        # the last report went while we rendered; keep the file only if
+        # the same content has been uploaded again since
+        if not ReportBlob.objects.filter(sha256=blob.sha256).exists():
+            storage.delete(name)
+        return None
+    return name
+
+
+def build_previews(blob_ids):
+    """Build the missing previews of the given blobs; returns (built, skipped, failed)."""
+    built = skipped = failed = 0
+    for blob in ReportBlob.objects.filter(id__in=blob_ids, preview="", preview_status=""):
+        try:
+            name = build_preview(blob)
+        except Exception:
+            logger.exception("Could not build a preview of %s", blob.name)
+            ReportBlob.objects.filter(id=blob.id).update(preview_status="FAILED")
+            failed += 1
+            continue
+        if name:
+            built += 1
+        else:
+            skipped += 1
+    return built, skipped, failed
+
+
+# ------------------------
+# BACKGROUND QUEUE
+# ------------------------
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _executor():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(
+                settings.REPORT_PREVIEW_WORKERS, thread_name_prefix="report-preview"
+            )
+    return _pool
+
+
+def _build_in_background(blob_ids):
+    try:
+        build_previews(blob_ids)
+    finally:
+        connection.close()  # this pool thread's own connection
+
+
+def schedule_previews(blobs):
+    """
+    Queue previews for the blobs that lack one, to be built once the
+    current transaction commits. REPORT_PREVIEW_WORKERS = 0 builds them
+    inline in the on_commit callback instead.
+    """
+    blob_ids = [
+        blob.id for blob in blobs
+        if not blob.preview and not blob.preview_status and _renderer(blob)
+    ]
+    if not blob_ids:
+        return
+    if settings.REPORT_PREVIEW_WORKERS:
+        transaction.on_commit(lambda: _executor().submit(_build_in_background, blob_ids))
+    else:
+        transaction.on_commit(lambda: build_previews(blob_ids))
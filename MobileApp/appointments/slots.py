@@ -0,0 +1,83 @@
+from datetime import datetime, timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from dashboards.stats import count_new_days, refresh_day_stats
+from doctors.schedule import get_schedule
+from .models import TimeSlot
+
+
+# ------------------------
+# SCHEDULE
+# ------------------------
+def working_intervals(doctor, slot_date):
+    return get_schedule().intervals(doctor.id, slot_date)
+
+
+def is_working_day(doctor, slot_date):
+    return get_schedule().is_working(doctor.id, slot_date)
+
+
+# ------------------------
+# SLOT MATERIALIZATION
+# ------------------------
+def build_day_slots(doctor, slot_date):
+    """
+    Compute a doctor-day's slots in memory from the compiled schedule
+    (no queries). Returns unsaved TimeSlot objects ordered by start time.
+    """
+    slots = []
+
+    for start, end, minutes in working_intervals(doctor, slot_date):
+        if minutes <= 0:
+            raise ValueError(f"Slot length must be positive, got {minutes} minutes")
+        duration = timedelta(minutes=minutes)
+        current = datetime.combine(slot_date, start)
+        end_dt = datetime.combine(slot_date, end)
+
+        while current + duration <= end_dt:
+            slots.append(TimeSlot(
+                doctor=doctor,
+                date=slot_date,
+                start_time=current.time(),
+                end_time=(current + duration).time(),
+                is_available=True,
+            ))
+            current += duration
+
+    return slots
+
+
+def materialize_slots(doctor, slot_date):
+    """
+    Write a doctor-day's scheduled slots with a single bulk insert.
+
+    Idempotent: only missing start times are inserted, and the
+    (doctor, date, start_time) unique constraint makes concurrent
+    callers skip each other's rows, so there are never duplicates.
+    DoctorDayStats is updated in the same transaction. Returns the
+    number of slots the day should have (0 for past dates and days off).
+    """
+    if slot_date < timezone.localdate():
+        return 0
+
+    slots = build_day_slots(doctor, slot_date)
+    if not slots:
+        return 0
+
+    have = set(TimeSlot.objects.filter(
+        doctor=doctor,
+        date=slot_date
+    ).values_list("start_time", flat=True))
+    missing = [s for s in slots if s.start_time not in have]
+
+    if missing:
+        with transaction.atomic(savepoint=False):
+            TimeSlot.objects.bulk_create(missing, ignore_conflicts=True)
+            if have:
+                # filling gaps around rows that may be booked: recount
+                refresh_day_stats([(doctor.id, slot_date)])
+            else:
+                count_new_days({(doctor.id, slot_date): len(missing)})
+    return len(slots)
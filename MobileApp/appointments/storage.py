@@ -0,0 +1,52 @@
+import hashlib
+import os
+import posixpath
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.crypto import get_random_string
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Stores a file under the SHA-256 of its content
+    (<upload_to>/<ab>/<abcdef...><ext>), so the same bytes saved twice
+    occupy one file. Who still uses a file is counted by ReportBlob rows
+    (appointments.blobs), not here: delete() unlinks unconditionally.
+    """
+
+    def blob_name(self, directory, sha256, suffix=""):
+        return posixpath.join(directory, sha256[:2], sha256 + suffix.lower())
+
+    def get_available_name(self, name, max_length=None):
+        # equal names mean equal content, so an existing file is reused
+        return name
+
+    def _save(self, name, content):
+        sha256 = hashlib.sha256()
+        content.seek(0)
+        for chunk in content.chunks():
+            sha256.update(chunk)
+        content.seek(0)
+
+        directory = posixpath.dirname(name)
+        name = self.blob_name(directory, sha256.hexdigest(), posixpath.splitext(name)[1])
+        if self.exists(name):
+            return name
+
+        # write beside it, then rename: readers never see a partial blob
+        partial = super()._save(
+            posixpath.join(directory, "incoming", get_random_string(32) + ".part"), content
+        )
+        return self.adopt(partial, name)
+
+    def adopt(self, partial, name):
+        """Move a fully written file in this storage to its blob name."""
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(self.path(partial), path)
+        return name
+
+
+report_storage = ContentAddressedStorage()
@@ -1,3 +1,1294 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time, timedelta
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from dashboards.stats import check_day_stats
+from doctors.models import Doctor, Holiday
+from doctors.schedule import get_schedule
+from . import availability, live, previews, uploads
+from .availability import availability_cache_stats, cached_free_slots, free_slots
+from .booking import (
+    HoldExpired,
+    SlotUnavailable,
+    book_slot,
+    cancel_booking,
+    confirm_hold,
+    release_expired_holds,
+)
+from .models import Appointment, AppointmentReport, ReportBlob, TimeSlot, WaitlistEntry
+from .slots import build_day_slots, materialize_slots
+
+
+def next_weekday(days_ahead=7):
+    day = timezone.localdate() + timedelta(days=days_ahead)
+    while day.weekday() >= 5:
+        day += timedelta(days=1)
+    return day
+
+
+class BookingTestMixin:
+    def setUp(self):
+        cache.clear()
+        self.patient = User.objects.create(username="9000000001")
+        self.doctor = Doctor.objects.create(
+            user=User.objects.create(username="doctor"),
+            name="Asha Rao",
+            specialization="Cardiology",
+            consultation_fee=500,
+        )
+        self.day = next_weekday()
+        self.client.force_login(self.patient)
+
+    def get_slots(self):
+        response = self.client.get(
+            reverse("appointments:slots_by_date", args=[self.doctor.id]),
+            {"date": self.day.isoformat()},
+        )
+        return response.json()["slots"]
+
+    def book(self, slot_id, consultation_type="CLINIC"):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(
+                reverse("appointments:book_appointment"),
+                {"slot_id": slot_id, "consultation_type": consultation_type},
+                content_type="application/json",
+            )
+
+
+# ------------------------
+# SLOT MATERIALIZATION
+# ------------------------
+class MaterializeSlotsTests(BookingTestMixin, TestCase):
+    def day_rows(self, day=None):
+        return TimeSlot.objects.filter(doctor=self.doctor, date=day or self.day)
+
+    def test_reruns_are_idempotent(self):
+        # clinic default: 10:00-12:00 and 13:00-17:00 in 30 minute slots
+        self.assertEqual(len(build_day_slots(self.doctor, self.day)), 12)
+
+        self.assertEqual(materialize_slots(self.doctor, self.day), 12)
+        ids = set(self.day_rows().values_list("id", flat=True))
+        self.assertEqual(len(ids), 12)
+
+        self.assertEqual(materialize_slots(self.doctor, self.day), 12)
+        self.assertEqual(set(self.day_rows().values_list("id", flat=True)), ids)
+
+    def test_rerun_fills_gaps_and_keeps_bookings(self):
+        materialize_slots(self.doctor, self.day)
+        first, second = self.day_rows().order_by("start_time")[:2]
+        book_slot(first.id, consultation_type="CLINIC", user=self.patient)
+        second.delete()
+
+        materialize_slots(self.doctor, self.day)
+
+        self.assertEqual(self.day_rows().count(), 12)
+        first.refresh_from_db()
+        self.assertFalse(first.is_available)
+        self.assertTrue(self.day_rows().get(start_time=second.start_time).is_available)
+
+    def test_day_stats_are_counted_from_the_new_rows(self):
+        get_schedule()  # compiled once per process, keep it out of the count
+        with self.assertNumQueries(4):  # read, insert, stats update/insert
+            materialize_slots(self.doctor, self.day)
+        self.assertEqual(check_day_stats([(self.doctor.id, self.day)]), [])
+
+        first, second = self.day_rows().order_by("start_time")[:2]
+        book_slot(first.id, consultation_type="CLINIC", user=self.patient)
+        second.delete()
+        materialize_slots(self.doctor, self.day)
+        self.assertEqual(check_day_stats([(self.doctor.id, self.day)]), [])
+
+    def test_past_days_and_days_off_write_nothing(self):
+        yesterday = timezone.localdate() - timedelta(days=1)
+        saturday = self.day + timedelta(days=5 - self.day.weekday())
+
+        self.assertEqual(materialize_slots(self.doctor, yesterday), 0)
+        self.assertEqual(materialize_slots(self.doctor, saturday), 0)
+        self.assertFalse(TimeSlot.objects.exists())
+
+    def test_non_positive_slot_length_is_refused(self):
+        interval = ((time(10), time(12), 0),)
+        with mock.patch("appointments.slots.working_intervals", return_value=interval):
+            with self.assertRaises(ValueError):
+                build_day_slots(self.doctor, self.day)
+
+    def test_unique_doctor_slot_start(self):
+        materialize_slots(self.doctor, self.day)
+        slot = self.day_rows().first()
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            TimeSlot.objects.create(
+                doctor=self.doctor,
+                date=self.day,
+                start_time=slot.start_time,
+                end_time=slot.end_time,
+            )
+
+
+# ------------------------
+# DEFAULT SLOT HORIZON
+# ------------------------
+class CreateDefaultSlotsMixin:
+    def setUp(self):
+        cache.clear()
+        self.doctors = [
+            Doctor.objects.create(
+                user=User.objects.create(username=f"doctor{i}"),
+                name=f"Doctor {i}",
+                specialization="Cardiology",
+            )
+            for i in range(3)
+        ]
+        Doctor.objects.create(
+            user=User.objects.create(username="retired"),
+            name="Retired",
+            specialization="Cardiology",
+            is_active=False,
+        )
+
+    def run_command(self, **options):
+        out = StringIO()
+        call_command("create_default_slots", stdout=out, **options)
+        return out.getvalue()
+
+    def expected_slots(self, days):
+        today = timezone.localdate()
+        return {
+            (doctor.id, today + timedelta(days=i)): len(build_day_slots(doctor, today + timedelta(days=i)))
+            for doctor in self.doctors
+            for i in range(days)
+        }
+
+    def created_slots(self):
+        counts = {}
+        for doctor_id, day in TimeSlot.objects.values_list("doctor_id", "date"):
+            counts[doctor_id, day] = counts.get((doctor_id, day), 0) + 1
+        return counts
+
+
+class CreateDefaultSlotsTests(CreateDefaultSlotsMixin, TestCase):
+    def test_fills_the_horizon_for_active_doctors(self):
+        expected = self.expected_slots(10)
+        out = self.run_command(days=10, workers=1)
+
+        self.assertEqual(
+            self.created_slots(), {key: n for key, n in expected.items() if n}
+        )
+        self.assertIn(f"{sum(expected.values())} slots created for 3 doctors over 10 days", out)
+
+    def test_day_stats_are_counted(self):
+        self.run_command(days=10, workers=1, batch_size=7)
+        # a gap in one day and a day with no rows left at all
+        TimeSlot.objects.filter(id=TimeSlot.objects.order_by("id")[0].id).delete()
+        gone = TimeSlot.objects.order_by("-id")[0]
+        TimeSlot.objects.filter(doctor_id=gone.doctor_id, date=gone.date).delete()
+        self.run_command(days=10, workers=1, batch_size=7)
+
+        self.assertEqual(check_day_stats(self.expected_slots(10)), [])
+
+    def test_rerun_skips_complete_doctors_and_extends_the_horizon(self):
+        self.run_command(days=5, workers=1)
+        out = self.run_command(days=5, workers=1)
+        self.assertIn("0 slots created for 0 doctors", out)
+        self.assertIn("Skipped 3 doctors", out)
+
+        expected = self.expected_slots(8)
+        self.run_command(days=8, workers=1)
+        self.assertEqual(
+            self.created_slots(), {key: n for key, n in expected.items() if n}
+        )
+
+
+class CreateDefaultSlotsWorkerTests(CreateDefaultSlotsMixin, TransactionTestCase):
+    def test_workers_split_doctors_without_overlap(self):
+        # forked children can't see the in-memory test database, so the
+        # chunks run one after another on a thread (SQLite would lock
+        # concurrent writers anyway); splitting and merging are the same
+        from appointments.management.commands import create_default_slots
+
+        def pool(workers, initializer):
+            return ThreadPoolExecutor(1, initializer=initializer)
+
+        with mock.patch.object(create_default_slots, "ProcessPoolExecutor", pool):
+            out = self.run_command(days=6, workers=2, batch_size=7)
+            self.assertIn("2 workers", out)
+
+            expected = self.expected_slots(6)
+            self.assertEqual(
+                self.created_slots(), {key: n for key, n in expected.items() if n}
+            )
+            self.assertIn("Skipped 3 doctors", self.run_command(days=6, workers=3))
+
+
+# ------------------------
+# AVAILABILITY CACHE
+# ------------------------
+class AvailabilityCacheTests(BookingTestMixin, TestCase):
+    def assert_booked_slot_hidden(self):
+        slots = self.get_slots()
+        booked = slots[0]["id"]
+
+        self.assertEqual(self.book(booked).status_code, 200)
+
+        ids = [s["id"] for s in self.get_slots()]
+        self.assertNotIn(booked, ids)
+        self.assertEqual(len(ids), len(slots) - 1)
+
+    def test_cached_read_hides_booked_slot(self):
+        self.assert_booked_slot_hidden()
+
+    @override_settings(SLOT_AVAILABILITY_MODE="virtual")
+    def test_cached_read_hides_booked_slot_virtual(self):
+        self.assert_booked_slot_hidden()
+
+    def test_read_racing_with_booking_is_not_served(self):
+        # the read computes its result, then a booking commits before
+        # the result is stored; the stale entry must never be returned
+        real_free_slots = availability.free_slots
+
+        def free_slots_then_booking(doctor, slot_date):
+            result = real_free_slots(doctor, slot_date)
+            self.book(result[0]["id"])
+            return result
+
+        with mock.patch.object(availability, "free_slots", free_slots_then_booking):
+            stale = cached_free_slots(self.doctor, self.day)
+
+        ids = [s["id"] for s in self.get_slots()]
+        self.assertNotIn(stale[0]["id"], ids)
+
+    def test_cancel_frees_slot(self):
+        booked = self.get_slots()[0]["id"]
+        appointment_id = self.book(booked).json()["appointment_id"]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                reverse("appointments:cancel_appointment", args=[appointment_id])
+            )
+
+        self.assertIn(booked, [s["id"] for s in self.get_slots()])
+
+    def test_hit_and_miss_counters(self):
+        self.get_slots()
+        self.get_slots()
+        self.get_slots()
+
+        self.assertEqual(availability_cache_stats(), {"hits": 2, "misses": 1})
+
+
+# ------------------------
+# VIRTUAL SLOT IDS
+# ------------------------
+class SlotTokenTests(BookingTestMixin, TestCase):
+    def token(self, start=time(10), day=None):
+        return availability.slot_token(self.doctor.id, day or self.day, start)
+
+    def day_rows(self):
+        return TimeSlot.objects.filter(doctor=self.doctor, date=self.day)
+
+    def test_deleted_slot_stays_deleted(self):
+        materialize_slots(self.doctor, self.day)
+        self.day_rows().get(start_time=time(10)).delete()
+
+        self.assertEqual(self.book(self.token()).status_code, 409)
+        self.assertEqual(self.day_rows().count(), 11)
+
+    def test_token_finds_a_manual_slot(self):
+        materialize_slots(self.doctor, self.day)
+        manual = TimeSlot.objects.create(
+            doctor=self.doctor, date=self.day, start_time=time(17), end_time=time(17, 30)
+        )
+        self.assertEqual(availability.resolve_slot_id(self.token(time(17))), manual.id)
+
+    def test_dates_outside_the_booking_horizon_are_refused(self):
+        yesterday = timezone.localdate() - timedelta(days=1)
+        too_far = next_weekday(settings.BOOKING_HORIZON_DAYS)
+        for day in (yesterday, too_far):
+            with self.subTest(day=day):
+                self.assertIsNone(availability.resolve_slot_id(self.token(day=day)))
+        self.assertFalse(TimeSlot.objects.exists())
+
+
+@override_settings(SLOT_AVAILABILITY_MODE="virtual")
+class VirtualAvailabilityTests(BookingTestMixin, TestCase):
+    def test_booking_writes_only_the_booked_slot(self):
+        slots = self.get_slots()
+        self.assertTrue(all(s["id"].startswith("v-") for s in slots))
+
+        self.assertEqual(self.book(slots[0]["id"]).status_code, 200)
+
+        self.assertEqual(TimeSlot.objects.count(), 1)
+        self.assertEqual(
+            [s["id"] for s in self.get_slots()], [s["id"] for s in slots[1:]]
+        )
+        self.assertEqual(check_day_stats([(self.doctor.id, self.day)]), [])
+
+    def test_cancelled_slot_is_bookable_again(self):
+        first = self.get_slots()[0]
+        appointment_id = self.book(first["id"]).json()["appointment_id"]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("appointments:cancel_appointment", args=[appointment_id]))
+
+        again = self.get_slots()[0]
+        self.assertEqual(again["start"], first["start"])
+        self.assertEqual(again["id"], TimeSlot.objects.get().id)
+        self.assertEqual(self.book(again["id"]).status_code, 200)
+        self.assertEqual(check_day_stats([(self.doctor.id, self.day)]), [])
+
+    def test_stale_tokens_are_refused(self):
+        token = self.get_slots()[0]["id"]
+        self.assertEqual(self.book(token).status_code, 200)
+        self.assertEqual(self.book(token).status_code, 409)
+
+        # a time the template doesn't have (or no longer has)
+        off_grid = availability.slot_token(self.doctor.id, self.day, time(10, 15))
+        self.assertEqual(self.book(off_grid).status_code, 409)
+        self.assertEqual(TimeSlot.objects.count(), 1)
+
+
+# ------------------------
+# RANGE ENDPOINT
+# ------------------------
+class AvailabilityRangeTests(BookingTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.other = Doctor.objects.create(
+            user=User.objects.create(username="doctor2"),
+            name="Vikram Shah",
+            specialization="Dermatology",
+        )
+
+    def get_range(self, days, **params):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse("appointments:slots_by_range"), {
+                "doctor": [self.doctor.id, self.other.id],
+                "start": self.day.isoformat(),
+                "end": (self.day + timedelta(days=days - 1)).isoformat(),
+                **params,
+            })
+        return response, len(ctx.captured_queries)
+
+    def test_query_count_is_independent_of_range_length(self):
+        self.book(self.get_slots()[0]["id"])
+
+        _, one_day = self.get_range(1)
+        response, four_weeks = self.get_range(28, include_slots="1")
+
+        self.assertEqual(one_day, four_weeks)
+        doctors = {d["id"]: d for d in response.json()["doctors"]}
+        first_day = doctors[self.doctor.id]["days"][0]
+        self.assertEqual(first_day["free"], 11)
+        self.assertEqual(len(first_day["slots"]), 11)
+
+    def test_range_is_capped(self):
+        response, _ = self.get_range(32)
+        self.assertEqual(response.status_code, 400)
+
+
+# ------------------------
+# NEXT AVAILABLE SEARCH
+# ------------------------
+class NextAvailableTests(BookingTestMixin, TestCase):
+    def test_earliest_slots_for_specialization(self):
+        Doctor.objects.create(
+            user=User.objects.create(username="doctor2"),
+            name="Vikram Shah",
+            specialization="Dermatology",
+        )
+
+        first = self.client.get(
+            reverse("appointments:next_available"),
+            {"specialization": "cardiology", "limit": 3},
+        ).json()["slots"]
+
+        self.assertEqual(len(first), 3)
+        self.assertEqual({s["doctor"]["id"] for s in first}, {self.doctor.id})
+
+        self.book(first[0]["id"])
+
+        after = self.client.get(
+            reverse("appointments:next_available"),
+            {"specialization": "cardiology", "limit": 3},
+        ).json()["slots"]
+        # ids may change once the day is written, so compare times
+        times = [(s["date"], s["label"]) for s in after]
+        self.assertNotIn((first[0]["date"], first[0]["label"]), times)
+        self.assertEqual(times[0], (first[1]["date"], first[1]["label"]))
+
+    def slot_queries(self, ctx):
+        return sum("appointments_timeslot" in q["sql"] for q in ctx.captured_queries)
+
+    def scan(self, doctors):
+        """Every free slot of the horizon, as the search should order them."""
+        today = timezone.localdate()
+        cutoff = timezone.localtime().time()
+        return sorted(
+            (day, s["start_time"], doctor_id, s["id"])
+            for doctor_id, days in availability.free_slots_for_range(
+                doctors, today, availability.horizon_end()
+            ).items()
+            for day, slots in days.items()
+            for s in slots
+            if day != today or s["start_time"] > cutoff
+        )
+
+    @mock.patch("doctors.schedule._compiled", None)
+    def test_search_matches_a_full_scan(self):
+        other = Doctor.objects.create(
+            user=User.objects.create(username="doctor2"),
+            name="Vikram Shah",
+            specialization="Dermatology",
+        )
+        doctors = [self.doctor, other]
+        today = timezone.localdate()
+        for n in range(4):
+            Holiday.objects.create(date=today + timedelta(days=n), doctor=other)
+
+        for mode in ("materialized", "virtual"):
+            with self.subTest(mode=mode), self.settings(SLOT_AVAILABILITY_MODE=mode):
+                TimeSlot.objects.all().delete()
+                materialize_slots(other, self.day)
+                first = free_slots(self.doctor, self.day)[0]["id"]
+                book_slot(first, consultation_type="CLINIC", user=self.patient)
+                # a row left on a day the doctor has since taken off
+                TimeSlot.objects.create(
+                    doctor=other, date=today + timedelta(days=1),
+                    start_time=time(9), end_time=time(9, 30)
+                )
+
+                expected = self.scan(doctors)
+                for limit in (1, 5, 20):
+                    found = availability.next_available(doctors, limit)
+                    self.assertEqual(
+                        [(day, s["start_time"], d.id, s["id"]) for day, d, s in found],
+                        expected[:limit],
+                    )
+
+                first = availability.next_slot_by_doctor(doctors)
+                for doctor in doctors:
+                    day, start, _, slot_id = next(e for e in expected if e[2] == doctor.id)
+                    self.assertEqual(first[doctor.id][0], day)
+                    self.assertEqual(first[doctor.id][1]["id"], slot_id)
+
+    @mock.patch("doctors.schedule._compiled", None)
+    def test_query_count_does_not_grow_with_the_horizon(self):
+        # on leave for the whole horizon: nothing to find anywhere
+        today = timezone.localdate()
+        for n in range(28):
+            Holiday.objects.create(date=today + timedelta(days=n), doctor=self.doctor)
+
+        for mode, queries in (("materialized", 2), ("virtual", 1)):
+            for days in (14, 28):
+                with self.subTest(mode=mode, days=days), \
+                        self.settings(SLOT_AVAILABILITY_MODE=mode):
+                    with CaptureQueriesContext(connection) as ctx:
+                        self.assertEqual(availability.next_available([self.doctor], 5, days), [])
+                    self.assertEqual(self.slot_queries(ctx), queries)
+
+                    with CaptureQueriesContext(connection) as ctx:
+                        self.assertEqual(availability.next_slot_by_doctor([self.doctor], days), {})
+                    self.assertEqual(self.slot_queries(ctx), queries)
+
+
+# ------------------------
+# BATCH BOOKING
+# ------------------------
+class BatchBookingTests(BookingTestMixin, TestCase):
+    def book_weekly(self, count, **params):
+        with CaptureQueriesContext(connection) as ctx:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(
+                    reverse("appointments:book_appointments_batch"),
+                    {
+                        "consultation_type": "CLINIC",
+                        "recurrence": {
+                            "doctor_id": self.doctor.id,
+                            "date": self.day.isoformat(),
+                            "time": "10:00",
+                            "count": count,
+                        },
+                        **params,
+                    },
+                    content_type="application/json",
+                )
+        return response, len(ctx.captured_queries)
+
+    def test_recurring_booking_query_count_is_bounded(self):
+        get_schedule()  # compiled once per process, keep it out of the count
+        response, two_weeks = self.book_weekly(2)
+        self.assertEqual(response.json()["status"], "CONFIRMED")
+
+        self.day += timedelta(weeks=2)
+        response, eight_weeks = self.book_weekly(8)
+
+        self.assertEqual(two_weeks, eight_weeks)
+        self.assertEqual(len(response.json()["results"]), 8)
+        self.assertEqual(response.json()["amount"], 8 * 500)
+        self.assertEqual(
+            Appointment.objects.filter(user=self.patient, status="BOOKED").count(), 10
+        )
+
+    def test_batch_is_all_or_nothing_unless_partial(self):
+        taken = free_slots(self.doctor, self.day + timedelta(weeks=1))[0]["id"]
+        book_slot(taken, consultation_type="CLINIC", user=self.patient)
+
+        response, _ = self.book_weekly(3)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Appointment.objects.count(), 1)
+
+        response, _ = self.book_weekly(3, partial=True)
+        data = response.json()
+        self.assertEqual(data["status"], "PARTIAL")
+        self.assertEqual(
+            [r["status"] for r in data["results"]], ["BOOKED", "UNAVAILABLE", "BOOKED"]
+        )
+
+    def test_recurrence_matches_rows_before_the_template(self):
+        weeks = [self.day + timedelta(weeks=n) for n in range(3)]
+        for day in weeks:
+            materialize_slots(self.doctor, day)
+        # week 2 dropped its 10:00 slot; every week has a manual 17:00
+        TimeSlot.objects.filter(date=weeks[1], start_time=time(10)).delete()
+        for day in weeks:
+            TimeSlot.objects.create(
+                doctor=self.doctor, date=day, start_time=time(17), end_time=time(17, 30)
+            )
+
+        data = self.book_weekly(3, partial=True)[0].json()
+        self.assertEqual(
+            [r["status"] for r in data["results"]], ["BOOKED", "UNAVAILABLE", "BOOKED"]
+        )
+        self.assertFalse(TimeSlot.objects.filter(date=weeks[1], start_time=time(10)).exists())
+
+        response = self.client.post(
+            reverse("appointments:book_appointments_batch"),
+            {
+                "consultation_type": "CLINIC",
+                "recurrence": {
+                    "doctor_id": self.doctor.id,
+                    "date": self.day.isoformat(),
+                    "time": "17:00",
+                    "count": 3,
+                },
+            },
+            content_type="application/json",
+        )
+        self.assertEqual(response.json()["status"], "CONFIRMED")
+
+
+# ------------------------
+# PAYMENT HOLDS
+# ------------------------
+class SlotHoldTests(BookingTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.slot_id = free_slots(self.doctor, self.day)[0]["id"]
+        self.held = book_slot(self.slot_id, user=self.patient)
+
+    def expire(self):
+        past = timezone.now() - timedelta(minutes=1)
+        TimeSlot.objects.filter(id=self.slot_id).update(held_until=past)
+        Appointment.objects.filter(id=self.held.id).update(hold_expires_at=past)
+        self.held.refresh_from_db()
+
+    def test_online_booking_holds_slot(self):
+        self.assertTrue(self.held.is_held)
+        self.assertNotIn(self.slot_id, [s["id"] for s in free_slots(self.doctor, self.day)])
+
+    def test_expired_hold_is_free_before_sweep(self):
+        self.expire()
+        self.assertIn(self.slot_id, [s["id"] for s in free_slots(self.doctor, self.day)])
+
+        rebooked = book_slot(self.slot_id, consultation_type="CLINIC", user=self.patient)
+
+        self.held.refresh_from_db()
+        self.assertEqual(self.held.status, "CANCELLED")
+        with self.assertRaises(HoldExpired):
+            confirm_hold(self.held)
+        self.assertEqual(rebooked.status, "BOOKED")
+
+    def test_late_payment_kept_if_slot_not_taken(self):
+        self.expire()
+        confirm_hold(self.held)
+
+        slot = TimeSlot.objects.get(id=self.slot_id)
+        self.assertIsNone(slot.held_until)
+        self.assertFalse(slot.is_available)
+        with self.assertRaises(SlotUnavailable):
+            book_slot(self.slot_id, user=self.patient)
+
+    def test_sweeper_releases_only_expired_holds(self):
+        other = book_slot(free_slots(self.doctor, self.day)[0]["id"], user=self.patient)
+        self.expire()
+
+        self.assertEqual(release_expired_holds(batch_size=1), 1)
+
+        self.held.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(self.held.status, "CANCELLED")
+        self.assertTrue(TimeSlot.objects.get(id=self.slot_id).is_available)
+        self.assertTrue(other.is_held)
+
+
+# ------------------------
+# BOOKING ENGINE
+# ------------------------
+class ConcurrentBookingTests(BookingTestMixin, TransactionTestCase):
+    attempts = 200
+
+    def test_exactly_one_concurrent_booking_wins(self):
+        slot_id = free_slots(self.doctor, self.day)[0]["id"]
+
+        def attempt(i):
+            try:
+                book_slot(slot_id, user=self.patient)
+                return True
+            except SlotUnavailable:
+                return False
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=32) as pool:
+            results = list(pool.map(attempt, range(self.attempts)))
+
+        self.assertEqual(results.count(True), 1)
+        self.assertEqual(Appointment.objects.filter(slot_id=slot_id).count(), 1)
+
+    def test_slot_can_be_rebooked_after_cancellation(self):
+        slot_id = free_slots(self.doctor, self.day)[0]["id"]
+
+        first = book_slot(slot_id, user=self.patient)
+        with self.assertRaises(SlotUnavailable):
+            book_slot(slot_id, user=self.patient)
+
+        first.status = "CANCELLED"
+        first.save()
+        first.slot.is_available = True
+        first.slot.save()
+
+        second = book_slot(slot_id, user=self.patient)
+        self.assertNotEqual(first.id, second.id)
+
+
+# ------------------------
+# WAITLIST
+# ------------------------
+class WaitlistTests(BookingTestMixin, TestCase):
+    def wait(self, username, priority=0):
+        return WaitlistEntry.objects.create(
+            doctor=self.doctor,
+            date=self.day,
+            user=User.objects.create(username=username),
+            consultation_type="CLINIC",
+            priority=priority,
+        )
+
+    def test_join_refused_while_slots_are_free(self):
+        response = self.client.post(
+            reverse("appointments:join_waitlist"),
+            {"doctor_id": self.doctor.id, "date": self.day.isoformat()},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 409)
+
+    def test_cancellation_promotes_by_priority_then_age(self):
+        booked = book_slot(free_slots(self.doctor, self.day)[0]["id"], user=self.patient)
+        first = self.wait("9000000002")
+        urgent = self.wait("9000000003", priority=5)
+
+        self.assertTrue(cancel_booking(booked))
+        self.assertFalse(cancel_booking(booked))
+
+        urgent.refresh_from_db()
+        first.refresh_from_db()
+        self.assertEqual(urgent.status, "PROMOTED")
+        self.assertEqual(urgent.appointment.slot_id, booked.slot_id)
+        self.assertEqual(first.status, "WAITING")
+        self.assertFalse(TimeSlot.objects.get(id=booked.slot_id).is_available)
+
+
+class ConcurrentWaitlistTests(BookingTestMixin, TransactionTestCase):
+    def test_concurrent_cancellations_promote_distinct_patients(self):
+        slots = [s["id"] for s in free_slots(self.doctor, self.day)][:8]
+        booked = [book_slot(slot_id, user=self.patient) for slot_id in slots]
+        for i in range(20):
+            WaitlistEntry.objects.create(
+                doctor=self.doctor,
+                date=self.day,
+                user=User.objects.create(username=f"waiting-{i}"),
+                consultation_type="CLINIC",
+            )
+
+        def cancel(appointment):
+            try:
+                return cancel_booking(appointment)
+            finally:
+                connection.close()
+
+        # every appointment is cancelled twice at once
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            results = list(pool.map(cancel, booked * 2))
+
+        self.assertEqual(results.count(True), len(booked))
+        promoted = WaitlistEntry.objects.filter(status="PROMOTED")
+        self.assertEqual(promoted.count(), len(booked))
+        self.assertEqual(
+            set(promoted.values_list("appointment__slot_id", flat=True)), set(slots)
+        )
+        self.assertEqual(
+            Appointment.objects.filter(slot_id__in=slots, status="BOOKED").count(),
+            len(slots),
+        )
+
+
+# ------------------------
+# HISTORY
+# ------------------------
+class AppointmentHistoryTests(BookingTestMixin, TestCase):
+    def add_appointments(self, count):
+        day = self.day
+        while count:
+            for slot in free_slots(self.doctor, day)[:count]:
+                appointment = book_slot(slot["id"], consultation_type="CLINIC", user=self.patient)
+                AppointmentReport.objects.bulk_create(
+                    AppointmentReport(appointment=appointment, file=f"appointment_reports/{n}.pdf")
+                    for n in range(2)
+                )
+                count -= 1
+            day = next_weekday((day - timezone.localdate()).days + 1)
+
+    def get_history(self, **params):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse("appointments:appointment_history"), params)
+        return response, len(ctx.captured_queries)
+
+    def test_query_count_is_fixed(self):
+        self.add_appointments(2)
+        _, few = self.get_history()
+
+        self.add_appointments(40)
+        response, many = self.get_history()
+
+        self.assertEqual(few, many)
+        self.assertEqual(len(response.context["appointments"]), 20)
+
+    def test_cursor_walks_every_appointment_once(self):
+        self.add_appointments(45)
+
+        seen = []
+        params = {}
+        while True:
+            response, _ = self.get_history(**params)
+            seen += [a.id for a in response.context["appointments"]]
+            if not response.context["next_cursor"]:
+                break
+            params = {"before": response.context["next_cursor"]}
+
+        self.assertEqual(seen, list(
+            Appointment.objects.order_by("-created_at", "-id").values_list("id", flat=True)
+        ))
+        self.assertTrue(all(a.can_cancel() for a in response.context["appointments"]))
+
+
+# ------------------------
+# TIME FLAGS
+# ------------------------
+class TimeFlagTests(BookingTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        yesterday = timezone.localdate() - timedelta(days=1)
+        past_slot = TimeSlot.objects.create(
+            doctor=self.doctor, date=yesterday, start_time=time(9, 0), end_time=time(9, 30)
+        )
+        self.past = book_slot(past_slot.id, consultation_type="CLINIC", user=self.patient)
+        self.upcoming = book_slot(
+            free_slots(self.doctor, self.day)[0]["id"], consultation_type="CLINIC", user=self.patient
+        )
+
+    def test_flags_are_annotated_in_sql(self):
+        rows = list(Appointment.objects.with_time_flags().order_by("-starts_at"))
+
+        self.assertEqual([a.id for a in rows], [self.upcoming.id, self.past.id])
+        self.assertEqual(
+            rows[0].starts_at,
+            timezone.make_aware(datetime.combine(self.day, self.upcoming.slot.start_time))
+        )
+        self.assertEqual([(a.is_past, a.can_cancel()) for a in rows], [(False, True), (True, False)])
+        self.assertEqual(
+            list(Appointment.objects.with_time_flags().filter(is_past=True)), [self.past]
+        )
+
+    def test_slot_edit_moves_its_appointments(self):
+        slot = self.upcoming.slot
+        slot.start_time, slot.end_time = time(6, 0), time(6, 30)
+        slot.save()
+
+        self.upcoming.refresh_from_db()
+        self.assertEqual(self.upcoming.starts_at, slot.starts_at)
+        self.assertEqual(self.upcoming.ends_at, slot.ends_at)
+        self.assertEqual(self.upcoming.date, self.day)
+
+    def test_listings_do_not_join_slots(self):
+        self.client.force_login(self.doctor.user)
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(
+                reverse("doctors:doctor_appointments"), {"date": self.day.isoformat()}
+            )
+            self.client.force_login(self.patient)
+            self.client.get(reverse("appointments:appointment_history"))
+
+        listing = [q["sql"] for q in ctx.captured_queries if "appointments_appointment" in q["sql"]]
+        self.assertTrue(listing)
+        self.assertFalse(any(TimeSlot._meta.db_table in sql for sql in listing))
+
+    def test_cancel_checks_the_rule_in_its_update(self):
+        response = self.client.post(
+            reverse("appointments:cancel_appointment", args=[self.past.id])
+        )
+        self.assertEqual(response.status_code, 403)
+        self.past.refresh_from_db()
+        self.assertEqual(self.past.status, "BOOKED")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("appointments:cancel_appointment", args=[self.upcoming.id]))
+        self.upcoming.refresh_from_db()
+        self.assertEqual(self.upcoming.status, "CANCELLED")
+
+
+# ------------------------
+# LIVE SLOT EVENTS
+# ------------------------
+@override_settings(SSE_POLL_INTERVAL=0.01, SSE_KEEPALIVE_SECONDS=0.05)
+class SlotEventStreamTests(BookingTestMixin, TransactionTestCase):
+    async def next_event(self, stream):
+        while True:
+            chunk = await asyncio.wait_for(anext(stream), 5)
+            chunk = chunk.decode() if isinstance(chunk, bytes) else chunk
+            if chunk.startswith("id:"):
+                return chunk
+
+    async def test_stream_pushes_taken_and_freed(self):
+        await sync_to_async(self.async_client.force_login)(self.patient)
+        slot_id = (await sync_to_async(free_slots)(self.doctor, self.day))[0]["id"]
+
+        response = await self.async_client.get(
+            reverse("appointments:slot_events", args=[self.doctor.id]),
+            {"date": self.day.isoformat()},
+        )
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        stream = aiter(response.streaming_content)
+        await asyncio.wait_for(anext(stream), 5)  # retry: hint, subscribes
+
+        appointment = await sync_to_async(book_slot)(slot_id, user=self.patient)
+        taken = await self.next_event(stream)
+
+        await sync_to_async(cancel_booking)(appointment)
+        freed = await self.next_event(stream)
+        await stream.aclose()
+
+        self.assertIn('"kind": "taken"', taken)
+        self.assertIn(f'"id": {slot_id}', taken)
+        self.assertIn('"kind": "freed"', freed)
+
+    async def test_hub_outlives_a_failed_poll(self):
+        slot_id = (await sync_to_async(free_slots)(self.doctor, self.day))[0]["id"]
+        key = (self.doctor.id, self.day)
+        hub = live.SlotEventHub()
+        queue = hub.subscribe(key)
+
+        failures = [DatabaseError("database table is locked")]
+        events_after = live._events_after
+
+        def flaky(last_id):
+            if failures:
+                raise failures.pop()
+            return events_after(last_id)
+
+        with mock.patch.object(live, "_events_after", flaky), self.assertLogs("appointments.live"):
+            await hub.start()
+            await sync_to_async(book_slot)(slot_id, user=self.patient)
+            event = await asyncio.wait_for(queue.get(), 5)
+            hub.unsubscribe(key, queue)
+            await asyncio.wait_for(hub.task, 5)
+
+        self.assertEqual(event.slot_id, slot_id)
+
+    def test_wsgi_requests_poll(self):
+        self.client.force_login(self.patient)
+        url = reverse("appointments:slot_events", args=[self.doctor.id])
+        slot_id = free_slots(self.doctor, self.day)[0]["id"]
+
+        first = self.client.get(url, {"date": self.day.isoformat()})
+        self.assertFalse(first.streaming)
+        self.assertEqual(first["Content-Type"], "text/event-stream")
+        body = first.content.decode()
+        self.assertIn(f"retry: {settings.SSE_POLL_FALLBACK_MS}", body)
+        cursor = body.split("id: ")[1].split()[0]
+
+        book_slot(slot_id, user=self.patient)
+        response = self.client.get(
+            url, {"date": self.day.isoformat()}, headers={"Last-Event-ID": cursor}
+        )
+        self.assertEqual(response.content.decode().count("event: slot"), 1)
+        self.assertIn('"kind": "taken"', response.content.decode())
+
+
+# ------------------------
+# REPORT UPLOADS
+# ------------------------
+@override_settings(REPORT_UPLOAD_MAX_FILE_SIZE=1024 * 1024)
+class ReportUploadTests(BookingTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.media = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        self.enterContext(self.settings(MEDIA_ROOT=self.media))
+
+        self.appointment = book_slot(
+            free_slots(self.doctor, self.day)[0]["id"], consultation_type="CLINIC", user=self.patient
+        )
+        self.url = reverse("appointments:upload_report", args=[self.appointment.id])
+
+    def stored_files(self):
+        return sorted(p.name for p in self.media.rglob("*") if p.is_file())
+
+    def test_reports_stream_to_storage_with_one_insert(self):
+        pdf = b"%PDF-1.7\n" + b"x" * 600_000
+        png = b"\x89PNG\r\n\x1a\n" + b"y" * 100
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(self.url, {"reports": [
+                SimpleUploadedFile("scan.pdf", pdf),
+                SimpleUploadedFile("photo.png", png),
+            ]})
+
+        self.assertEqual(response.status_code, 302)
+        inserts = [q for q in ctx.captured_queries if q["sql"].startswith(
+            'INSERT INTO "appointments_appointmentreport"'
+        )]
+        self.assertEqual(len(inserts), 1)
+
+        reports = self.appointment.reports.select_related("blob").order_by("blob__size")
+        self.assertEqual([r.blob.size for r in reports], [len(png), len(pdf)])
+        sha256 = hashlib.sha256(pdf).hexdigest()
+        self.assertEqual(reports[1].blob.sha256, sha256)
+        with reports[1].file.open("rb") as f:
+            self.assertEqual(f.read(), pdf)
+        self.assertEqual(self.stored_files(), sorted([
+            hashlib.sha256(png).hexdigest() + ".png", sha256 + ".pdf"
+        ]))
+
+    def test_equal_files_share_one_blob_until_the_last_report_goes(self):
+        pdf = b"%PDF-1.7\n same lab report"
+        other = book_slot(
+            free_slots(self.doctor, self.day)[1]["id"], consultation_type="CLINIC", user=self.patient
+        )
+        for appointment in (self.appointment, self.appointment, other):
+            self.client.post(
+                reverse("appointments:upload_report", args=[appointment.id]),
+                {"reports": SimpleUploadedFile("lab.pdf", pdf)},
+            )
+
+        blob = ReportBlob.objects.get()
+        self.assertEqual((blob.sha256, blob.refcount), (hashlib.sha256(pdf).hexdigest(), 3))
+        self.assertEqual(len(self.stored_files()), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            for report in self.appointment.reports.all():
+                self.client.post(reverse("appointments:delete_report", args=[report.id]))
+        blob.refresh_from_db()
+        self.assertEqual(blob.refcount, 1)
+        self.assertEqual(len(self.stored_files()), 1)
+
+        # a cascade drops the last reference too
+        with self.captureOnCommitCallbacks(execute=True):
+            other.delete()
+        self.assertFalse(ReportBlob.objects.exists())
+        self.assertEqual(self.stored_files(), [])
+
+    def test_limits_reject_the_whole_upload(self):
+        cases = [
+            (413, [b"%PDF-" + b"x" * (1024 * 1024)]),
+            (415, [b"%PDF-1.7 fine", b"MZ\x90\x00 not a pdf at all"]),
+        ]
+        for status, contents in cases:
+            with self.subTest(status=status):
+                response = self.client.post(self.url, {"reports": [
+                    SimpleUploadedFile(f"report{i}.pdf", content)
+                    for i, content in enumerate(contents)
+                ]})
+                self.assertEqual(response.status_code, status)
+                self.assertFalse(self.appointment.reports.exists())
+                self.assertEqual(self.stored_files(), [])
+
+        response = self.client.post(self.url, {"reports": SimpleUploadedFile("notes.txt", b"%PDF-")})
+        self.assertEqual(response.status_code, 415)
+
+    def test_csrf_is_checked_before_anything_is_written(self):
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.patient)
+        client.get(self.url)
+        token = client.cookies[settings.CSRF_COOKIE_NAME].value
+        pdf = b"%PDF-1.7 lab"
+
+        for data, headers in (
+            ({}, {}),
+            ({"csrfmiddlewaretoken": token}, {}),  # only readable by parsing the upload
+            ({}, {"X-CSRFToken": "x" * 32}),
+        ):
+            with self.subTest(data=data, headers=headers), \
+                    mock.patch.object(uploads.ReportUploadHandler, "_open") as opened:
+                response = client.post(
+                    self.url, {**data, "reports": SimpleUploadedFile("lab.pdf", pdf)}, headers=headers
+                )
+                self.assertEqual(response.status_code, 403)
+                opened.assert_not_called()
+
+        response = client.post(
+            self.url,
+            {"csrfmiddlewaretoken": token, "reports": SimpleUploadedFile("lab.pdf", pdf)},
+            headers={"X-CSRFToken": token},
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.appointment.reports.count(), 1)
+
+
+# ------------------------
+# REPORT PREVIEWS
+# ------------------------
+def fake_render(source, destination, size):
+    Path(destination).write_bytes(b"\xff\xd8\xff preview of " + Path(source).name.encode())
+
+
+@override_settings(REPORT_PREVIEW_WORKERS=0)
+class ReportPreviewTests(BookingTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.media = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        self.enterContext(self.settings(MEDIA_ROOT=self.media))
+        self.render = self.enterContext(mock.patch.dict(
+            previews.RENDERERS, {".pdf": mock.Mock(side_effect=fake_render)}, clear=True
+        ))[".pdf"]
+
+        self.appointment = book_slot(
+            free_slots(self.doctor, self.day)[0]["id"], consultation_type="CLINIC", user=self.patient
+        )
+
+    def upload(self, appointment, content, name="scan.pdf"):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                reverse("appointments:upload_report", args=[appointment.id]),
+                {"reports": SimpleUploadedFile(name, content)},
+            )
+
+    def test_previews_are_built_once_per_content_and_cached(self):
+        pdf = b"%PDF-1.7\n blood panel"
+        other = book_slot(
+            free_slots(self.doctor, self.day)[1]["id"], consultation_type="CLINIC", user=self.patient
+        )
+        self.upload(self.appointment, pdf)
+        self.upload(other, pdf)
+        self.upload(other, b"\x89PNG\r\n\x1a\n no renderer patched in", "photo.png")
+
+        self.assertEqual(self.render.call_count, 1)
+        blob = ReportBlob.objects.get(sha256=hashlib.sha256(pdf).hexdigest())
+        self.assertEqual(
+            blob.preview, f"appointment_reports/previews/{blob.sha256[:2]}/{blob.sha256}.jpg"
+        )
+        self.assertEqual(ReportBlob.objects.exclude(preview="").count(), 1)
+
+        report = self.appointment.reports.get()
+        url = reverse("appointments:report_preview", args=[report.id, blob.sha256])
+        self.client.force_login(self.doctor.user)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "image/jpeg")
+        self.assertIn("immutable", response["Cache-Control"])
+        self.assertTrue(b"".join(response.streaming_content).startswith(b"\xff\xd8\xff"))
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=f'"{blob.sha256}"')
+        self.assertEqual(response.status_code, 304)
+
+        self.client.force_login(User.objects.create(username="9000000002"))
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.appointment.delete()
+            other.delete()
+        self.assertEqual(sorted(self.media.rglob("*.jpg")), [])
+
+    def test_backfill_builds_missing_previews(self):
+        with mock.patch("appointments.views.schedule_previews"):  # e.g. a restart
+            self.upload(self.appointment, b"%PDF-1.7\n x-ray")
+        self.assertEqual(ReportBlob.objects.get().preview, "")
+
+        out = StringIO()
+        call_command("build_report_previews", workers=1, stdout=out)
+        self.assertIn("1 previews built for 1 report files", out.getvalue())
+        self.assertNotEqual(ReportBlob.objects.get().preview, "")
+
+    def test_failed_previews_wait_for_retry_failed(self):
+        self.render.side_effect = OSError("renderer crashed")
+        with self.assertLogs("appointments.previews", "ERROR"):
+            self.upload(self.appointment, b"%PDF-1.7\n x-ray")
+        self.assertEqual(ReportBlob.objects.get().preview_status, "FAILED")
+
+        self.render.side_effect = fake_render
+        out = StringIO()
+        call_command("build_report_previews", workers=1, stdout=out)
+        self.assertIn("Nothing to do", out.getvalue())
+        self.assertEqual(self.render.call_count, 1)
+
+        call_command("build_report_previews", workers=1, retry_failed=True, stdout=out)
+        self.assertIn("1 previews built for 1 report files", out.getvalue())
+        self.assertNotEqual(ReportBlob.objects.get().preview, "")
+
+    @skipUnless(previews.Image, "Pillow is not installed")
+    def test_image_thumbnails_fit_the_preview_size(self):
+        from PIL import Image
+
+        buffer = BytesIO()
+        Image.new("RGB", (2000, 1000), "white").save(buffer, "PNG")
+        with mock.patch.dict(previews.RENDERERS, {".png": previews._render_image}):
+            self.upload(self.appointment, buffer.getvalue(), "photo.png")
+
+        blob = ReportBlob.objects.get()
+        with Image.open(self.media / blob.preview) as thumbnail:
+            self.assertEqual(thumbnail.size, (480, 240))
+
+    @skipUnless(previews.Image, "Pillow is not installed")
+    @override_settings(REPORT_PREVIEW_MAX_PIXELS=1_000_000)
+    def test_oversized_images_are_not_decoded(self):
+        from PIL import Image
+
+        buffer = BytesIO()
+        Image.new("RGB", (2000, 1000), "white").save(buffer, "PNG")
+        with mock.patch.object(Image.Image, "load") as load, \
+                mock.patch.dict(previews.RENDERERS, {".png": previews._render_image}):
+            self.upload(self.appointment, buffer.getvalue(), "photo.png")
+
+        load.assert_not_called()
+        self.assertEqual(ReportBlob.objects.get().preview, "")
+
+    def test_declined_files_are_not_tried_again(self):
+        self.render.side_effect = lambda *args: False
+        self.upload(self.appointment, b"%PDF-1.7\n scan")
+        other = book_slot(
+            free_slots(self.doctor, self.day)[1]["id"], consultation_type="CLINIC", user=self.patient
+        )
+        self.upload(other, b"%PDF-1.7\n scan")
+
+        out = StringIO()
+        call_command("build_report_previews", workers=1, retry_failed=True, stdout=out)
+        self.assertIn("Nothing to do", out.getvalue())
+        self.assertEqual(self.render.call_count, 1)
+        blob = ReportBlob.objects.get()
+        self.assertEqual((blob.preview, blob.preview_status), ("", "SKIPPED"))
+        self.assertEqual(sorted(self.media.rglob("*.jpg")), [])
+
+
+# ------------------------
+# PROTECTED REPORT DELIVERY
+# ------------------------
+class ReportFileTests(BookingTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.media = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        self.enterContext(self.settings(MEDIA_ROOT=self.media))
+
+        appointment = book_slot(
+            free_slots(self.doctor, self.day)[0]["id"], consultation_type="CLINIC", user=self.patient
+        )
+        self.content = b"%PDF-1.7\n" + bytes(range(256)) * 4
+        self.client.post(
+            reverse("appointments:upload_report", args=[appointment.id]),
+            {"reports": SimpleUploadedFile("scan.pdf", self.content)},
+        )
+        self.report = AppointmentReport.objects.select_related("blob").get()
+        self.url = reverse("appointments:report_file", args=[self.report.id])
+        self.etag = f'"{self.report.blob.sha256}"'
+
+    def test_patient_and_doctor_only(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), self.content)
+        self.assertEqual(response["Content-Type"], "application/pdf")
+        self.assertEqual(response["ETag"], self.etag)
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertEqual(
+            response["Content-Disposition"], f'inline; filename="report-{self.report.id}.pdf"'
+        )
+
+        self.client.force_login(self.doctor.user)
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+        self.client.force_login(User.objects.create(username="9000000002"))
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        self.client.logout()
+        self.assertEqual(self.client.get(self.url).status_code, 302)
+
+    def test_ranges_and_revalidation(self):
+        size = len(self.content)
+        cases = [
+            ("bytes=9-18", 206, f"bytes 9-18/{size}", self.content[9:19]),
+            ("bytes=-4", 206, f"bytes {size - 4}-{size - 1}/{size}", self.content[-4:]),
+            (f"bytes={size - 2}-", 206, f"bytes {size - 2}-{size - 1}/{size}", self.content[-2:]),
+            (f"bytes={size}-", 416, f"bytes */{size}", b""),
+            ("bytes=0-1,5-6", 200, None, self.content),
+        ]
+        for header, status, content_range, body in cases:
+            with self.subTest(range=header):
+                response = self.client.get(self.url, HTTP_RANGE=header)
+                self.assertEqual(response.status_code, status)
+                self.assertEqual(response.get("Content-Range"), content_range)
+                content = (
+                    b"".join(response.streaming_content) if response.streaming else response.content
+                )
+                self.assertEqual(content, body)
+
+        response = self.client.get(self.url, HTTP_RANGE="bytes=0-3", HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=f'W/"x", {self.etag}')
+        self.assertEqual(response.status_code, 304)
+
+    @mock.patch("core.media.CHUNK_SIZE", 256)
+    async def test_asgi_reads_one_chunk_at_a_time(self):
+        await sync_to_async(self.async_client.force_login)(self.patient)
+        for headers, body in (({}, self.content), ({"Range": "bytes=9-600"}, self.content[9:601])):
+            with self.subTest(**headers):
+                response = await self.async_client.get(self.url, headers=headers)
+                self.assertTrue(response.is_async)  # a sync iterator is buffered whole
+                self.assertEqual(int(response["Content-Length"]), len(body))
+
+                chunks = [chunk async for chunk in response.streaming_content]
+                self.assertEqual(b"".join(chunks), body)
+                self.assertEqual([len(chunk) for chunk in chunks[:-1]], [256] * (len(chunks) - 1))
+
+    def test_front_end_server_sends_the_file(self):
+        name = self.report.file.name
+        with self.settings(PROTECTED_MEDIA_SERVER="x-accel-redirect"):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["X-Accel-Redirect"], f"/protected-media/{name}")
+        self.assertEqual(response.content, b"")
+
+        with self.settings(PROTECTED_MEDIA_SERVER="x-sendfile"):
+            response = self.client.get(self.url)
+        self.assertEqual(response["X-Sendfile"], str(self.media / name))
+        self.assertEqual(response["Content-Type"], "application/pdf")
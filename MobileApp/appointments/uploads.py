@@ -0,0 +1,179 @@
+# Streaming report uploads.
+#
+# upload_report installs ReportUploadHandler in place of Django's
+# memory/temp-file handlers. Every chunk is checked against the size and
+# type limits as it arrives, hashed, and written into the report
+# storage's incoming/ directory (which must have a local path), so an
+# upload is never buffered in memory. acquire_blobs() then renames each
+# file to its content address on the same disk, without a copy. A limit
+# stops the parse at once; discard() deletes whatever this request wrote
+# that did not become a blob (duplicates included). Nothing is written
+# before csrf_rejection() has passed the request.
+import copy
+import hashlib
+import os
+import posixpath
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile, StopUpload
+from django.http import QueryDict
+from django.middleware.csrf import CsrfViewMiddleware
+from django.utils.crypto import get_random_string
+
+from .models import AppointmentReport
+
+
+REPORT_FIELD = "reports"
+
+# extension -> (offset, magic bytes) that must all match the file's head
+REPORT_SIGNATURES = {
+    ".pdf": [(0, b"%PDF-")],
+    ".jpg": [(0, b"\xff\xd8\xff")],
+    ".jpeg": [(0, b"\xff\xd8\xff")],
+    ".png": [(0, b"\x89PNG\r\n\x1a\n")],
+    ".webp": [(0, b"RIFF"), (8, b"WEBP")],
+}
+HEAD_BYTES = 16
+
+TYPE_ERROR = "Reports must be PDF, JPEG, PNG or WebP files"
+
+
+def _mb(size):
+    return f"{size / 2**20:g} MB"
+
+
+def csrf_rejection(request):
+    """
+    CsrfViewMiddleware's verdict on a request without parsing its body,
+    so before any file reaches storage: the token has to come in the
+    X-CSRFToken header. The 403 response, or None if the request passes.
+    """
+    probe = copy.copy(request)
+    probe.POST = QueryDict()
+    return CsrfViewMiddleware(lambda request: None).process_view(probe, None, (), {})
+
+
+class StoredReport:
+    """A report ReportUploadHandler has already written to storage."""
+
+    def __init__(self, name, size, sha256, suffix):
+        self.name = name
+        self.size = size
+        self.sha256 = sha256
+        self.suffix = suffix
+
+    def __repr__(self):
+        return f"<StoredReport {self.name} ({self.size} bytes)>"
+
+
+class ReportUploadHandler(FileUploadHandler):
+    chunk_size = 256 * 2**10
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.field = AppointmentReport._meta.get_field("file")
+        self.storage = self.field.storage
+        self.stored = []     # names written by this request
+        self.error = None    # (status, message) once a limit is hit
+        self.total = 0
+        self.count = 0
+        self.destination = None
+
+    # ------------------------
+    # LIMITS
+    # ------------------------
+    def reject(self, status, message):
+        self.error = (status, message)
+        self._close()
+        raise StopUpload(connection_reset=False)
+
+    def _check_type(self):
+        if not all(
+            self.head[offset:offset + len(magic)] == magic
+            for offset, magic in self.signature
+        ):
+            self.reject(415, TYPE_ERROR)
+        self.head = None
+
+    # ------------------------
+    # HANDLER HOOKS
+    # ------------------------
+    def new_file(self, field_name, file_name, content_type, content_length, *args, **kwargs):
+        super().new_file(field_name, file_name, content_type, content_length, *args, **kwargs)
+        if field_name != REPORT_FIELD:
+            raise SkipFile()
+
+        self.count += 1
+        if self.count > settings.REPORT_UPLOAD_MAX_FILES:
+            self.reject(413, f"Upload at most {settings.REPORT_UPLOAD_MAX_FILES} reports at a time")
+        if content_length and content_length > settings.REPORT_UPLOAD_MAX_FILE_SIZE:
+            self.reject(413, f"Each report must be under {_mb(settings.REPORT_UPLOAD_MAX_FILE_SIZE)}")
+
+        self.suffix = Path(file_name).suffix.lower()
+        self.signature = REPORT_SIGNATURES.get(self.suffix)
+        if self.signature is None:
+            self.reject(415, TYPE_ERROR)
+
+        self.head = b""
+        self.sha256 = hashlib.sha256()
+        self._open()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.total += len(raw_data)
+        if start + len(raw_data) > settings.REPORT_UPLOAD_MAX_FILE_SIZE:
+            self.reject(413, f"Each report must be under {_mb(settings.REPORT_UPLOAD_MAX_FILE_SIZE)}")
+        if self.total > settings.REPORT_UPLOAD_MAX_REQUEST_SIZE:
+            self.reject(413, f"Upload at most {_mb(settings.REPORT_UPLOAD_MAX_REQUEST_SIZE)} at a time")
+
+        if self.head is not None:
+            self.head += raw_data[:HEAD_BYTES - len(self.head)]
+            if len(self.head) == HEAD_BYTES:
+                self._check_type()
+
+        self.sha256.update(raw_data)
+        self.destination.write(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        if self.head is not None:
+            self._check_type()
+        self._close()
+        return StoredReport(self.stored[-1], file_size, self.sha256.hexdigest(), self.suffix)
+
+    def upload_interrupted(self):
+        self._close()
+
+    # ------------------------
+    # STORAGE
+    # ------------------------
+    def _open(self):
+        directory = posixpath.join(self.field.upload_to, "incoming")
+        os.makedirs(self.storage.path(directory), exist_ok=True)
+
+        while True:
+            name = posixpath.join(directory, get_random_string(32) + ".part")
+            path = self.storage.path(name)
+            flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0)
+            try:
+                fd = os.open(path, flags, 0o666)
+            except FileExistsError:
+                continue
+            break
+
+        if self.storage.file_permissions_mode is not None:
+            os.chmod(path, self.storage.file_permissions_mode)
+        self.stored.append(name)
+        self.destination = os.fdopen(fd, "wb")
+
+    def _close(self):
+        if self.destination is not None:
+            self.destination.close()
+            self.destination = None
+
+    def discard(self):
+        """Delete every file this request wrote that is still in incoming/."""
+        self._close()
+        for name in self.stored:
+            self.storage.delete(name)
+        self.stored = []
@@ -9,6 +9,7 @@ urlpatterns = [
     path("", views.select_slot, name="appointment_home"),
     path("slots/<int:doctor_id>/", select_slot, name="select_slot"),
     path("book/", book_appointment, name="book_appointment"),
+    path("book/batch/", views.book_appointments_batch, name="book_appointments_batch"),
     path("history/", appointment_history, name="appointment_history"),
     path("cancel/<int:appointment_id>/", cancel_appointment, name="cancel_appointment"),
     path(
@@ -16,7 +17,18 @@ urlpatterns = [
         available_slots_by_date,
         name="slots_by_date"
     ),
+    path("doctor/<int:doctor_id>/slot-events/", views.slot_events, name="slot_events"),
+    path("slots-by-range/", views.available_slots_by_range, name="slots_by_range"),
+    path("next-available/", views.next_available_slots, name="next_available"),
+    path("waitlist/join/", views.join_waitlist, name="join_waitlist"),
+    path("waitlist/<int:entry_id>/leave/", views.leave_waitlist, name="leave_waitlist"),
     path("appointments/<int:appointment_id>/upload-report/",upload_report,name="upload_report"),
     path("reports/<int:report_id>/delete/",delete_report,name="delete_report"),
     path("reports/<int:report_id>/view/",views.view_report,name="view_report"),
+    path("reports/<int:report_id>/file/", views.report_file, name="report_file"),
+    path(
+        "reports/<int:report_id>/preview/<str:sha256>.jpg",
+        views.report_preview,
+        name="report_preview"
+    ),
 ]
@@ -1,92 +1,211 @@
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from django.shortcuts import render, get_object_or_404, redirect
+from django.urls import reverse
 from django.contrib.auth.decorators import login_required
 from django.utils import timezone
-from django.http import JsonResponse, HttpResponseForbidden
+from django.http import HttpResponse, JsonResponse, HttpResponseForbidden, StreamingHttpResponse
 from django.db import transaction
+from django.conf import settings
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from django.db.models import Q
+from django.core.handlers.asgi import ASGIRequest
+from asgiref.sync import sync_to_async
 from datetime import timedelta, datetime, time, date
 
-from .models import TimeSlot, Appointment, AppointmentReport
+from .models import (
+    TimeSlot,
+    Appointment,
+    AppointmentReport,
+    WaitlistEntry,
+    CONSULTATION_TYPE_CHOICES,
+)
+from .availability import (
+    cached_free_slots,
+    free_slots_for_range,
+    invalidate_availability,
+    next_available,
+    slot_label,
+    slot_token,
+)
+from .live import slot_event_poll, slot_event_stream
+from .uploads import REPORT_FIELD, ReportUploadHandler, csrf_rejection
+from .blobs import acquire_blobs
+from .previews import schedule_previews
+from .booking import MixedDoctors, SlotUnavailable, book_slot, book_slots, cancel_booking
 from doctors.models import Doctor
+from doctors.day_view import invalidate_doctor_day
+from core.idempotency import idempotent
+from core.media import serve_file
+from core.pagination import keyset_page
 
 
 # ------------------------
-# HOLIDAYS
+# AJAX: AVAILABLE SLOTS
 # ------------------------
-HOLIDAYS = [
-    date(2025, 1, 26),
-    date(2025, 8, 15),
-    date(2025, 10, 2),
-]
+@login_required
+def available_slots_by_date(request, doctor_id):
+    date_str = request.GET.get("date")
+    if not date_str:
+        return JsonResponse({"slots": []})
+
+    try:
+        selected_date = datetime.strptime(date_str, "%Y-%m-%d").date()
+    except ValueError:
+        return JsonResponse({"slots": []})
+
+    doctor = get_object_or_404(Doctor, id=doctor_id)
+
+    return JsonResponse({
+        "slots": [
+            {
+                "id": s["id"],
+                "start": s["start_time"].strftime("%H:%M"),
+                "label": slot_label(s["start_time"], s["end_time"])
+            }
+            for s in cached_free_slots(doctor, selected_date)
+        ]
+    })
 
 
 # ------------------------
-# SLOT GENERATION
+# AJAX: AVAILABILITY OVER A DATE RANGE
 # ------------------------
-def generate_default_slots(doctor, slot_date):
-    # ❌ No past dates
-    if slot_date < timezone.localdate():
-        return
-
-    # ❌ No weekends or holidays
-    if slot_date.weekday() >= 5 or slot_date in HOLIDAYS:
-        return
-    working_hours = [
-        (time(10, 0), time(12, 0)),
-        (time(13, 0), time(17, 0)),
-    ]
+RANGE_MAX_DAYS = 31
+RANGE_MAX_DOCTORS = 20
 
-    for start, end in working_hours:
-        current = datetime.combine(slot_date, start)
-        end_dt = datetime.combine(slot_date, end)
-
-        while current < end_dt:
-            TimeSlot.objects.get_or_create(
-                doctor=doctor,
-                date=slot_date,
-                start_time=current.time(),
-                end_time=(current + timedelta(minutes=30)).time(),
-                defaults={"is_available": True}
-            )
-            current += timedelta(minutes=30)
+
+@login_required
+def available_slots_by_range(request):
+    """
+    Free-slot counts per day for one or more doctors, e.g.
+    ?doctor=1&doctor=2&start=2026-01-05&end=2026-01-18&include_slots=1
+    Two queries however long the range is.
+    """
+    try:
+        start = datetime.strptime(request.GET.get("start", ""), "%Y-%m-%d").date()
+        end = datetime.strptime(request.GET.get("end", ""), "%Y-%m-%d").date()
+        doctor_ids = [int(i) for i in request.GET.getlist("doctor")]
+    except ValueError:
+        return JsonResponse({"error": "Invalid start, end or doctor"}, status=400)
+
+    if end < start:
+        return JsonResponse({"error": "end is before start"}, status=400)
+
+    if (end - start).days >= RANGE_MAX_DAYS:
+        return JsonResponse(
+            {"error": f"Range is limited to {RANGE_MAX_DAYS} days"}, status=400
+        )
+
+    if not doctor_ids or len(doctor_ids) > RANGE_MAX_DOCTORS:
+        return JsonResponse(
+            {"error": f"Pass between 1 and {RANGE_MAX_DOCTORS} doctors"}, status=400
+        )
+
+    include_slots = request.GET.get("include_slots") == "1"
+    doctors = list(Doctor.objects.filter(id__in=doctor_ids, is_active=True))
+    availability = free_slots_for_range(doctors, start, end)
+
+    result = []
+    for doctor in doctors:
+        days = []
+        for day, slots in availability[doctor.id].items():
+            entry = {"date": day.isoformat(), "free": len(slots)}
+            if include_slots:
+                entry["slots"] = [
+                    {
+                        "id": s["id"],
+                        "label": slot_label(s["start_time"], s["end_time"])
+                    }
+                    for s in slots
+                ]
+            days.append(entry)
+
+        result.append({"id": doctor.id, "name": doctor.name, "days": days})
+
+    return JsonResponse({
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "doctors": result,
+    })
 
 
 # ------------------------
-# AJAX: AVAILABLE SLOTS
+# SSE: LIVE SLOT EVENTS
 # ------------------------
 @login_required
-def available_slots_by_date(request, doctor_id):
-    date_str = request.GET.get("date")
-    if not date_str:
-        return JsonResponse({"slots": []})
-
+async def slot_events(request, doctor_id):
+    """
+    text/event-stream of slots taken/freed for one doctor-day:
+    ?date=YYYY-MM-DD. Reconnects resume from Last-Event-ID. Under WSGI
+    each request answers at once and the browser reconnects to poll.
+    """
     try:
-        selected_date = datetime.strptime(date_str, "%Y-%m-%d").date()
+        day = date.fromisoformat(request.GET.get("date", ""))
     except ValueError:
-        return JsonResponse({"slots": []})
+        return JsonResponse({"error": "Invalid date"}, status=400)
 
-    if selected_date.weekday() >= 5 or selected_date in HOLIDAYS:
-        return JsonResponse({"slots": []})
+    last_event_id = request.headers.get("Last-Event-ID")
+    last_event_id = int(last_event_id) if last_event_id and last_event_id.isdigit() else None
 
-    doctor = get_object_or_404(Doctor, id=doctor_id)
+    if isinstance(request, ASGIRequest):
+        response = StreamingHttpResponse(
+            slot_event_stream(doctor_id, day, last_event_id),
+            content_type="text/event-stream"
+        )
+    else:
+        response = HttpResponse(
+            await sync_to_async(slot_event_poll)(doctor_id, day, last_event_id),
+            content_type="text/event-stream"
+        )
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # nginx: don't buffer the stream
+    return response
 
-    if not TimeSlot.objects.filter(doctor=doctor, date=selected_date).exists():
-        generate_default_slots(doctor, selected_date)
 
-    slots = TimeSlot.objects.filter(
-        doctor=doctor,
-        date=selected_date,
-        is_available=True
-    ).order_by("start_time")
+# ------------------------
+# AJAX: NEXT AVAILABLE SLOTS
+# ------------------------
+NEXT_AVAILABLE_MAX = 20
+
+
+@login_required
+def next_available_slots(request):
+    """
+    Earliest free slots across all active doctors, e.g.
+    ?specialization=Cardiology&type=CLINIC&limit=5
+    Every active doctor offers both consultation types, so `type`
+    is validated and carried into the booking link.
+    """
+    consultation_type = request.GET.get("type", "ONLINE")
+    if consultation_type not in dict(CONSULTATION_TYPE_CHOICES):
+        return JsonResponse({"error": "Invalid consultation type"}, status=400)
+
+    try:
+        limit = min(int(request.GET.get("limit", 5)), NEXT_AVAILABLE_MAX)
+    except ValueError:
+        return JsonResponse({"error": "Invalid limit"}, status=400)
+
+    doctors = Doctor.objects.filter(is_active=True)
+    specialization = request.GET.get("specialization")
+    if specialization:
+        doctors = doctors.filter(specialization__iexact=specialization)
 
     return JsonResponse({
         "slots": [
             {
-                "id": s.id,
-                "label": f"{s.start_time.strftime('%I:%M %p')} - {s.end_time.strftime('%I:%M %p')}"
+                "id": slot["id"],
+                "date": day.isoformat(),
+                "label": slot_label(slot["start_time"], slot["end_time"]),
+                "doctor": {
+                    "id": doctor.id,
+                    "name": doctor.name,
+                    "specialization": doctor.specialization,
+                },
+                "book_url": reverse("appointments:select_slot", args=[doctor.id])
+                            + f"?type={consultation_type}",
             }
-            for s in slots
+            for day, doctor, slot in next_available(list(doctors), limit)
         ]
     })
 
@@ -94,35 +213,28 @@ def available_slots_by_date(request, doctor_id):
 # ------------------------
 # API: BOOK APPOINTMENT
 # ------------------------
+@idempotent
 @api_view(["POST"])
 @login_required
 def book_appointment(request):
-    slot_id = request.data.get("slot_id")
     consultation_type = request.data.get("consultation_type", "ONLINE")
 
-    with transaction.atomic():
-        slot = get_object_or_404(
-            TimeSlot.objects.select_for_update(),
-            id=slot_id,
-            is_available=True
-        )
+    if consultation_type not in dict(CONSULTATION_TYPE_CHOICES):
+        return Response({"message": "Invalid consultation type"}, status=400)
 
-        doctor = slot.doctor
-        amount = doctor.consultation_fee or 0
-
-        appointment = Appointment.objects.create(
-            user=request.user,
-            doctor=doctor,
-            slot=slot,
+    try:
+        appointment = book_slot(
+            request.data.get("slot_id"),
             consultation_type=consultation_type,
-            amount=amount,
-            payment_status="PENDING",
-            status="BOOKED",
-            payment_mode="ONLINE" if consultation_type == "ONLINE" else "OFFLINE"
+            user=request.user
         )
+    except SlotUnavailable:
+        return Response({
+            "status": "UNAVAILABLE",
+            "message": "This slot was just booked. Please pick another one."
+        }, status=409)
 
-        slot.is_available = False
-        slot.save()
+    amount = appointment.amount
 
     # 🏥 CLINIC → CONFIRM ONLY
     if consultation_type == "CLINIC":
@@ -136,10 +248,188 @@ def book_appointment(request):
     return Response({
         "status": "PAYMENT_REQUIRED",
         "appointment_id": appointment.id,
-        "amount": amount
+        "amount": amount,
+        "held_until": appointment.hold_expires_at
+    })
+
+
+# ------------------------
+# API: BATCH / RECURRING BOOKING
+# ------------------------
+BATCH_MAX = 26
+
+
+def _recurring_slot_ids(rule):
+    """
+    {"doctor_id", "date", "time": "HH:MM", "count", "every_weeks"}
+    -> a slot id per occurrence (virtual ids; existing rows are matched
+    by time when resolved).
+    """
+    doctor_id = int(rule["doctor_id"])
+    first = date.fromisoformat(rule["date"])
+    start_time = time.fromisoformat(rule["time"])
+    count = int(rule["count"])
+    every = int(rule.get("every_weeks", 1))
+
+    if count < 1 or every < 1:
+        raise ValueError("count and every_weeks must be positive")
+
+    return [
+        slot_token(doctor_id, first + timedelta(weeks=i * every), start_time)
+        for i in range(count)
+    ]
+
+
+@idempotent
+@api_view(["POST"])
+@login_required
+def book_appointments_batch(request):
+    """
+    Book a list of slots, or one weekly slot for several weeks, in one
+    transaction:
+      {"slot_ids": [...]} or
+      {"recurrence": {"doctor_id", "date", "time", "count", "every_weeks"}}
+    plus "consultation_type" and "partial". Without "partial" the batch
+    is all or nothing; with it each slot is reported separately.
+    """
+    consultation_type = request.data.get("consultation_type", "ONLINE")
+    if consultation_type not in dict(CONSULTATION_TYPE_CHOICES):
+        return Response({"message": "Invalid consultation type"}, status=400)
+
+    try:
+        if request.data.get("recurrence"):
+            slot_ids = _recurring_slot_ids(request.data["recurrence"])
+        else:
+            slot_ids = request.data.get("slot_ids") or []
+            if not isinstance(slot_ids, list) or not all(
+                isinstance(v, (int, str)) for v in slot_ids
+            ):
+                raise ValueError("slot_ids must be a list of ids")
+    except (KeyError, TypeError, ValueError):
+        return Response({"message": "Invalid slot list or recurrence rule"}, status=400)
+
+    slot_ids = list(dict.fromkeys(slot_ids))
+    if not slot_ids:
+        return Response({"message": "No slots given"}, status=400)
+    if len(slot_ids) > BATCH_MAX:
+        return Response({"message": f"At most {BATCH_MAX} slots per batch"}, status=400)
+
+    try:
+        results = book_slots(
+            slot_ids,
+            consultation_type=consultation_type,
+            user=request.user,
+            partial=bool(request.data.get("partial"))
+        )
+    except MixedDoctors as e:
+        return Response({"message": str(e)}, status=400)
+    except SlotUnavailable as e:
+        return Response({
+            "status": "UNAVAILABLE",
+            "message": "Some slots are no longer available. Nothing was booked.",
+            "unavailable": e.args[0],
+        }, status=409)
+
+    booked = [a for _, a in results if a is not None]
+    items = []
+    for slot_id, appointment in results:
+        if appointment is None:
+            items.append({"slot_id": slot_id, "status": "UNAVAILABLE"})
+            continue
+        items.append({
+            "slot_id": slot_id,
+            "status": "BOOKED",
+            "appointment_id": appointment.id,
+            "date": appointment.slot.date.isoformat(),
+            "label": slot_label(appointment.slot.start_time, appointment.slot.end_time),
+        })
+
+    if not booked:
+        status = "UNAVAILABLE"
+    elif len(booked) < len(results):
+        status = "PARTIAL"
+    elif consultation_type == "CLINIC":
+        status = "CONFIRMED"
+    else:
+        status = "PAYMENT_REQUIRED"
+
+    return Response({
+        "status": status,
+        "results": items,
+        "amount": sum(a.amount for a in booked),
+        "held_until": booked[0].hold_expires_at if booked else None,
+    }, status=200 if booked else 409)
+
+
+# ------------------------
+# API: WAITLIST
+# ------------------------
+@api_view(["POST"])
+@login_required
+def join_waitlist(request):
+    """
+    Queue for a fully booked doctor-day. When a slot on that day is
+    cancelled it is booked for the head of the queue automatically.
+    """
+    consultation_type = request.data.get("consultation_type", "ONLINE")
+    if consultation_type not in dict(CONSULTATION_TYPE_CHOICES):
+        return Response({"message": "Invalid consultation type"}, status=400)
+
+    try:
+        day = date.fromisoformat(request.data.get("date") or "")
+    except ValueError:
+        return Response({"message": "Invalid date"}, status=400)
+
+    if day < timezone.localdate():
+        return Response({"message": "Cannot join a waitlist for a past date"}, status=400)
+
+    doctor = get_object_or_404(Doctor, id=request.data.get("doctor_id"), is_active=True)
+
+    if cached_free_slots(doctor, day):
+        return Response({
+            "status": "AVAILABLE",
+            "message": "Slots are still available on this date."
+        }, status=409)
+
+    entry, _ = WaitlistEntry.objects.get_or_create(
+        doctor=doctor,
+        date=day,
+        user=request.user,
+        status="WAITING",
+        defaults={"consultation_type": consultation_type}
+    )
+
+    ahead = WaitlistEntry.objects.filter(
+        doctor=doctor,
+        date=day,
+        status="WAITING"
+    ).filter(
+        Q(priority__gt=entry.priority) |
+        Q(priority=entry.priority, created_at__lt=entry.created_at) |
+        Q(priority=entry.priority, created_at=entry.created_at, id__lt=entry.id)
+    ).count()
+
+    return Response({
+        "status": "WAITING",
+        "entry_id": entry.id,
+        "position": ahead + 1
     })
 
 
+@api_view(["POST"])
+@login_required
+def leave_waitlist(request, entry_id):
+    left = WaitlistEntry.objects.filter(
+        id=entry_id,
+        user=request.user,
+        status="WAITING"
+    ).update(status="LEFT")
+
+    if not left:
+        return Response({"message": "Not on this waitlist"}, status=404)
+    return Response({"status": "LEFT"})
+
+
 
 # ------------------------
 # PATIENT: SELECT SLOT (HTML)
@@ -157,16 +447,36 @@ def select_slot(request, doctor_id):
 # ------------------------
 # PATIENT: HISTORY
 # ------------------------
+HISTORY_PAGE_SIZE = 20
+
+
 @login_required
 def appointment_history(request):
+    """
+    Newest first, HISTORY_PAGE_SIZE per page. ?before=<cursor> continues
+    after the last row of the previous page; the (user, created_at, id)
+    index makes every page as cheap as the first.
+    """
     appointments = Appointment.objects.filter(
         user=request.user
-    ).select_related("doctor", "slot").order_by("-created_at")
+    ).select_related(
+        "doctor"
+    ).prefetch_related(
+        "reports"
+    ).with_time_flags()
+
+    page, next_cursor, is_first_page = keyset_page(
+        appointments, request.GET.get("before"), HISTORY_PAGE_SIZE
+    )
 
     return render(
         request,
         "appointments/history.html",
-        {"appointments": appointments}
+        {
+            "appointments": page,
+            "next_cursor": next_cursor,
+            "is_first_page": is_first_page,
+        }
     )
 
 
@@ -182,18 +492,17 @@ def cancel_appointment(request, appointment_id):
         status="BOOKED"
     )
 
-    if not appointment.can_cancel():
+    # one conditional UPDATE checks it is still BOOKED and not started,
+    # then frees the slot and promotes the waitlist in the same transaction
+    if not cancel_booking(appointment, upcoming_only=True):
         return HttpResponseForbidden("Cannot cancel this appointment.")
 
-    slot = appointment.slot
-    slot.is_available = True
-    slot.save()
-
-    appointment.status = "CANCELLED"
-    appointment.save()
-
     return redirect("appointments:appointment_history")
 
+# ------------------------
+# REPORT UPLOADS
+# ------------------------
+@csrf_exempt  # checked below, before the upload handler can write anything
 @login_required
 def upload_report(request, appointment_id):
     appointment = get_object_or_404(
@@ -209,21 +518,59 @@ def upload_report(request, appointment_id):
     if appointment.consultation_type == "CLINIC" and appointment.status != "BOOKED":
         return HttpResponseForbidden("Invalid appointment")
 
+    if int(request.META.get("CONTENT_LENGTH") or 0) > settings.REPORT_UPLOAD_MAX_REQUEST_SIZE:
+        return _upload_form(request, appointment, (
+            413, f"Upload at most {settings.REPORT_UPLOAD_MAX_REQUEST_SIZE // 2**20} MB at a time"
+        ))
+
     if request.method == "POST":
-        files = request.FILES.getlist("reports")
+        rejected = csrf_rejection(request)
+        if rejected:
+            return rejected
+
+    # must be set before anything reads the body
+    handler = ReportUploadHandler(request)
+    request.upload_handlers = [handler]
+    try:
+        return _save_reports(request, appointment, handler)
+    finally:
+        handler.discard()  # duplicates, and everything if the upload failed
+
+
+@csrf_protect
+def _save_reports(request, appointment, handler):
+    if request.method != "POST":
+        return _upload_form(request, appointment)
 
-        for f in files:
-            AppointmentReport.objects.create(
+    reports = request.FILES.getlist(REPORT_FIELD)
+    if handler.error:
+        return _upload_form(request, appointment, handler.error)
+    if not reports:
+        return _upload_form(request, appointment, (400, "Choose at least one report"))
+
+    with transaction.atomic():
+        blobs = acquire_blobs(reports)
+        AppointmentReport.objects.bulk_create([
+            AppointmentReport(
                 appointment=appointment,
-                file=f
+                blob=blobs[report.sha256],
+                file=blobs[report.sha256].name
             )
+            for report in reports
+        ])
+        schedule_previews(blobs.values())
+    invalidate_doctor_day(appointment.doctor_id, appointment.date)
+
+    return redirect("appointments:appointment_history")
 
-        return redirect("appointments:appointment_history")
 
+def _upload_form(request, appointment, error=None):
+    status, message = error or (200, None)
     return render(
         request,
         "appointments/upload_report.html",
-        {"appointment": appointment}
+        {"appointment": appointment, "error": message},
+        status=status
     )
 
 @login_required
@@ -234,21 +581,27 @@ def delete_report(request, report_id):
         appointment__user=request.user
     )
 
-    appointment_id = report.appointment.id
-    report.file.delete(save=False)  # delete file from storage
-    report.delete()
+    appointment = report.appointment
+    report.delete()  # the file goes with the last report using it
+    invalidate_doctor_day(appointment.doctor_id, appointment.date)
 
     return redirect("appointments:appointment_history")
 
-from django.http import FileResponse
+from django.http import Http404
 from pathlib import Path
 
-from pathlib import Path
+
+def visible_reports(user):
+    """Reports the patient or the appointment's doctor may open."""
+    return AppointmentReport.objects.filter(
+        Q(appointment__user=user) | Q(appointment__doctor__user=user)
+    )
+
 
 @login_required
 def view_report(request, report_id):
     report = get_object_or_404(
-        AppointmentReport,
+        AppointmentReport.objects.select_related("blob"),
         id=report_id,
         appointment__user=request.user
     )
@@ -265,6 +618,44 @@ def view_report(request, report_id):
         }
     )
 
+
+@login_required
+def report_file(request, report_id):
+    report = get_object_or_404(
+        visible_reports(request.user).select_related("blob"),
+        id=report_id
+    )
+    if report.blob is None:
+        raise Http404("Report file missing")
+
+    return serve_file(
+        request,
+        report.file.storage,
+        report.file.name,
+        report.blob.sha256,
+        filename=f"report-{report.id}{Path(report.file.name).suffix.lower()}"
+    )
+
+
+@login_required
+def report_preview(request, report_id, sha256):
+    report = get_object_or_404(
+        visible_reports(request.user).select_related("blob"),
+        id=report_id,
+        blob__sha256=sha256
+    )
+    if not report.blob.preview:
+        raise Http404("No preview yet")
+
+    # the URL carries the content hash, so the response never changes
+    return serve_file(
+        request,
+        report.file.storage,
+        report.blob.preview,
+        sha256,
+        cache_control="private, max-age=31536000, immutable"
+    )
+
 @login_required
 def doctor_edit_slot(request, slot_id):
     if not hasattr(request.user, "doctor"):
@@ -288,6 +679,7 @@ def doctor_edit_slot(request, slot_id):
 
         slot.full_clean()  # overlap + validation
         slot.save()
+        invalidate_availability(slot.doctor_id, slot.date)
 
         return redirect(f"?date={slot.date}")
 
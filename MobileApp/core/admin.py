@@ -1,3 +1,10 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import IdempotencyKey
+
+
+@admin.register(IdempotencyKey)
+class IdempotencyKeyAdmin(admin.ModelAdmin):
+    list_display = ("user", "key", "status_code", "created_at", "expires_at")
+    search_fields = ("user__username", "key")
+    readonly_fields = ("fingerprint", "body")
@@ -3,3 +3,10 @@ from django.apps import AppConfig
 
 class CoreConfig(AppConfig):
     name = 'core'
+
+    def ready(self):
+        from django.core.checks import Tags, register
+
+        from .checks import check_shared_cache
+
+        register(check_shared_cache, Tags.caches, deploy=True)
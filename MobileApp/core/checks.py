@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.checks import Error
+
+
+# backends whose entries other processes never see
+PROCESS_LOCAL_CACHES = {
+    "django.core.cache.backends.locmem.LocMemCache",
+}
+
+
+def check_shared_cache(app_configs, **kwargs):
+    backend = settings.CACHES["default"]["BACKEND"]
+    if backend not in PROCESS_LOCAL_CACHES:
+        return []
+    return [Error(
+        f"The default cache ({backend}) is local to each process.",
+        hint=(
+            "Availability and day-view invalidation would only reach the "
+            "worker that made the change. Set REDIS_URL to use a shared cache."
+        ),
+        id="core.E001",
+    )]
@@ -0,0 +1,181 @@
+import hashlib
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+
+from .models import IdempotencyKey
+
+
+HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 64
+
+
+def _fingerprint(request):
+    digest = hashlib.sha256()
+    digest.update(request.method.encode())
+    digest.update(request.get_full_path().encode())
+    digest.update(b"\0")
+    digest.update(request.body)
+    return digest.hexdigest()
+
+
+def _replay(record):
+    if record.body is None:
+        # too large to keep; the request was applied, say so
+        response = JsonResponse(
+            {"message": "This request was already processed."},
+            status=record.status_code
+        )
+    else:
+        response = HttpResponse(
+            bytes(record.body),
+            status=record.status_code,
+            content_type=record.content_type
+        )
+    response["Idempotent-Replayed"] = "true"
+    return response
+
+
+def _take_over(record, now, expires_at):
+    """Claim a reservation whose request never finished; True if we got it."""
+    return IdempotencyKey.objects.filter(
+        id=record.id,
+        status_code__isnull=True,
+        reserved_at=record.reserved_at
+    ).update(reserved_at=now, expires_at=expires_at) == 1
+
+
+def _reserve(user, key, fingerprint, now):
+    """
+    Insert the in-progress record reserved at `now`, or return the one
+    already there. An abandoned reservation of the same request is taken
+    over instead.
+    """
+    expires_at = now + timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+    abandoned = now - timedelta(seconds=settings.IDEMPOTENCY_LOCK_TIMEOUT)
+
+    for _ in range(2):
+        try:
+            with transaction.atomic():
+                IdempotencyKey.objects.create(
+                    user=user,
+                    key=key,
+                    fingerprint=fingerprint,
+                    reserved_at=now,
+                    expires_at=expires_at
+                )
+            return None
+        except IntegrityError:
+            record = IdempotencyKey.objects.filter(user=user, key=key).first()
+            if record is not None and record.expires_at > now:
+                if (
+                    record.status_code is None
+                    and record.reserved_at <= abandoned
+                    and record.fingerprint == fingerprint
+                    and _take_over(record, now, expires_at)
+                ):
+                    return None
+                return record
+            # expired but not purged yet: drop it and claim the key again
+            IdempotencyKey.objects.filter(
+                user=user, key=key, expires_at__lte=now
+            ).delete()
+
+    return IdempotencyKey.objects.filter(user=user, key=key).first()
+
+
+def idempotent(view_func):
+    """
+    Replay the first response for requests repeating an Idempotency-Key.
+
+    Goes outside @api_view so the stored bytes are the rendered response.
+    Requests without the header run normally. Responses are kept per
+    (user, key) for IDEMPOTENCY_KEY_TTL seconds; 5xx responses are not
+    kept so the client can retry them. A retry while the first request
+    runs gets 409, until IDEMPOTENCY_LOCK_TIMEOUT passes and it may take
+    the key over; the first request then no longer records its response.
+    """
+    @wraps(view_func)
+    def _wrapped_view(request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key or not request.user.is_authenticated:
+            return view_func(request, *args, **kwargs)
+
+        if len(key) > MAX_KEY_LENGTH:
+            return JsonResponse(
+                {"message": f"{HEADER} must be at most {MAX_KEY_LENGTH} characters"},
+                status=400
+            )
+
+        fingerprint = _fingerprint(request)
+        reserved_at = timezone.now()
+        record = _reserve(request.user, key, fingerprint, reserved_at)
+
+        if record is not None:
+            if record.fingerprint != fingerprint:
+                return JsonResponse(
+                    {"message": f"{HEADER} was already used for a different request"},
+                    status=422
+                )
+            if record.status_code is None:
+                response = JsonResponse(
+                    {"message": "A request with this key is still being processed"},
+                    status=409
+                )
+                response["Retry-After"] = "1"
+                return response
+            return _replay(record)
+
+        # matches nothing once a retry has taken the key over
+        mine = IdempotencyKey.objects.filter(
+            user=request.user, key=key, reserved_at=reserved_at
+        )
+        try:
+            response = view_func(request, *args, **kwargs)
+            if hasattr(response, "render"):
+                response.render()
+        except Exception:
+            mine.delete()
+            raise
+
+        if response.status_code >= 500 or response.streaming:
+            mine.delete()
+            return response
+
+        body = response.content
+        if len(body) > settings.IDEMPOTENCY_MAX_RESPONSE_BYTES:
+            body = None
+
+        mine.update(
+            status_code=response.status_code,
+            content_type=response.get("Content-Type", ""),
+            body=body
+        )
+        return response
+
+    return _wrapped_view
+
+
+def purge_expired_keys(batch_size=1000, now=None):
+    """Delete expired keys in index-ordered batches. Returns the count."""
+    now = now or timezone.now()
+    deleted = 0
+
+    while True:
+        ids = list(IdempotencyKey.objects.filter(
+            expires_at__lte=now
+        ).order_by("expires_at").values_list("id", flat=True)[:batch_size])
+
+        if not ids:
+            break
+
+        deleted += IdempotencyKey.objects.filter(id__in=ids).delete()[0]
+
+        if len(ids) < batch_size:
+            break
+
+    return deleted
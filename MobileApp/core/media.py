@@ -0,0 +1,229 @@
+# Protected file delivery.
+#
+# Views check access and then return serve_file(). With
+# PROTECTED_MEDIA_SERVER set, the response is just a header naming the
+# file, and the front-end server sends it: nginx via X-Accel-Redirect to
+# an internal location, Apache/lighttpd via X-Sendfile. The worker is
+# free as soon as the headers are out, and the server handles ranges and
+# slow clients. Without a proxy the file streams from Django in
+# CHUNK_SIZE reads, with single byte ranges and ETag revalidation.
+# Under ASGI, Django would drain a sync iterator in one thread call and
+# buffer the whole body, so each read is awaited in a thread instead.
+#
+# serve_zip() streams several files as one ZIP built on the fly: entries
+# are stored, not compressed (reports are PDFs and images already), and
+# each CHUNK_SIZE read is sent before the next one, so memory stays flat
+# and nothing is written to disk however many files go in. Under ASGI
+# the archive is built in a thread one step at a time, like file reads.
+import mimetypes
+import re
+import zipfile
+from urllib.parse import quote
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.handlers.asgi import ASGIRequest
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponse,
+    HttpResponseNotModified,
+    StreamingHttpResponse,
+)
+from django.utils.http import content_disposition_header, parse_etags, quote_etag
+
+
+CHUNK_SIZE = 256 * 2**10
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def serve_file(request, storage, name, etag, filename=None, cache_control="private, no-cache"):
+    """
+    Send `name` from `storage`. `etag` must change whenever the content
+    does (a content hash); the default Cache-Control revalidates every
+    time, so access is re-checked before a cached copy is reused.
+    """
+    etag = quote_etag(etag)
+    content_type = mimetypes.guess_type(filename or name)[0] or "application/octet-stream"
+    mode = settings.PROTECTED_MEDIA_SERVER
+
+    if _not_modified(request, etag):
+        response = HttpResponseNotModified()
+    elif mode == "x-accel-redirect":
+        response = HttpResponse(content_type=content_type)
+        response["X-Accel-Redirect"] = settings.PROTECTED_MEDIA_INTERNAL_URL + quote(name)
+    elif mode == "x-sendfile":
+        response = HttpResponse(content_type=content_type)
+        response["X-Sendfile"] = storage.path(name)
+    elif mode is None:
+        response = _stream(request, storage, name, etag, content_type)
+    else:
+        raise ImproperlyConfigured(f"Unknown PROTECTED_MEDIA_SERVER {mode!r}")
+
+    response["ETag"] = etag
+    response["Cache-Control"] = cache_control
+    if filename and response.status_code != 304:
+        response["Content-Disposition"] = content_disposition_header(False, filename)
+    return response
+
+
+def _not_modified(request, etag):
+    header = request.headers.get("If-None-Match")
+    if not header:
+        return False
+    etags = [tag.removeprefix("W/") for tag in parse_etags(header)]
+    return "*" in etags or etag in etags
+
+
+# ------------------------
+# STREAMING FALLBACK
+# ------------------------
+def _stream(request, storage, name, etag, content_type):
+    try:
+        f = storage.open(name, "rb")
+    except FileNotFoundError:
+        raise Http404("File not found")
+    size = storage.size(name)
+
+    byte_range = _requested_range(request, etag, size)
+    if byte_range is None and not isinstance(request, ASGIRequest):
+        response = FileResponse(f, content_type=content_type)  # wsgi.file_wrapper
+        response.block_size = CHUNK_SIZE
+    elif byte_range is None:
+        response = StreamingHttpResponse(
+            _streamed(request, _read(f, size)), content_type=content_type
+        )
+        response["Content-Length"] = size
+    elif byte_range is False:
+        f.close()
+        response = HttpResponse(status=416)
+        response["Content-Range"] = f"bytes */{size}"
+    else:
+        first, last = byte_range
+        f.seek(first)
+        response = StreamingHttpResponse(
+            _streamed(request, _read(f, last - first + 1)),
+            status=206,
+            content_type=content_type,
+        )
+        response["Content-Range"] = f"bytes {first}-{last}/{size}"
+        response["Content-Length"] = last - first + 1
+
+    response["Accept-Ranges"] = "bytes"
+    return response
+
+
+def _requested_range(request, etag, size):
+    """
+    (first, last) byte of a single satisfiable range, None to send the
+    whole file, or False when the range lies past the end. Multiple and
+    malformed ranges are ignored, as RFC 9110 allows.
+    """
+    match = RANGE_RE.match(request.headers.get("Range", "").replace(" ", ""))
+    if not match or not size:
+        return None
+    if_range = request.headers.get("If-Range")
+    if if_range and if_range.strip() != etag:
+        return None  # the client's copy is stale: send it all
+
+    start, end = match.groups()
+    if start:
+        first = int(start)
+        if end and int(end) < first:
+            return None
+        if first >= size:
+            return False
+        return first, min(int(end), size - 1) if end else size - 1
+    if not end:
+        return None
+    if not int(end):
+        return False
+    return max(0, size - int(end)), size - 1
+
+
+def _read(f, length):
+    with f:
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def _streamed(request, chunks):
+    """
+    Streaming content for `request`: `chunks` itself under WSGI, or an
+    async iterator that runs each step of it in a thread under ASGI.
+    """
+    if isinstance(request, ASGIRequest):
+        return _iterate_in_thread(chunks)
+    return chunks
+
+
+async def _iterate_in_thread(chunks):
+    step = sync_to_async(next, thread_sensitive=False)
+    try:
+        while (chunk := await step(chunks, None)) is not None:
+            yield chunk
+    finally:
+        if hasattr(chunks, "close"):
+            await sync_to_async(chunks.close, thread_sensitive=False)()
+
+
+# ------------------------
+# ZIP ARCHIVES
+# ------------------------
+class _Pipe:
+    """
+    The unseekable file ZipFile writes to: it buffers what was written
+    until the generator drains it. ZipFile puts sizes and CRCs in data
+    descriptors after each entry instead of seeking back to the header.
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        if self.chunks:
+            yield b"".join(self.chunks)
+            self.chunks = []
+
+
+def stream_zip(entries):
+    """
+    Yield a ZIP archive of (arcname, storage, name, modified) entries as
+    it is built. Files missing from storage are left out.
+    """
+    pipe = _Pipe()
+    with zipfile.ZipFile(pipe, "w", zipfile.ZIP_STORED) as archive:
+        for arcname, storage, name, modified in entries:
+            try:
+                f = storage.open(name, "rb")
+            except FileNotFoundError:
+                continue
+            info = zipfile.ZipInfo(arcname, modified.timetuple()[:6])
+            with f, archive.open(info, "w", force_zip64=f.size > zipfile.ZIP64_LIMIT) as entry:
+                while chunk := f.read(CHUNK_SIZE):
+                    entry.write(chunk)
+                    yield from pipe.drain()
+            yield from pipe.drain()  # the data descriptor
+    yield from pipe.drain()  # the central directory
+
+
+def serve_zip(request, entries, filename):
+    response = StreamingHttpResponse(
+        _streamed(request, stream_zip(entries)),
+        content_type="application/zip"
+    )
+    response["Content-Disposition"] = content_disposition_header(True, filename)
+    response["Cache-Control"] = "private, no-store"
+    return response
@@ -0,0 +1,19 @@
+# Generated by Django 6.0 on 2026-10-19 11:05
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='idempotencykey',
+            name='reserved_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
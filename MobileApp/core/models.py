@@ -1,3 +1,39 @@
+from django.conf import settings
 from django.db import models
+from django.utils import timezone
 
-# Create your models here.
+
+# -----------------------
+# IDEMPOTENCY KEYS
+# -----------------------
+class IdempotencyKey(models.Model):
+    """
+    First response to a request sent with an Idempotency-Key header.
+    status_code is NULL while that first request is still running; one
+    still NULL IDEMPOTENCY_LOCK_TIMEOUT after reserved_at was abandoned
+    (the worker died) and the next retry takes it over.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    key = models.CharField(max_length=64)
+    # sha256 of method, path and body; a reused key must match it
+    fingerprint = models.CharField(max_length=64)
+
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    content_type = models.CharField(max_length=100, blank=True)
+    # NULL when the body was over IDEMPOTENCY_MAX_RESPONSE_BYTES
+    body = models.BinaryField(null=True, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    reserved_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "key"],
+                name="unique_idempotency_key_per_user",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user} | {self.key}"
@@ -0,0 +1,61 @@
+# Keyset (cursor) pagination on (created_at, id), and bounded counts
+# for listing pages. A cursor is the last row's (created_at, id), so
+# every page is an index range scan no matter how deep it is.
+import hashlib
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+
+from django.core.cache import cache
+from django.db.models import Q
+
+
+def encode_cursor(obj):
+    raw = f"{obj.created_at.isoformat()}|{obj.id}"
+    return urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        created_at, pk = urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), int(pk)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def keyset_page(queryset, cursor, size, descending=True):
+    """
+    One page of an unordered queryset: (rows, next_cursor, is_first_page).
+    next_cursor is None on the last page.
+    """
+    after = decode_cursor(cursor or "")
+    op = "lt" if descending else "gt"
+
+    if after:
+        created_at, pk = after
+        queryset = queryset.filter(
+            Q(**{f"created_at__{op}": created_at}) |
+            Q(created_at=created_at, **{f"id__{op}": pk})
+        )
+
+    order = ("-created_at", "-id") if descending else ("created_at", "id")
+    rows = list(queryset.order_by(*order)[:size + 1])
+
+    next_cursor = None
+    if len(rows) > size:
+        rows = rows[:size]
+        next_cursor = encode_cursor(rows[-1])
+
+    return rows, next_cursor, after is None
+
+
+def capped_count(queryset, key, cap=1000, timeout=60):
+    """
+    (count, exact) where count stops at `cap`: the database counts at most
+    cap + 1 rows, never the whole table. Cached per `key` for `timeout`s.
+    """
+    cache_key = "capped_count:" + hashlib.sha256(key.encode()).hexdigest()
+    count = cache.get(cache_key)
+    if count is None:
+        count = queryset.order_by()[:cap + 1].count()
+        cache.set(cache_key, count, timeout)
+    return min(count, cap), count <= cap
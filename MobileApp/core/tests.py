@@ -1,3 +1,366 @@
-from django.test import TestCase
+import json
+import re
+from contextlib import redirect_stdout
+from datetime import time, timedelta
+from io import StringIO
+from unittest import skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import OTP
+from appointments.availability import free_slots
+from appointments.models import Appointment, TimeSlot
+from appointments.tests import next_weekday
+from doctors.models import Doctor
+from payment.models import Payment
+from training.models import TrainingCourse, TrainingEnrollment
+from .checks import check_shared_cache
+from .idempotency import _fingerprint, purge_expired_keys
+from .models import IdempotencyKey
+
+
+# ------------------------
+# IDEMPOTENCY KEYS
+# ------------------------
+class IdempotencyKeyTests(TestCase):
+    def setUp(self):
+        self.patient = User.objects.create(username="9000000001")
+        self.doctor = Doctor.objects.create(
+            user=User.objects.create(username="doctor"),
+            name="Asha Rao",
+            specialization="Cardiology",
+            consultation_fee=500,
+        )
+        self.slots = free_slots(self.doctor, next_weekday())
+        self.client.force_login(self.patient)
+
+    def post(self, url, data, key):
+        return self.client.post(
+            url, data, content_type="application/json", headers={"Idempotency-Key": key}
+        )
+
+    def test_retried_booking_is_replayed(self):
+        url = reverse("appointments:book_appointment")
+        data = {"slot_id": self.slots[0]["id"], "consultation_type": "ONLINE"}
+
+        first = self.post(url, data, "book-1")
+        retry = self.post(url, data, "book-1")
+
+        self.assertEqual(retry.status_code, first.status_code)
+        self.assertEqual(retry.content, first.content)
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(Appointment.objects.count(), 1)
+
+        other = self.post(url, {**data, "slot_id": self.slots[1]["id"]}, "book-1")
+        self.assertEqual(other.status_code, 422)
+
+    def test_retried_payment_writes_one_payment(self):
+        appointment_id = self.post(
+            reverse("appointments:book_appointment"),
+            {"slot_id": self.slots[0]["id"], "consultation_type": "ONLINE"},
+            "book-1",
+        ).json()["appointment_id"]
+
+        url = reverse("payment:make_payment_api")
+        data = {"appointment_id": appointment_id, "method": "UPI"}
+        responses = [self.post(url, data, "pay-1") for _ in range(3)]
+
+        self.assertEqual({r.json()["message"] for r in responses}, {"Payment successful"})
+        self.assertEqual(Payment.objects.count(), 1)
+
+    def test_abandoned_reservation_is_taken_over(self):
+        url = reverse("appointments:book_appointment")
+        data = {"slot_id": self.slots[0]["id"], "consultation_type": "CLINIC"}
+        # the first request's worker died before recording a response
+        IdempotencyKey.objects.create(
+            user=self.patient,
+            key="book-1",
+            fingerprint=_fingerprint(
+                RequestFactory().post(url, data, content_type="application/json")
+            ),
+            expires_at=timezone.now() + timedelta(days=1),
+        )
+        self.assertEqual(self.post(url, data, "book-1").status_code, 409)
+
+        IdempotencyKey.objects.update(
+            reserved_at=timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_LOCK_TIMEOUT)
+        )
+        self.assertEqual(self.post(url, data, "book-1").status_code, 200)
+        self.assertEqual(self.post(url, data, "book-1")["Idempotent-Replayed"], "true")
+        self.assertEqual(Appointment.objects.count(), 1)
+
+    def test_expired_keys_are_purged(self):
+        self.post(
+            reverse("appointments:book_appointment"),
+            {"slot_id": self.slots[0]["id"], "consultation_type": "CLINIC"},
+            "book-1",
+        )
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        self.assertEqual(purge_expired_keys(batch_size=1), 1)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+
+# ------------------------
+# QUERY PLANS
+# ------------------------
+# Tables every page reads whole: a handful of rows that change rarely.
+SCAN_ALLOWED = {
+    "doctors_doctor",            # the doctor list shows all active doctors
+    "training_trainingcourse",   # so does the course catalogue
+    "doctors_holiday",           # compiled once per schedule version
+}
+
+# capped_count() reads at most cap + 1 rows, whatever the plan
+BOUNDED_COUNT = re.compile(r"^SELECT COUNT\(\*\) FROM \(.* LIMIT \d+\) subquery$", re.S)
+
+
+def full_scans(sql):
+    """Tables the planner reads end to end for this query."""
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            # with sequential scans priced out, one is only chosen
+            # when no index can serve the query (lasts until the test's
+            # transaction is rolled back)
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            cursor.execute("EXPLAIN (FORMAT JSON) " + sql)
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            nodes, scans = [plan[0]["Plan"]], []
+            while nodes:
+                node = nodes.pop()
+                if node["Node Type"] == "Seq Scan":
+                    scans.append(node["Relation Name"])
+                nodes += node.get("Plans", [])
+            return scans
+
+        tables = set(connection.introspection.table_names(cursor))
+        cursor.execute("EXPLAIN QUERY PLAN " + sql)
+        return [
+            detail.split()[1]
+            for *_, detail in cursor.fetchall()
+            if detail.startswith("SCAN ") and " USING " not in detail
+            and detail.split()[1] in tables
+        ]
+
+
+class QueryPlanTests(TestCase):
+    """
+    EXPLAIN every query of the hot views against a few months of data
+    and fail on any full table scan. Runs on whichever database the
+    suite uses; set POSTGRES_DB to check PostgreSQL.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        def user(username, role="USER"):
+            u = User.objects.create(username=username)
+            if role != "USER":
+                u.profile.role = role
+                u.profile.save()
+            return u
+
+        cls.patient = user("9000000001")
+        cls.staff = user("staff", "STAFF")
+        patients = User.objects.bulk_create([User(username=f"patient{i}") for i in range(50)])
+
+        cls.doctors = [
+            Doctor.objects.create(
+                user=user(f"doctor{i}", "DOCTOR"),
+                name=f"Doctor {i}",
+                specialization="Cardiology",
+                consultation_fee=500,
+            )
+            for i in range(5)
+        ]
+        cls.doctor = cls.doctors[0]
+
+        # 60 days back and 30 ahead, 16 slots a day, half of them booked
+        today = timezone.localdate()
+        slots = TimeSlot.objects.bulk_create([
+            TimeSlot(
+                doctor=doctor,
+                date=today + timedelta(days=d),
+                start_time=time(9 + m // 4, m % 4 * 15),
+                end_time=time(9 + (m + 1) // 4, (m + 1) % 4 * 15),
+                is_available=m % 2 == 1,
+            )
+            for doctor in cls.doctors
+            for d in range(-60, 30)
+            for m in range(16)
+        ])
+        Appointment.objects.bulk_create([
+            Appointment(
+                user=cls.patient if i % 10 == 0 else patients[i % len(patients)],
+                doctor_id=slot.doctor_id,
+                slot=slot,
+                date=slot.date,
+                starts_at=slot.starts_at,
+                ends_at=slot.ends_at,
+                amount=500,
+                consultation_type="CLINIC" if i % 3 else "ONLINE",
+                status="COMPLETED" if slot.date < today else "BOOKED",
+                payment_status="PAID" if i % 4 else "PENDING",
+            )
+            for i, slot in enumerate(s for s in slots if not s.is_available)
+        ])
+
+        OTP.objects.bulk_create([
+            OTP(phone_number=f"90000{i:05d}", otp="123456", is_verified=i % 5 > 0)
+            for i in range(2000)
+        ])
+        courses = TrainingCourse.objects.bulk_create([
+            TrainingCourse(
+                name=f"Course {i}",
+                trainer_name="Trainer",
+                status="UPCOMING",
+                start_datetime=timezone.now(),
+                end_datetime=timezone.now() + timedelta(days=1),
+            )
+            for i in range(10)
+        ])
+        TrainingEnrollment.objects.bulk_create([
+            TrainingEnrollment(
+                course=course,
+                user=u,
+                full_name=u.username,
+                phone=u.username,
+                email="patient@example.com",
+            )
+            for u in [cls.patient, *patients]
+            for course in courses[:5]
+        ])
+
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def setUp(self):
+        cache.clear()
+
+    def assert_no_full_scans(self, user, method, url, data=None):
+        if user:
+            self.client.force_login(user)
+        with CaptureQueriesContext(connection) as ctx:
+            response = getattr(self.client, method)(url, data)
+        self.assertLess(response.status_code, 400, url)
+
+        for query in ctx.captured_queries:
+            sql = query["sql"]
+            if not sql.startswith("SELECT") or BOUNDED_COUNT.match(sql):
+                continue
+            with self.subTest(url=url, sql=sql):
+                scans = [t for t in full_scans(sql) if t not in SCAN_ALLOWED]
+                self.assertEqual(scans, [])
+
+    def test_patient_views(self):
+        day = next_weekday().isoformat()
+        for url, data in (
+            (reverse("doctors:doctor_list"), None),
+            (reverse("appointments:select_slot", args=[self.doctor.id]), None),
+            (reverse("appointments:slots_by_date", args=[self.doctor.id]), {"date": day}),
+            (reverse("appointments:next_available"), {"specialization": "Cardiology"}),
+            (reverse("appointments:appointment_history"), None),
+            (reverse("training:training_list"), None),
+            (reverse("training:my_trainings"), None),
+        ):
+            self.assert_no_full_scans(self.patient, "get", url, data)
+
+    def test_doctor_views(self):
+        today = timezone.localdate().isoformat()
+        for url, data in (
+            (reverse("doctors:doctor_dashboard"), None),
+            (reverse("doctors:doctor_appointments"), {"date": today}),
+            (reverse("doctors:doctor_slots"), {"date": today}),
+        ):
+            self.assert_no_full_scans(self.doctor.user, "get", url, data)
+
+    def test_staff_views(self):
+        console = reverse("staff:appointment_console")
+        today = timezone.localdate().isoformat()
+        for url, data in (
+            (reverse("staff:staff_dashboard"), None),
+            (reverse("staff:staff_doctors"), None),
+            (console, None),
+            (console, {"doctor": self.doctor.id, "status": "BOOKED"}),
+            (console, {"status": "BOOKED", "payment_status": "PENDING"}),
+            (console, {"from": today, "to": today}),
+            (console, {"doctor": self.doctor.id, "when": "upcoming"}),
+            (console, {"status": "COMPLETED"}),
+            (console, {"status": "BOOKED", "from": today, "to": today}),
+            (console, {"doctor": self.doctor.id, "status": "BOOKED", "from": today}),
+            (reverse("staff:staff_doctor_appointments", args=[self.doctor.id]), None),
+            (reverse("staff:staff_doctor_slots", args=[self.doctor.id]), None),
+            (reverse("staff:slots_by_date", args=[self.doctor.id]), {"date": today}),
+        ):
+            self.assert_no_full_scans(self.staff, "get", url, data)
+
+    @skipUnless(connection.vendor == "sqlite", "reads SQLite query plans")
+    def test_console_filters_search_an_index(self):
+        """
+        Walking appointment_recent_idx and filtering is not a full scan,
+        but it reads every row when the filter matches few: each filter
+        combination should narrow on an index instead.
+        """
+        console = reverse("staff:appointment_console")
+        today = timezone.localdate().isoformat()
+        self.client.force_login(self.staff)
+        for data in (
+            {"doctor": self.doctor.id},
+            {"status": "CANCELLED"},
+            {"payment_status": "PENDING"},
+            {"consultation_type": "ONLINE"},
+            {"doctor": self.doctor.id, "status": "BOOKED", "from": today, "to": today},
+            {"status": "BOOKED", "from": today, "to": today},
+            {"from": today, "to": today},
+        ):
+            with CaptureQueriesContext(connection) as ctx:
+                self.client.get(console, data)
+            for query in ctx.captured_queries:
+                sql = query["sql"]
+                if not sql.startswith("SELECT") or '"appointments_appointment"' not in sql:
+                    continue
+                with self.subTest(data=data, sql=sql), connection.cursor() as cursor:
+                    cursor.execute("EXPLAIN QUERY PLAN " + sql)
+                    walks = [
+                        detail for *_, detail in cursor.fetchall()
+                        if detail.startswith("SCAN appointments_appointment")
+                    ]
+                    self.assertEqual(walks, [])
+
+    def test_otp_login(self):
+        session = self.client.session
+        session["phone"] = "9000000001"
+        session.save()
+        self.assert_no_full_scans(None, "post", reverse("otp_verify"), {"otp": "000000"})
+        with redirect_stdout(StringIO()):  # the OTP is printed until SMS is wired up
+            self.assert_no_full_scans(
+                None, "post", reverse("phone_register"), {"phone": "9000000001"}
+            )
+
+
+# ------------------------
+# DEPLOY CHECKS
+# ------------------------
+class SharedCacheCheckTests(SimpleTestCase):
+    @override_settings(CACHES={
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+    })
+    def test_process_local_cache_is_an_error(self):
+        self.assertEqual([error.id for error in check_shared_cache(None)], ["core.E001"])
+
+    @override_settings(CACHES={
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": "redis://localhost:6379/0",
+        }
+    })
+    def test_shared_cache_passes(self):
+        self.assertEqual(check_shared_cache(None), [])
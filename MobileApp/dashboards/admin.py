@@ -1,3 +1,30 @@
 from django.contrib import admin
+from .models import DoctorDayStats
 
-# Register your models here.
+
+@admin.register(DoctorDayStats)
+class DoctorDayStatsAdmin(admin.ModelAdmin):
+    list_display = (
+        "doctor",
+        "date",
+        "slots",
+        "free",
+        "booked",
+        "completed",
+        "cancelled",
+        "revenue",
+    )
+
+    list_filter = (
+        "date",
+    )
+
+    search_fields = (
+        "doctor__name",
+    )
+
+    ordering = ("-date",)
+
+    # maintained by dashboards.stats; fix drift with rebuild_day_stats
+    def has_change_permission(self, request, obj=None):
+        return False
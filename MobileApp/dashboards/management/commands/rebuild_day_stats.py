@@ -0,0 +1,54 @@
+from collections import defaultdict
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+from dashboards.stats import check_day_stats, day_batches, refresh_day_stats
+
+
+class Command(BaseCommand):
+    help = "Recount DoctorDayStats from slots and appointments, or --check it for drift"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=500,
+            help="Doctor-days recounted per transaction"
+        )
+        parser.add_argument(
+            "--check", action="store_true",
+            help="Only compare; exit non-zero if any counter is off"
+        )
+
+    def handle(self, *args, **options):
+        started = perf_counter()
+        days = 0
+        drift = []
+
+        for batch in day_batches(options["batch_size"]):
+            if options["check"]:
+                drift += check_day_stats(batch)
+            else:
+                refresh_day_stats(batch)
+            days += len(batch)
+
+        elapsed = perf_counter() - started
+
+        if options["check"]:
+            by_day = defaultdict(list)
+            for doctor_id, day, field, stored, actual in drift:
+                by_day[doctor_id, day].append(f"{field} {stored} -> {actual}")
+            for (doctor_id, day), fields in by_day.items():
+                self.stdout.write(f"doctor {doctor_id} {day}: {', '.join(fields)}")
+            if drift:
+                raise CommandError(
+                    f"{len(by_day)} of {days} doctor-days out of step; "
+                    f"run rebuild_day_stats to fix"
+                )
+            self.stdout.write(
+                self.style.SUCCESS(f"✅ {days} doctor-days consistent ({elapsed:.2f}s)")
+            )
+            return
+
+        self.stdout.write(
+            self.style.SUCCESS(f"✅ Rebuilt stats for {days} doctor-days in {elapsed:.2f}s")
+        )
@@ -1,3 +1,47 @@
 from django.db import models
 
-# Create your models here.
+from doctors.models import Doctor
+
+
+# -----------------------
+# DOCTOR DAY STATS
+# -----------------------
+class DoctorDayStats(models.Model):
+    """
+    Counters for one doctor-day, changed by dashboards.stats in the same
+    transaction as the TimeSlot/Appointment rows they summarize.
+    """
+    doctor = models.ForeignKey(
+        Doctor,
+        on_delete=models.CASCADE,
+        related_name="day_stats"
+    )
+    date = models.DateField()
+
+    # TimeSlot rows, and those with is_available set (an expired hold
+    # counts as taken until release_expired_holds frees it)
+    slots = models.IntegerField(default=0)
+    free = models.IntegerField(default=0)
+
+    # appointments by status
+    booked = models.IntegerField(default=0)
+    completed = models.IntegerField(default=0)
+    cancelled = models.IntegerField(default=0)
+
+    # amount of PAID appointments
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["doctor", "date"],
+                name="one_stats_row_per_doctor_day",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.doctor} | {self.date}"
+
+    @property
+    def appointments(self):
+        return self.booked + self.completed + self.cancelled
@@ -0,0 +1,246 @@
+# DoctorDayStats maintenance.
+#
+# Every booking, cancellation, status change, payment and slot
+# add/delete calls bump_day_stats() inside its own transaction, so the
+# counters commit or roll back with the change. Days whose slots were
+# just generated from scratch are counted from the rows written
+# (count_new_days); any other day that has no row yet, or had gaps
+# filled, goes through refresh_day_stats(), which recounts it from the
+# source tables under the row lock.
+# The rebuild_day_stats command recounts every day in batches, or with
+# --check only reports drift.
+from decimal import Decimal
+
+from django.db import models, transaction
+from django.db.models import Case, Count, Exists, F, OuterRef, Q, Sum, Value, When
+
+from appointments.models import Appointment, TimeSlot
+from .models import DoctorDayStats
+
+
+FIELDS = ("slots", "free", "booked", "completed", "cancelled", "revenue")
+
+
+def _output_field(field):
+    if field == "revenue":
+        return models.DecimalField(max_digits=12, decimal_places=2)
+    return models.IntegerField()
+
+
+def _pairs_q(pairs):
+    q = Q()
+    for doctor_id, day in pairs:
+        q |= Q(doctor_id=doctor_id, date=day)
+    return q
+
+
+# ------------------------
+# COUNTING FROM SCRATCH
+# ------------------------
+def compute_day_stats(pairs):
+    """{(doctor_id, date): {field: value}} counted from slots and appointments."""
+    pairs = set(pairs)
+    if not pairs:
+        return {}
+
+    doctors = {doctor_id for doctor_id, _ in pairs}
+    dates = {day for _, day in pairs}
+    stats = {
+        pair: dict(dict.fromkeys(FIELDS, 0), revenue=Decimal("0"))
+        for pair in pairs
+    }
+
+    for row in TimeSlot.objects.filter(
+        doctor_id__in=doctors,
+        date__in=dates
+    ).values("doctor_id", "date").annotate(
+        slot_count=Count("id"),
+        free_count=Count("id", filter=Q(is_available=True)),
+    ).order_by():
+        counts = stats.get((row["doctor_id"], row["date"]))
+        if counts is not None:
+            counts["slots"] = row["slot_count"]
+            counts["free"] = row["free_count"]
+
+    for row in Appointment.objects.filter(
+        doctor_id__in=doctors,
+        date__in=dates
+    ).values("doctor_id", "date").annotate(
+        booked_count=Count("id", filter=Q(status="BOOKED")),
+        completed_count=Count("id", filter=Q(status="COMPLETED")),
+        cancelled_count=Count("id", filter=Q(status="CANCELLED")),
+        paid=Sum("amount", filter=Q(payment_status="PAID")),
+    ).order_by():
+        counts = stats.get((row["doctor_id"], row["date"]))
+        if counts is not None:
+            counts["booked"] = row["booked_count"]
+            counts["completed"] = row["completed_count"]
+            counts["cancelled"] = row["cancelled_count"]
+            counts["revenue"] = row["paid"] or Decimal("0")
+
+    return stats
+
+
+def check_day_stats(pairs):
+    """[(doctor_id, date, field, stored, actual)] for every counter that drifted."""
+    pairs = set(pairs)
+    stored = {
+        (row.doctor_id, row.date): row
+        for row in DoctorDayStats.objects.filter(
+            doctor_id__in={doctor_id for doctor_id, _ in pairs},
+            date__in={day for _, day in pairs}
+        )
+    }
+
+    drift = []
+    for (doctor_id, day), actual in compute_day_stats(pairs).items():
+        row = stored.get((doctor_id, day))
+        if row is None and not any(actual.values()):
+            continue
+        for field, value in actual.items():
+            have = getattr(row, field) if row is not None else None
+            if have != value:
+                drift.append((doctor_id, day, field, have, value))
+    return drift
+
+
+# ------------------------
+# KEEPING IT CURRENT
+# ------------------------
+def refresh_day_stats(pairs):
+    """Recount the given doctor-days from the source tables."""
+    pairs = set(pairs)
+    if not pairs:
+        return
+
+    with transaction.atomic():
+        # insert missing rows first: a concurrent refresh of the same new
+        # day then waits on our row instead of racing us to insert it
+        DoctorDayStats.objects.bulk_create(
+            [DoctorDayStats(doctor_id=doctor_id, date=day) for doctor_id, day in pairs],
+            ignore_conflicts=True
+        )
+        rows = [
+            row for row in DoctorDayStats.objects.select_for_update().filter(
+                doctor_id__in={doctor_id for doctor_id, _ in pairs},
+                date__in={day for _, day in pairs}
+            )
+            if (row.doctor_id, row.date) in pairs
+        ]
+
+        # counted after taking the locks, so no committed change is missed
+        # and any later one is applied on top by its own bump
+        computed = compute_day_stats(pairs)
+        for row in rows:
+            for field, value in computed[row.doctor_id, row.date].items():
+                setattr(row, field, value)
+        DoctorDayStats.objects.bulk_update(rows, FIELDS)
+
+
+def count_new_days(counts):
+    """
+    Count doctor-days whose slots were just generated from scratch,
+    {(doctor_id, date): number of slots}, in two queries however many
+    days. Call inside the transaction that wrote the slots.
+
+    A day without slots has no row, or one left at zero after its slots
+    were deleted. A row with slots means a concurrent writer generated
+    and counted the day first (our inserts were all conflicts), so it
+    is left alone.
+    """
+    counts = {pair: n for pair, n in counts.items() if n}
+    if not counts:
+        return
+
+    if len(counts) == 1:
+        (n,) = counts.values()
+        n = Value(n)
+    else:
+        n = Case(
+            *[
+                When(doctor_id=doctor_id, date=day, then=Value(count))
+                for (doctor_id, day), count in counts.items()
+            ],
+            output_field=models.IntegerField()
+        )
+    DoctorDayStats.objects.filter(_pairs_q(counts), slots=0).update(slots=n, free=n)
+    DoctorDayStats.objects.bulk_create(
+        [
+            DoctorDayStats(doctor_id=doctor_id, date=day, slots=count, free=count)
+            for (doctor_id, day), count in counts.items()
+        ],
+        ignore_conflicts=True
+    )
+
+
+def bump_day_stats(deltas):
+    """
+    Apply {(doctor_id, date): {field: change}} with one UPDATE.
+    Call inside the transaction that makes the change.
+    """
+    deltas = {
+        pair: {field: change for field, change in changes.items() if change}
+        for pair, changes in deltas.items()
+    }
+    deltas = {pair: changes for pair, changes in deltas.items() if changes}
+    if not deltas:
+        return
+
+    if len(deltas) == 1:
+        (changes,) = deltas.values()
+        updates = {field: F(field) + change for field, change in changes.items()}
+    else:
+        fields = {field for changes in deltas.values() for field in changes}
+        updates = {
+            field: F(field) + Case(
+                *[
+                    When(doctor_id=doctor_id, date=day, then=Value(changes[field]))
+                    for (doctor_id, day), changes in deltas.items()
+                    if field in changes
+                ],
+                default=Value(0),
+                output_field=_output_field(field)
+            )
+            for field in fields
+        }
+
+    updated = DoctorDayStats.objects.filter(_pairs_q(deltas)).update(**updates)
+    if updated < len(deltas):
+        # first change of a day: count it, this change included
+        refresh_day_stats(deltas)
+
+
+# ------------------------
+# REBUILD
+# ------------------------
+def day_batches(batch_size=500):
+    """Every doctor-day with slots or a stats row, in lists of batch_size."""
+    last = None
+    while True:
+        days = TimeSlot.objects.order_by("date", "doctor_id")
+        if last is not None:
+            days = days.filter(
+                Q(date__gt=last[1]) | Q(date=last[1], doctor_id__gt=last[0])
+            )
+        batch = [
+            (doctor_id, day)
+            for day, doctor_id in days.values_list("date", "doctor_id").distinct()[:batch_size]
+        ]
+        if not batch:
+            break
+        yield batch
+        last = batch[-1]
+
+    # rows left behind by days whose slots were all deleted
+    orphans = DoctorDayStats.objects.exclude(
+        Exists(TimeSlot.objects.filter(doctor_id=OuterRef("doctor_id"), date=OuterRef("date")))
+    ).order_by("id")
+    last_id = 0
+    while True:
+        batch = list(orphans.filter(id__gt=last_id).values_list(
+            "id", "doctor_id", "date"
+        )[:batch_size])
+        if not batch:
+            break
+        yield [(doctor_id, day) for _, doctor_id, day in batch]
+        last_id = batch[-1][0]
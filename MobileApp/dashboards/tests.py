@@ -1,3 +1,134 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from appointments.availability import free_slots
+from appointments.booking import (
+    book_slot,
+    book_slots,
+    cancel_booking,
+    complete_booking,
+    mark_paid,
+    release_expired_holds,
+)
+from appointments.models import Appointment, TimeSlot
+from appointments.tests import next_weekday
+from doctors.models import Doctor
+from .models import DoctorDayStats
+from .stats import check_day_stats
+
+
+# ------------------------
+# DOCTOR DAY STATS
+# ------------------------
+class DoctorDayStatsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        doctor_user = User.objects.create(username="doctor")
+        doctor_user.profile.role = "DOCTOR"
+        doctor_user.profile.save()
+
+        self.doctor = Doctor.objects.create(
+            user=doctor_user,
+            name="Asha Rao",
+            specialization="Cardiology",
+            consultation_fee=500,
+        )
+        self.patient = User.objects.create(username="9000000001")
+        self.day = next_weekday()
+        self.slots = [s["id"] for s in free_slots(self.doctor, self.day)]
+
+    def stats(self, day=None):
+        return DoctorDayStats.objects.get(doctor=self.doctor, date=day or self.day)
+
+    def assert_consistent(self):
+        self.assertEqual(check_day_stats([(self.doctor.id, self.day)]), [])
+
+    def test_counters_follow_every_state_change(self):
+        self.assertEqual(self.stats().slots, len(self.slots))
+        self.assertEqual(self.stats().free, len(self.slots))
+
+        first = book_slot(self.slots[0], consultation_type="CLINIC", user=self.patient)
+        held = book_slot(self.slots[1], consultation_type="ONLINE", user=self.patient)
+        kept = book_slot(self.slots[2], consultation_type="CLINIC", user=self.patient)
+        self.assertEqual((self.stats().booked, self.stats().free), (3, len(self.slots) - 3))
+
+        cancel_booking(first)
+        complete_booking(kept)
+        with transaction.atomic():
+            self.assertTrue(mark_paid(kept))
+            self.assertFalse(mark_paid(kept))
+
+        past = timezone.now() - timedelta(minutes=1)
+        TimeSlot.objects.filter(id=self.slots[1]).update(held_until=past)
+        Appointment.objects.filter(id=held.id).update(hold_expires_at=past)
+        release_expired_holds()
+
+        stats = self.stats()
+        self.assertEqual(stats.free, len(self.slots) - 1)
+        self.assertEqual((stats.booked, stats.completed, stats.cancelled), (0, 1, 2))
+        self.assertEqual(stats.revenue, 500)
+        self.assert_consistent()
+
+    def test_rebooking_an_expired_hold_cancels_it_once(self):
+        held = book_slot(self.slots[0], consultation_type="ONLINE", user=self.patient)
+        past = timezone.now() - timedelta(minutes=1)
+        TimeSlot.objects.filter(id=self.slots[0]).update(held_until=past)
+        Appointment.objects.filter(id=held.id).update(hold_expires_at=past)
+
+        book_slot(self.slots[0], consultation_type="CLINIC", user=self.patient)
+
+        stats = self.stats()
+        self.assertEqual((stats.booked, stats.cancelled), (1, 1))
+        self.assertEqual(stats.free, len(self.slots) - 1)
+        self.assert_consistent()
+
+    def test_batch_booking_updates_each_day(self):
+        days = [self.day + timedelta(weeks=n) for n in range(3)]
+        ids = [free_slots(self.doctor, day)[0]["id"] for day in days]
+
+        book_slots(ids, consultation_type="CLINIC", user=self.patient)
+
+        for day in days:
+            self.assertEqual(self.stats(day).booked, 1)
+        self.assertEqual(check_day_stats([(self.doctor.id, day) for day in days]), [])
+
+    def test_rebuild_repairs_drift(self):
+        book_slot(self.slots[0], consultation_type="CLINIC", user=self.patient)
+        DoctorDayStats.objects.filter(doctor=self.doctor).update(booked=99, free=0)
+        next_week = self.day + timedelta(weeks=1)
+        free_slots(self.doctor, next_week)
+        DoctorDayStats.objects.filter(date=next_week).delete()
+
+        with self.assertRaises(CommandError):
+            call_command("rebuild_day_stats", "--check", stdout=StringIO())
+
+        call_command("rebuild_day_stats", batch_size=1, stdout=StringIO())
+        call_command("rebuild_day_stats", "--check", stdout=StringIO())
+
+        self.assertEqual(self.stats().booked, 1)
+        self.assertEqual(self.stats(next_week).free, len(self.slots))
+
+    def test_dashboard_reads_the_stats_row(self):
+        self.day = timezone.localdate()
+        self.slots = [s["id"] for s in free_slots(self.doctor, self.day)]
+        for slot_id in self.slots[:2]:
+            book_slot(slot_id, consultation_type="CLINIC", user=self.patient)
+        self.client.force_login(self.doctor.user)
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse("doctors:doctor_dashboard"))
 
-# Create your tests here.
+        self.assertEqual(response.context["stats"].booked, len(self.slots[:2]))
+        self.assertFalse(any(
+            Appointment._meta.db_table in q["sql"] or TimeSlot._meta.db_table in q["sql"]
+            for q in ctx.captured_queries
+        ))
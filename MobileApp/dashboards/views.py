@@ -2,8 +2,11 @@ from django.contrib.auth.decorators import login_required
 from django.shortcuts import render, redirect,get_object_or_404
 from django.utils.timezone import now,localdate
 from django.contrib import messages
+from django.db import transaction
 from doctors.models import Doctor
+from doctors.day_view import day_stats
 from appointments.models import Appointment, TimeSlot
+from .stats import bump_day_stats, refresh_day_stats
 from django.db.models import Q
 from datetime import date, datetime
 
@@ -46,16 +49,13 @@ def doctor_dashboard(request):
     except Doctor.DoesNotExist:
         return redirect("phone_register")
 
-    today = now().date()
-
-    today_appointments_count = Appointment.objects.filter(
-        doctor=doctor,
-        slot__date=today
-    ).count()
+    # one row of counters kept current by the booking paths
+    stats = day_stats(doctor, localdate())
 
     context = {
         "doctor": doctor,
-        "today_appointments_count": today_appointments_count
+        "stats": stats,
+        "today_appointments_count": stats.appointments
     }
 
     return render(
@@ -87,8 +87,8 @@ def doctor_daily_appointments(request):
 
     appointments = Appointment.objects.filter(
         doctor=doctor,
-        slot__date=today
-    ).select_related("user", "slot").order_by("slot__start_time")
+        date=today
+    ).select_related("user").order_by("starts_at")
 
     context = {
         "doctor": doctor,
@@ -127,12 +127,15 @@ def doctor_slots(request):
         if overlap:
             messages.error(request, "Slot overlaps with existing slot")
         else:
-            TimeSlot.objects.create(
-                doctor=doctor,
-                date=date,
-                start_time=start_time,
-                end_time=end_time
-            )
+            with transaction.atomic():
+                TimeSlot.objects.create(
+                    doctor=doctor,
+                    date=date,
+                    start_time=start_time,
+                    end_time=end_time
+                )
+                slot_date = datetime.strptime(date, "%Y-%m-%d").date()
+                bump_day_stats({(doctor.id, slot_date): {"slots": 1, "free": 1}})
             messages.success(request, "Slot added successfully")
 
         return redirect("doctor_slots")
@@ -166,7 +169,9 @@ def delete_slot(request, slot_id):
         messages.error(request, "Cannot delete a booked slot")
         return redirect("doctor_slots")
 
-    slot.delete()
+    with transaction.atomic():
+        slot.delete()
+        refresh_day_stats([(slot.doctor_id, slot.date)])
     messages.success(request, "Slot deleted successfully")
     return redirect("doctor_slots")
 
@@ -190,8 +195,8 @@ def doctor_appointments(request):
 
     appointments = Appointment.objects.filter(
         doctor=doctor,
-        slot__date=selected_date
-    ).select_related("user", "slot").order_by("slot__start_time")
+        date=selected_date
+    ).select_related("user").order_by("starts_at")
 
     return render(
         request,
@@ -227,12 +232,5 @@ def doctor_appointment_history(request, appointment_id):
 
 @login_required
 def staff_appointments(request):
-    appointments = Appointment.objects.select_related(
-        "doctor", "user", "slot"
-    ).order_by("-slot__date")
-
-    return render(
-        request,
-        "staff/staff_appointments.html",
-        {"appointments": appointments}
-    )
+    # the unpaginated list is replaced by the staff console
+    return redirect("staff:appointment_console")
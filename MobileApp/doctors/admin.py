@@ -1,5 +1,11 @@
 from django.contrib import admin
-from .models import Doctor
+from .models import Doctor, DoctorSchedule, Holiday
+
+
+class DoctorScheduleInline(admin.TabularInline):
+    model = DoctorSchedule
+    extra = 0
+
 
 @admin.register(Doctor)
 class DoctorAdmin(admin.ModelAdmin):
@@ -7,10 +13,18 @@ class DoctorAdmin(admin.ModelAdmin):
     search_fields = ("name", "specialization")
     list_filter = ("specialization", "is_active")
     ordering = ("name",)
+    inlines = (DoctorScheduleInline,)
     list_display = (
         "name",
         "specialization",
         "experience_years",
         "consultation_fee",
         "is_active",
-    )
\ No newline at end of file
+    )
+
+
+@admin.register(Holiday)
+class HolidayAdmin(admin.ModelAdmin):
+    list_display = ("date", "doctor", "reason")
+    list_filter = ("doctor",)
+    ordering = ("-date",)
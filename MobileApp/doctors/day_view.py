@@ -0,0 +1,80 @@
+# Doctor's appointment list for one day, with report counts and the
+# latest upload annotated in the same query, behind an optional
+# short-lived cache.
+#
+# The cache key combines the day's availability version (bumped by
+# every booking, cancellation and hold release) with a version of its
+# own, bumped by report uploads/deletes and status changes.
+#
+# day_stats() is the dashboard's read of the day's counters: one row.
+import time as _time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Max
+
+from appointments.availability import availability_version, is_virtual
+from appointments.models import Appointment
+from appointments.slots import build_day_slots, is_working_day
+from dashboards.models import DoctorDayStats
+
+
+def _version_key(doctor_id, day):
+    return f"doctor_day:version:{doctor_id}:{day:%Y%m%d}"
+
+
+def day_appointments(doctor, day):
+    return list(Appointment.objects.filter(
+        doctor=doctor,
+        date=day
+    ).select_related(
+        "user", "booked_by_staff"
+    ).annotate(
+        report_count=Count("reports"),
+        last_report_at=Max("reports__uploaded_at"),
+    ).order_by("starts_at"))
+
+
+def cached_day_appointments(doctor, day):
+    timeout = settings.DOCTOR_DAY_CACHE_TIMEOUT
+    if not timeout:
+        return day_appointments(doctor, day)
+
+    version_key = _version_key(doctor.id, day)
+    version = cache.get(version_key)
+    if version is None:
+        cache.add(version_key, _time.time_ns(), timeout)
+        version = cache.get(version_key)
+
+    key = (
+        f"doctor_day:{doctor.id}:{day:%Y%m%d}:"
+        f"{availability_version(doctor.id, day)}:{version}"
+    )
+
+    appointments = cache.get(key)
+    if appointments is None:
+        appointments = day_appointments(doctor, day)
+        cache.set(key, appointments, timeout)
+    return appointments
+
+
+def invalidate_doctor_day(doctor_id, day):
+    version_key = _version_key(doctor_id, day)
+    transaction.on_commit(
+        lambda: cache.set(version_key, _time.time_ns(), settings.DOCTOR_DAY_CACHE_TIMEOUT)
+    )
+
+
+def day_stats(doctor, day):
+    """
+    The doctor-day's DoctorDayStats row (zeros if it has none yet). In
+    virtual mode free template slots have no row; they're added here.
+    """
+    stats = DoctorDayStats.objects.filter(doctor=doctor, date=day).first()
+    if stats is None:
+        stats = DoctorDayStats(doctor=doctor, date=day)
+
+    if is_virtual() and is_working_day(doctor, day):
+        stats.free += max(len(build_day_slots(doctor, day)) - stats.slots, 0)
+    return stats
@@ -0,0 +1,57 @@
+# Generated by Django 6.0 on 2026-10-18 18:46
+
+import django.db.models.deletion
+import datetime
+from django.db import migrations, models
+
+
+# the dates that used to be hard-coded as HOLIDAYS in appointments/views.py
+LEGACY_HOLIDAYS = [
+    (datetime.date(2025, 1, 26), 'Republic Day'),
+    (datetime.date(2025, 8, 15), 'Independence Day'),
+    (datetime.date(2025, 10, 2), 'Gandhi Jayanti'),
+]
+
+
+def seed_holidays(apps, schema_editor):
+    Holiday = apps.get_model('doctors', 'Holiday')
+    Holiday.objects.bulk_create([
+        Holiday(date=day, reason=reason) for day, reason in LEGACY_HOLIDAYS
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('doctors', '0006_alter_doctor_user'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DoctorSchedule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('weekday', models.PositiveSmallIntegerField(choices=[(0, 'Monday'), (1, 'Tuesday'), (2, 'Wednesday'), (3, 'Thursday'), (4, 'Friday'), (5, 'Saturday'), (6, 'Sunday')])),
+                ('start_time', models.TimeField()),
+                ('end_time', models.TimeField()),
+                ('slot_minutes', models.PositiveSmallIntegerField(default=30)),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='schedules', to='doctors.doctor')),
+            ],
+            options={
+                'ordering': ['doctor', 'weekday', 'start_time'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Holiday',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('reason', models.CharField(blank=True, max_length=100)),
+                ('doctor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='leaves', to='doctors.doctor')),
+            ],
+            options={
+                'ordering': ['date'],
+            },
+        ),
+        migrations.RunPython(seed_holidays, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 6.0 on 2026-10-19 09:12
+
+import django.core.validators
+from django.db import migrations, models
+from django.db.models import F
+
+
+def repair_schedules(apps, schema_editor):
+    # rows the new constraints would reject: empty intervals never
+    # produced a slot, and 0-minute slots hung slot generation
+    DoctorSchedule = apps.get_model('doctors', 'DoctorSchedule')
+    DoctorSchedule.objects.filter(start_time__gte=F('end_time')).delete()
+    DoctorSchedule.objects.filter(slot_minutes=0).update(slot_minutes=30)
+    DoctorSchedule.objects.filter(slot_minutes__lt=5).update(slot_minutes=5)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('doctors', '0007_doctorschedule_holiday'),
+    ]
+
+    operations = [
+        migrations.RunPython(repair_schedules, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='doctorschedule',
+            name='slot_minutes',
+            field=models.PositiveSmallIntegerField(default=30, validators=[django.core.validators.MinValueValidator(5)]),
+        ),
+        migrations.AddConstraint(
+            model_name='doctorschedule',
+            constraint=models.CheckConstraint(condition=models.Q(('slot_minutes__gte', 5)), name='doctorschedule_slot_minutes_min'),
+        ),
+        migrations.AddConstraint(
+            model_name='doctorschedule',
+            constraint=models.CheckConstraint(condition=models.Q(('start_time__lt', models.F('end_time'))), name='doctorschedule_start_before_end'),
+        ),
+    ]
@@ -1,6 +1,9 @@
 from django.db import models
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.core.exceptions import ValidationError
+from django.core.validators import MinValueValidator
+from django.core.signals import request_started
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from accounts.models import Profile
 
@@ -27,3 +30,107 @@ def set_doctor_role(sender, instance, created, **kwargs):
         profile, _ = Profile.objects.get_or_create(user=instance.user)
         profile.role = "DOCTOR"
         profile.save()
+
+
+# -----------------------
+# WEEKLY SCHEDULE
+# -----------------------
+WEEKDAY_CHOICES = [
+    (0, "Monday"),
+    (1, "Tuesday"),
+    (2, "Wednesday"),
+    (3, "Thursday"),
+    (4, "Friday"),
+    (5, "Saturday"),
+    (6, "Sunday"),
+]
+
+
+MIN_SLOT_MINUTES = 5
+
+
+class DoctorSchedule(models.Model):
+    """
+    One working interval of a doctor's week, e.g. Monday 10:00-12:00.
+    Doctors without any rows use the clinic default hours.
+    """
+    doctor = models.ForeignKey(
+        Doctor,
+        on_delete=models.CASCADE,
+        related_name="schedules"
+    )
+    weekday = models.PositiveSmallIntegerField(choices=WEEKDAY_CHOICES)
+    start_time = models.TimeField()
+    end_time = models.TimeField()
+    slot_minutes = models.PositiveSmallIntegerField(
+        default=30,
+        validators=[MinValueValidator(MIN_SLOT_MINUTES)]
+    )
+
+    class Meta:
+        ordering = ["doctor", "weekday", "start_time"]
+        constraints = [
+            models.CheckConstraint(
+                condition=models.Q(slot_minutes__gte=MIN_SLOT_MINUTES),
+                name="doctorschedule_slot_minutes_min",
+            ),
+            models.CheckConstraint(
+                condition=models.Q(start_time__lt=models.F("end_time")),
+                name="doctorschedule_start_before_end",
+            ),
+        ]
+
+    def clean(self):
+        if self.start_time and self.end_time and self.start_time >= self.end_time:
+            raise ValidationError("Start time must be before end time")
+
+    def __str__(self):
+        return f"{self.doctor.name} | {self.get_weekday_display()} {self.start_time}-{self.end_time}"
+
+
+# -----------------------
+# HOLIDAYS / LEAVE
+# -----------------------
+class Holiday(models.Model):
+    """
+    A day off. Without a doctor it closes the whole clinic,
+    with a doctor it is that doctor's leave.
+    """
+    date = models.DateField()
+    doctor = models.ForeignKey(
+        Doctor,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name="leaves"
+    )
+    reason = models.CharField(max_length=100, blank=True)
+
+    class Meta:
+        ordering = ["date"]
+
+    def __str__(self):
+        who = self.doctor.name if self.doctor_id else "Clinic"
+        return f"{who} | {self.date} {self.reason}".strip()
+
+
+class ScheduleVersion(models.Model):
+    """
+    A single row counting DoctorSchedule/Holiday changes. It is bumped
+    in the same transaction as the change, so any process sees the new
+    version together with the new rows (see doctors.schedule).
+    """
+    version = models.PositiveBigIntegerField(default=0)
+
+
+@receiver([post_save, post_delete], sender=DoctorSchedule)
+@receiver([post_save, post_delete], sender=Holiday)
+def invalidate_schedule(sender, **kwargs):
+    from .schedule import bump_schedule_version
+    bump_schedule_version()
+
+
+@receiver(request_started)
+def recheck_schedule(sender, **kwargs):
+    from .schedule import schedule_check_due
+    schedule_check_due()
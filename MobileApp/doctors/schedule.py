@@ -0,0 +1,127 @@
+# Compiled, in-process view of doctors' working hours.
+#
+# Templates and holidays are compiled into dicts, so "is doctor X working
+# on day D, and when?" needs no query. Every DoctorSchedule/Holiday change
+# bumps the ScheduleVersion row in its own transaction. A process reads
+# that row once per request (one primary-key query) and recompiles when
+# it has moved, so an edit reaches every worker by its next request.
+# Outside requests the version is re-read only after this process's own
+# edits, so a long-running command keeps the schedule it started with.
+from collections import defaultdict
+from datetime import time
+
+from django.db import transaction
+from django.db.models import F
+
+
+# -------------------------
+# CLINIC DEFAULTS
+# -------------------------
+# used for doctors that have no DoctorSchedule rows
+DEFAULT_SLOT_MINUTES = 30
+
+DEFAULT_WORKING_HOURS = (
+    (time(10, 0), time(12, 0), DEFAULT_SLOT_MINUTES),
+    (time(13, 0), time(17, 0), DEFAULT_SLOT_MINUTES),
+)
+
+# Monday..Friday
+DEFAULT_WEEK = tuple(
+    DEFAULT_WORKING_HOURS if weekday < 5 else ()
+    for weekday in range(7)
+)
+
+SCHEDULE_VERSION_ID = 1
+
+
+# -------------------------
+# COMPILED LOOKUP
+# -------------------------
+class ScheduleLookup:
+    def __init__(self, version, weeks, holidays, leaves):
+        self.version = version
+        self.weeks = weeks          # doctor_id -> 7-tuple of intervals
+        self.holidays = holidays    # frozenset of clinic-wide dates
+        self.leaves = leaves        # frozenset of (doctor_id, date)
+
+    def intervals(self, doctor_id, day):
+        """
+        Working intervals for a doctor-day as
+        ((start_time, end_time, slot_minutes), ...); empty if off.
+        """
+        if day in self.holidays or (doctor_id, day) in self.leaves:
+            return ()
+        return self.weeks.get(doctor_id, DEFAULT_WEEK)[day.weekday()]
+
+    def is_working(self, doctor_id, day):
+        return bool(self.intervals(doctor_id, day))
+
+
+def compile_schedule(version):
+    from .models import DoctorSchedule, Holiday
+
+    rows = defaultdict(lambda: [[] for _ in range(7)])
+    for doctor_id, weekday, start, end, minutes in DoctorSchedule.objects.values_list(
+        "doctor_id", "weekday", "start_time", "end_time", "slot_minutes"
+    ).order_by("doctor_id", "weekday", "start_time"):
+        rows[doctor_id][weekday].append((start, end, minutes))
+
+    weeks = {
+        doctor_id: tuple(tuple(day) for day in days)
+        for doctor_id, days in rows.items()
+    }
+
+    holidays = set()
+    leaves = set()
+    for doctor_id, day in Holiday.objects.values_list("doctor_id", "date"):
+        if doctor_id is None:
+            holidays.add(day)
+        else:
+            leaves.add((doctor_id, day))
+
+    return ScheduleLookup(version, weeks, frozenset(holidays), frozenset(leaves))
+
+
+def current_version():
+    from .models import ScheduleVersion
+
+    return ScheduleVersion.objects.filter(
+        id=SCHEDULE_VERSION_ID
+    ).values_list("version", flat=True).first() or 0
+
+
+_compiled = None
+_check_due = True
+
+
+def schedule_check_due():
+    """Make the next get_schedule() re-read the version."""
+    global _check_due
+    _check_due = True
+
+
+def get_schedule():
+    global _compiled, _check_due
+
+    if _compiled is None or _check_due:
+        # cleared first: an edit committing meanwhile sets it again
+        _check_due = False
+        # read before the rows: a version never labels older rows
+        version = current_version()
+        if _compiled is None or _compiled.version != version:
+            _compiled = compile_schedule(version)
+    return _compiled
+
+
+def bump_schedule_version():
+    """Call in the transaction that changes DoctorSchedule/Holiday rows."""
+    from .models import ScheduleVersion
+
+    if not ScheduleVersion.objects.filter(id=SCHEDULE_VERSION_ID).update(
+        version=F("version") + 1
+    ):
+        ScheduleVersion.objects.create(id=SCHEDULE_VERSION_ID, version=1)
+
+    # this thread sees the new rows now, other threads once it commits
+    schedule_check_due()
+    transaction.on_commit(schedule_check_due)
@@ -1,3 +1,323 @@
-from django.test import TestCase
+import tempfile
+import zipfile
+from datetime import time, timedelta
+from io import BytesIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.signals import request_started
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from appointments.availability import free_slots
+from appointments.booking import book_slot
+from appointments.models import AppointmentReport
+from appointments.tests import next_weekday
+from core.media import CHUNK_SIZE
+from . import schedule
+from .models import Doctor, DoctorSchedule, Holiday, ScheduleVersion
+from .schedule import DEFAULT_WORKING_HOURS, get_schedule
+
+
+# ------------------------
+# DOCTOR DAY VIEW
+# ------------------------
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class DoctorDayViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        doctor_user = User.objects.create(username="doctor")
+        doctor_user.profile.role = "DOCTOR"
+        doctor_user.profile.save()
+
+        self.doctor = Doctor.objects.create(
+            user=doctor_user,
+            name="Asha Rao",
+            specialization="Cardiology",
+        )
+        self.patient = User.objects.create(username="9000000001")
+        self.day = next_weekday()
+        self.client.force_login(doctor_user)
+
+    def add_appointments(self, count, reports=2):
+        for slot in free_slots(self.doctor, self.day)[:count]:
+            appointment = book_slot(slot["id"], consultation_type="CLINIC", user=self.patient)
+            AppointmentReport.objects.bulk_create(
+                AppointmentReport(appointment=appointment, file=f"appointment_reports/{n}.pdf")
+                for n in range(reports)
+            )
+
+    def get_day(self):
+        with CaptureQueriesContext(connection) as ctx:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.get(
+                    reverse("doctors:doctor_appointments"), {"date": self.day.isoformat()}
+                )
+        return response, len(ctx.captured_queries)
+
+    @override_settings(DOCTOR_DAY_CACHE_TIMEOUT=0)
+    def test_query_budget_is_independent_of_rows(self):
+        self.add_appointments(1)
+        _, one = self.get_day()
+
+        self.add_appointments(10, reports=3)
+        response, many = self.get_day()
+
+        self.assertEqual(one, many)
+        self.assertLessEqual(many, 5)
+        self.assertContains(response, "View Reports (3)")
+
+    def test_report_upload_invalidates_cached_day(self):
+        self.add_appointments(1)
+        _, cold = self.get_day()
+        _, warm = self.get_day()
+        self.assertLess(warm, cold)
+
+        appointment = self.doctor.appointment_set.get()
+        self.client.force_login(self.patient)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("appointments:delete_report", args=[
+                appointment.reports.first().id
+            ]))
+        self.client.force_login(self.doctor.user)
+
+        response, _ = self.get_day()
+        self.assertContains(response, "View Reports (1)")
+
+
+# ------------------------
+# WEEKLY SCHEDULE
+# ------------------------
+class FreshScheduleMixin:
+    def setUp(self):
+        super().setUp()
+        # every test rolls the version row back, so a schedule compiled
+        # by an earlier test could carry the version this one reaches
+        self.enterContext(mock.patch.object(schedule, "_compiled", None))
+
+
+class DoctorScheduleValidationTests(FreshScheduleMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.doctor = Doctor.objects.create(
+            user=User.objects.create(username="doctor"),
+            name="Asha Rao",
+            specialization="Cardiology",
+        )
+
+    def schedule(self, start=time(10), end=time(12), minutes=30):
+        return DoctorSchedule(
+            doctor=self.doctor, weekday=0, start_time=start, end_time=end, slot_minutes=minutes
+        )
+
+    def test_form_validation(self):
+        self.schedule().full_clean()
+        for row, field in [
+            (self.schedule(minutes=0), "slot_minutes"),
+            (self.schedule(minutes=4), "slot_minutes"),
+            (self.schedule(start=time(12), end=time(12)), "__all__"),
+            (self.schedule(start=time(13), end=time(12)), "__all__"),
+        ]:
+            with self.subTest(start=row.start_time, end=row.end_time, minutes=row.slot_minutes):
+                with self.assertRaises(ValidationError) as ctx:
+                    row.full_clean()
+                self.assertIn(field, ctx.exception.message_dict)
+
+    def test_database_rejects_what_validation_would(self):
+        for row in [self.schedule(minutes=0), self.schedule(start=time(12), end=time(10))]:
+            with self.subTest(minutes=row.slot_minutes), self.assertRaises(IntegrityError):
+                with transaction.atomic():
+                    row.save()
+
+
+class ScheduleLookupTests(FreshScheduleMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.scheduled, self.default = [
+            Doctor.objects.create(
+                user=User.objects.create(username=f"doctor{i}"),
+                name=f"Doctor {i}",
+                specialization="Cardiology",
+            )
+            for i in range(2)
+        ]
+        DoctorSchedule.objects.bulk_create([
+            DoctorSchedule(doctor=self.scheduled, weekday=0, start_time=time(14), end_time=time(16)),
+            DoctorSchedule(
+                doctor=self.scheduled, weekday=0, start_time=time(9), end_time=time(11), slot_minutes=15
+            ),
+            DoctorSchedule(doctor=self.scheduled, weekday=5, start_time=time(10), end_time=time(13)),
+        ])
+        ScheduleVersion.objects.update(version=F("version") + 1)
+        request_started.send(sender=self.__class__)
+
+        day = next_weekday()
+        self.monday = day + timedelta(days=7 - day.weekday())
+        self.week = [self.monday + timedelta(days=i) for i in range(7)]
+
+    def test_intervals_per_weekday_in_time_order(self):
+        schedule = get_schedule()
+        self.assertEqual(
+            [schedule.intervals(self.scheduled.id, day) for day in self.week],
+            [
+                ((time(9), time(11), 15), (time(14), time(16), 30)),
+                (), (), (), (),
+                ((time(10), time(13), 30),),
+                (),
+            ],
+        )
+        self.assertEqual(
+            [schedule.is_working(self.scheduled.id, day) for day in self.week],
+            [True, False, False, False, False, True, False],
+        )
+
+    def test_doctors_without_rows_use_the_clinic_week(self):
+        schedule = get_schedule()
+        self.assertEqual(
+            [schedule.intervals(self.default.id, day) for day in self.week],
+            [DEFAULT_WORKING_HOURS] * 5 + [(), ()],
+        )
+
+    def test_clinic_holidays_and_leave(self):
+        tuesday = self.week[1]
+        Holiday.objects.create(date=self.monday, reason="Clinic closed")
+        Holiday.objects.create(date=tuesday, doctor=self.default, reason="Leave")
+
+        schedule = get_schedule()
+        for doctor in (self.scheduled, self.default):
+            self.assertFalse(schedule.is_working(doctor.id, self.monday))
+        self.assertFalse(schedule.is_working(self.default.id, tuesday))
+        self.assertTrue(schedule.is_working(self.default.id, self.week[2]))
+        self.assertTrue(schedule.is_working(self.scheduled.id, self.week[5]))
+
+
+class ScheduleVersionTests(FreshScheduleMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.doctor = Doctor.objects.create(
+            user=User.objects.create(username="doctor"),
+            name="Asha Rao",
+            specialization="Cardiology",
+        )
+        day = next_weekday()
+        self.monday = day + timedelta(days=7 - day.weekday())
+
+    def test_local_edits_apply_at_once(self):
+        self.assertEqual(len(get_schedule().intervals(self.doctor.id, self.monday)), 2)
+        DoctorSchedule.objects.create(
+            doctor=self.doctor, weekday=0, start_time=time(9), end_time=time(11)
+        )
+        self.assertEqual(
+            get_schedule().intervals(self.doctor.id, self.monday), ((time(9), time(11), 30),)
+        )
+
+    def test_other_workers_edits_apply_from_the_next_request(self):
+        before = get_schedule()
+        # what another process's edit leaves behind: new rows, a new version
+        DoctorSchedule.objects.bulk_create([
+            DoctorSchedule(doctor=self.doctor, weekday=0, start_time=time(9), end_time=time(11))
+        ])
+        ScheduleVersion.objects.update(version=F("version") + 1)
+
+        self.assertIs(get_schedule(), before)
+        request_started.send(sender=self.__class__)
+        self.assertEqual(
+            get_schedule().intervals(self.doctor.id, self.monday), ((time(9), time(11), 30),)
+        )
+
+        with CaptureQueriesContext(connection) as ctx:
+            request_started.send(sender=self.__class__)
+            get_schedule()
+            get_schedule()
+        self.assertEqual(len(ctx.captured_queries), 1)
+
+
+# ------------------------
+# REPORT EXPORT
+# ------------------------
+class ReportExportTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.media = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        self.enterContext(self.settings(MEDIA_ROOT=self.media))
+
+        doctor_user = User.objects.create(username="doctor")
+        doctor_user.profile.role = "DOCTOR"
+        doctor_user.profile.save()
+        self.doctor = Doctor.objects.create(
+            user=doctor_user,
+            name="Asha Rao",
+            specialization="Cardiology",
+        )
+        patient = User.objects.create(username="9000000001")
+        self.appointment = book_slot(
+            free_slots(self.doctor, next_weekday())[0]["id"], consultation_type="CLINIC", user=patient
+        )
+
+        self.files = {
+            "scan.pdf": b"%PDF-1.7\n" + bytes(range(256)) * 3000,
+            "photo.png": b"\x89PNG\r\n\x1a\n" + b"p" * 100,
+        }
+        self.client.force_login(patient)
+        self.client.post(
+            reverse("appointments:upload_report", args=[self.appointment.id]),
+            {"reports": [SimpleUploadedFile(name, data) for name, data in self.files.items()]},
+        )
+        self.client.force_login(doctor_user)
+        self.url = reverse("doctors:doctor_download_reports", args=[self.appointment.id])
+
+    def test_archive_streams_while_files_are_read(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response["Content-Type"], "application/zip")
+        self.assertTrue(response.streaming)
+        self.assertFalse(response.has_header("Content-Length"))
+
+        chunks = list(response.streaming_content)
+        self.assertGreater(len(chunks), 4)
+        self.assertLessEqual(max(map(len, chunks)), CHUNK_SIZE + 1024)
+
+        archive = zipfile.ZipFile(BytesIO(b"".join(chunks)))
+        self.assertIsNone(archive.testzip())
+        folder = f"{self.appointment.date:%Y-%m-%d}-appointment-{self.appointment.id}"
+        by_name = {
+            f"{folder}/report-{report.id}{Path(report.file.name).suffix}": report
+            for report in self.appointment.reports.all()
+        }
+        self.assertEqual(sorted(archive.namelist()), sorted(by_name))
+        self.assertEqual(
+            sorted(archive.read(name) for name in by_name), sorted(self.files.values())
+        )
+
+    async def test_asgi_sends_each_chunk_as_it_is_built(self):
+        await sync_to_async(self.async_client.force_login)(self.doctor.user)
+        response = await self.async_client.get(self.url)
+        self.assertTrue(response.is_async)  # a sync iterator is buffered whole
+
+        chunks = [chunk async for chunk in response.streaming_content]
+        self.assertGreater(len(chunks), 4)
+        self.assertLessEqual(max(map(len, chunks)), CHUNK_SIZE + 1024)
+        archive = zipfile.ZipFile(BytesIO(b"".join(chunks)))
+        self.assertIsNone(archive.testzip())
+        self.assertEqual(len(archive.namelist()), 2)
+
+    def test_missing_files_are_left_out_and_other_doctors_refused(self):
+        report = self.appointment.reports.get(blob__size=len(self.files["photo.png"]))
+        (self.media / report.file.name).unlink()
+
+        archive = zipfile.ZipFile(BytesIO(b"".join(self.client.get(self.url).streaming_content)))
+        self.assertEqual(len(archive.namelist()), 1)
+
+        other = User.objects.create(username="other-doctor")
+        other.profile.role = "DOCTOR"
+        other.profile.save()
+        Doctor.objects.create(user=other, name="Other", specialization="Cardiology")
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
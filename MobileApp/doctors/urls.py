@@ -8,6 +8,7 @@ from .views import (
     delete_slot,
     doctor_list,
     doctor_view_reports,
+    doctor_download_reports,
 )
 
 app_name = "doctors"
@@ -32,5 +33,10 @@ urlpatterns = [
     doctor_view_reports,
     name="doctor_view_reports"
 ),
+    path(
+        "appointments/<int:appointment_id>/reports.zip",
+        doctor_download_reports,
+        name="doctor_download_reports"
+    ),
 
 ]
@@ -20,8 +20,14 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.utils import timezone
 from datetime import date, datetime
 from django.contrib import messages
+from django.db import transaction
 
 from appointments.models import Appointment, TimeSlot
+from appointments.availability import invalidate_availability, next_slot_by_doctor
+from appointments.booking import cancel_booking, complete_booking
+from appointments.exports import reports_zip
+from dashboards.stats import bump_day_stats, refresh_day_stats
+from .day_view import cached_day_appointments, day_stats, invalidate_doctor_day
 from .models import Doctor
 from functools import wraps
 
@@ -29,7 +35,13 @@ from functools import wraps
 @login_required
 @doctor_required
 def doctor_dashboard(request):
-    return render(request, "doctors/dashboard.html")
+    doctor = get_object_or_404(Doctor, user=request.user)
+
+    return render(
+        request,
+        "doctors/dashboard.html",
+        {"stats": day_stats(doctor, timezone.localdate())}
+    )
 
 @login_required
 @doctor_required
@@ -42,12 +54,8 @@ def doctor_appointments(request):
         if date_str else date.today()
     )
 
-    appointments = Appointment.objects.filter(
-        doctor=doctor,
-        slot__date=selected_date
-    ).select_related(
-        "user", "booked_by_staff", "slot"
-    ).order_by("slot__start_time")
+    # report counts are annotated, no per-row queries
+    appointments = cached_day_appointments(doctor, selected_date)
 
     return render(
         request,
@@ -79,6 +87,7 @@ def doctor_edit_slot(request, slot_id):
             request.POST.get("end_time"), "%H:%M"
         ).time()
         slot.save()
+        invalidate_availability(slot.doctor_id, slot.date)
 
     return redirect("doctors:doctor_slots")
 
@@ -94,10 +103,10 @@ def doctor_mark_completed(request, appointment_id):
 
     if request.method == "POST":
         if request.POST.get("cancel"):
-            appointment.status = "CANCELLED"
+            cancel_booking(appointment)
         else:
-            appointment.status = "COMPLETED"
-        appointment.save()
+            complete_booking(appointment)
+            invalidate_doctor_day(appointment.doctor_id, appointment.date)
 
     return redirect("doctors:doctor_appointments")
 
@@ -116,7 +125,11 @@ def delete_slot(request, slot_id):
     )
 
     date_str = slot.date.strftime("%Y-%m-%d")
-    slot.delete()
+    with transaction.atomic():
+        slot.delete()
+        # the slot's cancelled appointments go with it, so recount
+        refresh_day_stats([(slot.doctor_id, slot.date)])
+    invalidate_availability(slot.doctor_id, slot.date)
     messages.success(request, "Slot deleted")
     return redirect(f"/dashboard/doctor/slots/?date={date_str}")
 
@@ -129,9 +142,14 @@ def doctor_list(request):
         return redirect("post_login_redirect")
 
 
-    doctors = Doctor.objects.filter(is_active=True)
+    doctors = list(Doctor.objects.filter(is_active=True))
     consultation_type = request.GET.get("type", "ONLINE")
 
+    # earliest free slot per doctor, one or two slot queries for the whole list
+    next_slots = next_slot_by_doctor(doctors)
+    for doctor in doctors:
+        doctor.next_slot = next_slots.get(doctor.id)
+
     return render(
         request,
         "doctors/doctor_list.html",
@@ -181,7 +199,10 @@ def doctor_slots(request):
                 end_time=end_time
             )
             slot.full_clean()
-            slot.save()
+            with transaction.atomic():
+                slot.save()
+                bump_day_stats({(doctor.id, selected_date): {"slots": 1, "free": 1}})
+            invalidate_availability(doctor.id, selected_date)
             messages.success(request, "Slot added successfully")
             return redirect(f"?date={selected_date}")
 
@@ -209,7 +230,7 @@ def doctor_view_reports(request, appointment_id):
         doctor__user=request.user
     )
 
-    reports = appointment.reports.all()  # ✅ related_name works
+    reports = appointment.reports.select_related("blob")
 
     return render(
         request,
@@ -220,3 +241,19 @@ def doctor_view_reports(request, appointment_id):
         }
     )
 
+
+@login_required
+@doctor_required
+def doctor_download_reports(request, appointment_id):
+    appointment = get_object_or_404(
+        Appointment,
+        id=appointment_id,
+        doctor__user=request.user
+    )
+
+    return reports_zip(
+        request,
+        appointment.reports.all(),
+        f"appointment-{appointment.id}-reports.zip"
+    )
+
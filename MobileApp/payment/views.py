@@ -3,7 +3,11 @@ from django.contrib.auth.decorators import login_required
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from django.http import HttpResponseForbidden
+from django.db import transaction
+from django.contrib import messages
 
+from appointments.booking import HoldExpired, confirm_hold, mark_paid
+from core.idempotency import idempotent
 from appointments.models import Appointment
 from .models import Payment
 
@@ -28,7 +32,8 @@ def payment_page(request, appointment_id):
         id=appointment_id,
         user=request.user,
         consultation_type="ONLINE",
-        payment_status="PENDING"
+        payment_status="PENDING",
+        status="BOOKED"
     )
 
     return render(
@@ -62,17 +67,27 @@ def confirm_payment(request, appointment_id):
                 appointment_id=appointment.id
             )
 
-        # ✅ Update appointment
-        appointment.payment_mode = method
-        appointment.payment_status = "PAID"
-        appointment.save()
-
-        # ✅ Create payment record
-        Payment.objects.create(
-            appointment=appointment,
-            amount=appointment.amount,
-            method=method
-        )
+        with transaction.atomic():
+            # ⏳ Slot is only held until hold_expires_at
+            try:
+                confirm_hold(appointment)
+            except HoldExpired:
+                messages.error(
+                    request,
+                    "Your slot hold expired before payment. Please book again."
+                )
+                return redirect("appointments:appointment_history")
+
+            # ✅ Update appointment (a double submit only pays once)
+            if not mark_paid(appointment, payment_mode=method):
+                return redirect("payment:payment_success")
+
+            # ✅ Create payment record
+            Payment.objects.create(
+                appointment=appointment,
+                amount=appointment.amount,
+                method=method
+            )
 
         request.session["last_appointment_id"] = appointment.id
         return redirect("payment:payment_success")
@@ -99,6 +114,7 @@ def payment_success(request):
 # API FLOW (SECURE)
 # ----------------------------
 
+@idempotent
 @api_view(["POST"])
 @login_required
 def make_payment_api(request):
@@ -114,14 +130,26 @@ def make_payment_api(request):
     if appointment.payment_status == "PAID":
         return Response({"message": "Already paid"})
 
-    appointment.payment_mode = method
-    appointment.payment_status = "PAID"
-    appointment.save()
+    with transaction.atomic():
+        try:
+            confirm_hold(appointment)
+        except HoldExpired:
+            # a duplicate request that lost to the one that paid
+            if Appointment.objects.filter(id=appointment.id, payment_status="PAID").exists():
+                return Response({"message": "Already paid"})
+            return Response(
+                {"message": "Slot hold expired, please book again"},
+                status=409
+            )
 
-    Payment.objects.create(
-        appointment=appointment,
-        amount=appointment.amount,
-        method=method
-    )
+        # a concurrent duplicate must not reach the OneToOne Payment insert
+        if not mark_paid(appointment, payment_mode=method):
+            return Response({"message": "Already paid"})
+
+        Payment.objects.create(
+            appointment=appointment,
+            amount=appointment.amount,
+            method=method
+        )
 
     return Response({"message": "Payment successful"})
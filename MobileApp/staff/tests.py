@@ -1,3 +1,144 @@
+import tempfile
+import zipfile
+from io import BytesIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from appointments.availability import free_slots
+from appointments.booking import book_slot
+from appointments.tests import next_weekday
+from doctors.models import Doctor
+from . import views
+
+
+# ------------------------
+# APPOINTMENT CONSOLE
+# ------------------------
+class AppointmentConsoleTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        staff = User.objects.create(username="staff")
+        staff.profile.role = "STAFF"
+        staff.profile.save()
+        self.client.force_login(staff)
+
+        self.patient = User.objects.create(username="9000000001")
+        self.doctors = [
+            Doctor.objects.create(
+                user=User.objects.create(username=f"doctor{i}"),
+                name=f"Doctor {i}",
+                specialization="Cardiology",
+            )
+            for i in range(2)
+        ]
+
+        day = next_weekday()
+        for doctor in self.doctors:
+            for i, slot in enumerate(free_slots(doctor, day)):
+                book_slot(
+                    slot["id"],
+                    consultation_type="CLINIC" if i % 2 else "ONLINE",
+                    user=self.patient,
+                )
+
+    def get_console(self, **params):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse("staff:appointment_console"), params)
+        return response, len(ctx.captured_queries)
+
+    def test_query_count_is_independent_of_page_size(self):
+        _, small = self.get_console(per_page=2)
+        cache.clear()
+        response, large = self.get_console(per_page=20)
+
+        self.assertEqual(small, large)
+        self.assertEqual(len(response.context["appointments"]), 20)
+
+    def test_filters_and_cursor_cover_every_match_once(self):
+        doctor = self.doctors[0]
+        params = {"doctor": doctor.id, "consultation_type": "CLINIC", "per_page": 2}
+
+        seen = []
+        while True:
+            response, _ = self.get_console(**params)
+            seen += [a.id for a in response.context["appointments"]]
+            if not response.context["next_cursor"]:
+                break
+            params["after"] = response.context["next_cursor"]
+
+        expected = doctor.appointment_set.filter(consultation_type="CLINIC")
+        self.assertEqual(sorted(seen), sorted(expected.values_list("id", flat=True)))
+        self.assertEqual(response.context["count"], len(seen))
+
+    def test_count_is_capped(self):
+        with mock.patch.object(views, "CONSOLE_COUNT_CAP", 5):
+            response, _ = self.get_console(**{"from": next_weekday().isoformat()})
+
+        self.assertEqual(response.context["count"], 5)
+        self.assertFalse(response.context["count_exact"])
+
+    def test_doctor_page_keeps_its_date_filter(self):
+        doctor = self.doctors[0]
+        day = next_weekday().isoformat()
+        response = self.client.get(
+            reverse("staff:staff_doctor_appointments", args=[doctor.id]),
+            {"date": day, "sort": "asc"},
+        )
+
+        response = self.client.get(response["Location"])
+        self.assertEqual(
+            response.context["filters"], {"doctor": doctor.id, "from": day, "to": day}
+        )
+        self.assertEqual(response.context["sort"], "asc")
+        self.assertEqual(response.context["count"], doctor.appointment_set.count())
+
+
+# ------------------------
+# PATIENT REPORT EXPORT
+# ------------------------
+class PatientReportExportTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.enterContext(self.settings(MEDIA_ROOT=self.enterContext(tempfile.TemporaryDirectory())))
+        doctor = Doctor.objects.create(
+            user=User.objects.create(username="doctor"),
+            name="Asha Rao",
+            specialization="Cardiology",
+        )
+        slots = free_slots(doctor, next_weekday())
+
+        self.patient = User.objects.create(username="9000000001")
+        other = User.objects.create(username="9000000002")
+        for i, user in enumerate([self.patient, self.patient, other]):
+            appointment = book_slot(slots[i]["id"], consultation_type="CLINIC", user=user)
+            self.client.force_login(user)
+            self.client.post(
+                reverse("appointments:upload_report", args=[appointment.id]),
+                {"reports": SimpleUploadedFile("lab.pdf", f"%PDF-1.7 lab {i}".encode())},
+            )
+        self.url = reverse("staff:staff_patient_reports", args=[self.patient.id])
+
+    def test_one_archive_per_patient_for_staff_only(self):
+        self.assertEqual(self.client.get(self.url).status_code, 302)
+
+        staff = User.objects.create(username="staff")
+        staff.profile.role = "STAFF"
+        staff.profile.save()
+        self.client.force_login(staff)
 
-# Create your tests here.
+        response = self.client.get(self.url)
+        self.assertEqual(
+            response["Content-Disposition"], 'attachment; filename="patient-9000000001-reports.zip"'
+        )
+        archive = zipfile.ZipFile(BytesIO(b"".join(response.streaming_content)))
+        self.assertEqual(
+            sorted(archive.read(name) for name in archive.namelist()),
+            [b"%PDF-1.7 lab 0", b"%PDF-1.7 lab 1"],
+        )
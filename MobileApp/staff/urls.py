@@ -9,6 +9,8 @@ from .views import (
     mark_payment_paid,
     update_appointment_status,
     slots_by_date,   # 🔥 ADD THIS
+    appointment_console,
+    patient_reports_zip,
 )
 
 app_name = "staff"
@@ -18,6 +20,12 @@ urlpatterns = [
 
     path("doctors/", staff_doctors, name="staff_doctors"),
     path("appointments/", staff_appointments, name="staff_appointments"),
+    path("console/", appointment_console, name="appointment_console"),
+    path(
+        "patient/<int:user_id>/reports.zip",
+        patient_reports_zip,
+        name="staff_patient_reports"
+    ),
 
     path(
         "doctor/<int:doctor_id>/appointments/",
@@ -1,12 +1,33 @@
 import json
-from datetime import datetime
+from datetime import date, datetime
+from urllib.parse import urlencode
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
+from django.db import transaction
+from django.http import JsonResponse, Http404
 from django.shortcuts import render, redirect, get_object_or_404
 from django.utils import timezone
 from django.views.decorators.http import require_POST
+from django.urls import reverse
+from django.contrib.auth.models import User
 from doctors.models import Doctor
-from appointments.models import Appointment, TimeSlot
+from appointments.exports import reports_zip
+from appointments.models import (
+    Appointment,
+    AppointmentReport,
+    APPOINTMENT_STATUS_CHOICES,
+    CONSULTATION_TYPE_CHOICES,
+    PAYMENT_STATUS_CHOICES,
+)
+from appointments.availability import cached_free_slots, slot_label
+from appointments.booking import (
+    SlotUnavailable,
+    book_slot,
+    cancel_booking,
+    complete_booking,
+    mark_paid,
+)
+from doctors.day_view import invalidate_doctor_day
+from core.pagination import capped_count, keyset_page
 
 
 # -------------------------
@@ -60,23 +81,19 @@ def book_clinic_appointment(request, doctor_id):
         return JsonResponse({"error": "Unauthorized"}, status=403)
 
     data = json.loads(request.body)
-    slot_id = data.get("slot_id")
-
-    slot = get_object_or_404(TimeSlot, id=slot_id, is_available=True)
-
-    Appointment.objects.create(
-        user=None,  # walk-in
-        doctor=slot.doctor,
-        slot=slot,
-        consultation_type="CLINIC",
-        amount=slot.doctor.consultation_fee,
-        payment_mode="PAY_AT_CLINIC",
-        payment_status="PENDING",
-        status="BOOKED"
-    )
 
-    slot.is_available = False
-    slot.save()
+    try:
+        book_slot(
+            data.get("slot_id"),
+            consultation_type="CLINIC",
+            user=None,  # walk-in
+            booked_by_staff=request.user
+        )
+    except SlotUnavailable:
+        return JsonResponse({
+            "error": "Slot unavailable",
+            "message": "This slot was just booked. Please pick another one."
+        }, status=409)
 
     return JsonResponse({
         "success": True,
@@ -93,26 +110,129 @@ def doctor_appointments(request, doctor_id):
         return redirect("phone_register")
 
     doctor = get_object_or_404(Doctor, id=doctor_id)
-    selected_date = request.GET.get("date")
-    sort = request.GET.get("sort", "desc")
+    params = request.GET.copy()
+    params["doctor"] = doctor.id
+    # old links filter on one ?date=; the console takes a from/to range
+    selected_date = params.pop("date", [""])[-1]
+    if selected_date:
+        params.setdefault("from", selected_date)
+        params.setdefault("to", selected_date)
+    return redirect(f"{reverse('staff:appointment_console')}?{params.urlencode()}")
 
-    appointments = Appointment.objects.filter(doctor=doctor)
 
-    if selected_date:
-        appointments = appointments.filter(slot__date=selected_date)
+# -------------------------
+# APPOINTMENT CONSOLE
+# -------------------------
+CONSOLE_PAGE_SIZE = 25
+CONSOLE_MAX_PAGE_SIZE = 100
+CONSOLE_COUNT_CAP = 1000
+
+CONSOLE_FILTERS = {
+    "status": dict(APPOINTMENT_STATUS_CHOICES),
+    "payment_status": dict(PAYMENT_STATUS_CHOICES),
+    "consultation_type": dict(CONSULTATION_TYPE_CHOICES),
+}
+
+# ?when= filters on the is_past annotation, in SQL
+CONSOLE_WHEN = {"upcoming": False, "past": True}
+
 
-    appointments = appointments.order_by(
-        "created_at" if sort == "asc" else "-created_at"
+@login_required
+def appointment_console(request):
+    """
+    All appointments, newest booking first, filtered by
+    ?doctor= &status= &payment_status= &consultation_type= &from= &to=
+    &when=upcoming|past
+    and paged with ?after=<cursor>. The page query and the capped,
+    cached count are the only appointment queries, whatever the page size.
+    """
+    if not staff_only(request):
+        return redirect("phone_register")
+
+    appointments = Appointment.objects.with_time_flags()
+    filters = {}
+
+    doctor_id = request.GET.get("doctor")
+    if doctor_id and doctor_id.isdigit():
+        appointments = appointments.filter(doctor_id=doctor_id)
+        filters["doctor"] = int(doctor_id)
+
+    for field, choices in CONSOLE_FILTERS.items():
+        value = request.GET.get(field)
+        if value in choices:
+            appointments = appointments.filter(**{field: value})
+            filters[field] = value
+
+    when = request.GET.get("when")
+    if when in CONSOLE_WHEN:
+        appointments = appointments.filter(is_past=CONSOLE_WHEN[when])
+        filters["when"] = when
+
+    for param, lookup in (("from", "date__gte"), ("to", "date__lte")):
+        try:
+            day = date.fromisoformat(request.GET.get(param, ""))
+        except ValueError:
+            continue
+        appointments = appointments.filter(**{lookup: day})
+        filters[param] = day.isoformat()
+
+    try:
+        page_size = min(int(request.GET.get("per_page", CONSOLE_PAGE_SIZE)), CONSOLE_MAX_PAGE_SIZE)
+    except ValueError:
+        page_size = CONSOLE_PAGE_SIZE
+    page_size = max(page_size, 1)
+
+    sort = "asc" if request.GET.get("sort") == "asc" else "desc"
+
+    count, exact = capped_count(
+        appointments,
+        "staff_console:" + urlencode(sorted(filters.items())),
+        cap=CONSOLE_COUNT_CAP
     )
 
-    return render(request, "staff/doctor_appointments.html", {
-        "doctor": doctor,
-        "appointments": appointments,
-        "selected_date": selected_date,
+    page, next_cursor, is_first_page = keyset_page(
+        appointments.select_related("doctor", "user", "booked_by_staff"),
+        request.GET.get("after"),
+        page_size,
+        descending=sort == "desc"
+    )
+
+    query = request.GET.copy()
+    query.pop("after", None)
+
+    return render(request, "staff/appointment_console.html", {
+        "appointments": page,
+        "next_cursor": next_cursor,
+        "is_first_page": is_first_page,
+        "query": query.urlencode(),
+        "filters": filters,
         "sort": sort,
+        "page_size": page_size,
+        "count": count,
+        "count_exact": exact,
+        "doctors": Doctor.objects.filter(is_active=True).only("id", "name").order_by("name"),
+        "status_choices": APPOINTMENT_STATUS_CHOICES,
+        "payment_status_choices": PAYMENT_STATUS_CHOICES,
+        "consultation_type_choices": CONSULTATION_TYPE_CHOICES,
     })
 
 
+# -------------------------
+# PATIENT REPORTS
+# -------------------------
+@login_required
+def patient_reports_zip(request, user_id):
+    if not staff_only(request):
+        return redirect("phone_register")
+
+    patient = get_object_or_404(User, id=user_id)
+    return reports_zip(
+        request,
+        AppointmentReport.objects.filter(appointment__user=patient),
+        f"patient-{patient.username}-reports.zip"
+    )
+
+
 # -------------------------
 # ACTIONS
 @login_required
@@ -125,8 +245,8 @@ def mark_payment_paid(request, id):
 
     # 🔐 SAFETY: Only allow CLINIC payments to be marked paid
     if appointment.consultation_type == "CLINIC":
-        appointment.payment_status = "PAID"
-        appointment.save()
+        with transaction.atomic():
+            mark_paid(appointment)
 
     # 🔥 Redirect back to same page
     return redirect(request.META.get("HTTP_REFERER", "staff:staff_dashboard"))
@@ -139,9 +259,11 @@ def update_appointment_status(request, id):
     appointment = get_object_or_404(Appointment, id=id)
     status = request.POST.get("status")
 
-    if status in ["COMPLETED", "CANCELLED"]:
-        appointment.status = status
-        appointment.save()
+    if status == "CANCELLED":
+        cancel_booking(appointment)
+    elif status == "COMPLETED":
+        complete_booking(appointment)
+        invalidate_doctor_day(appointment.doctor_id, appointment.date)
 
     next_url = request.GET.get("next")
     return redirect(next_url or "staff:staff_dashboard")
@@ -158,18 +280,13 @@ def slots_by_date(request, doctor_id):
     selected_date = datetime.fromisoformat(date_str).date()
     doctor = get_object_or_404(Doctor, id=doctor_id)
 
-    slots = TimeSlot.objects.filter(
-        doctor=doctor,
-        date=selected_date,
-        is_available=True
-    ).order_by("start_time")
-
     return JsonResponse({
         "slots": [
             {
-                "id": s.id,
-                "label": f"{s.start_time.strftime('%I:%M %p')} - {s.end_time.strftime('%I:%M %p')}"
-            } for s in slots
+                "id": s["id"],
+                "start": s["start_time"].strftime("%H:%M"),
+                "label": slot_label(s["start_time"], s["end_time"])
+            } for s in cached_free_slots(doctor, selected_date)
         ]
     })
 
@@ -186,19 +303,16 @@ def staff_appointments(request):
 
 @login_required
 def book_appointment_staff(request, slot_id):
-    slot = get_object_or_404(
-        TimeSlot,
-        id=slot_id,
-        is_available=True
-    )
-
-    Appointment.objects.create(
-        doctor=slot.doctor,
-        slot=slot,
-        booked_by_staff=request.user,   # ✅ STAFF BOOKING
-    )
+    if not staff_only(request):
+        return redirect("phone_register")
 
-    slot.is_available = False
-    slot.save()
+    try:
+        book_slot(
+            slot_id,
+            consultation_type="CLINIC",
+            booked_by_staff=request.user,   # ✅ STAFF BOOKING
+        )
+    except SlotUnavailable:
+        raise Http404("Slot is no longer available")
 
-    return redirect("staff_dashboard")
+    return redirect("staff:staff_dashboard")
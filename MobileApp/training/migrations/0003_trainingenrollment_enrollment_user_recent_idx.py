@@ -0,0 +1,19 @@
+# Generated by Django 6.0 on 2026-10-18 22:20
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('training', '0002_trainingenrollment'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='trainingenrollment',
+            index=models.Index(fields=['user', '-enrolled_at'], name='enrollment_user_recent_idx'),
+        ),
+    ]
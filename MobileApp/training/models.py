@@ -59,6 +59,13 @@ class TrainingEnrollment(models.Model):
 
     class Meta:
         unique_together = ("course", "user")
+        indexes = [
+            # "my trainings", newest first
+            models.Index(
+                fields=["user", "-enrolled_at"],
+                name="enrollment_user_recent_idx",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.full_name} → {self.course.name}"